@@ -11,6 +11,9 @@ from models.token_model import Token
 from models.search_model import Search
 from models.session import Session
 from models.pdf_chunk import PdfChunk
+from models.pdf_document import PdfDocument
+from models.project_document import ProjectDocument
+from models.job_model import Job
 
 # Load .env file
 load_dotenv()
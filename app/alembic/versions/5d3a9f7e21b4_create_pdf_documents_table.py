@@ -0,0 +1,40 @@
+"""Store chat embeddings per document content hash instead of per session
+
+Revision ID: 5d3a9f7e21b4
+Revises: 8b2e61c4d0a7
+Create Date: 2026-10-17 19:20:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = '5d3a9f7e21b4'
+down_revision = '8b2e61c4d0a7'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'pdf_documents',
+        sa.Column('content_hash', sa.String(64), primary_key=True),
+        sa.Column('chunk_count', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('ref_count', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime, server_default=sa.func.now()),
+        sa.Column('last_used_at', sa.DateTime, server_default=sa.func.now())
+    )
+
+    op.add_column('sessions', sa.Column('content_hash', sa.String(64), sa.ForeignKey('pdf_documents.content_hash', ondelete='SET NULL'), nullable=True))
+    op.create_index('ix_sessions_content_hash', 'sessions', ['content_hash'])
+
+    op.add_column('pdf_chunks', sa.Column('content_hash', sa.String(64), sa.ForeignKey('pdf_documents.content_hash', ondelete='CASCADE'), nullable=True))
+    op.create_index('ix_pdf_chunks_content_hash', 'pdf_chunks', ['content_hash'])
+    op.alter_column('pdf_chunks', 'session_id', nullable=True)
+
+def downgrade():
+    op.execute("DELETE FROM pdf_chunks WHERE session_id IS NULL")
+    op.alter_column('pdf_chunks', 'session_id', nullable=False)
+    op.drop_index('ix_pdf_chunks_content_hash', table_name='pdf_chunks')
+    op.drop_column('pdf_chunks', 'content_hash')
+    op.drop_index('ix_sessions_content_hash', table_name='sessions')
+    op.drop_column('sessions', 'content_hash')
+    op.drop_table('pdf_documents')
@@ -0,0 +1,39 @@
+"""Create jobs table for background retrieval and extraction
+
+Revision ID: 8b2e61c4d0a7
+Revises: 3f97d3675926
+Create Date: 2026-10-17 17:05:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+
+revision = '8b2e61c4d0a7'
+down_revision = '3f97d3675926'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'tbl_jobs',
+        sa.Column('job_id', UUID(as_uuid=True), primary_key=True, server_default=sa.text("uuid_generate_v4()")),
+        sa.Column('user_id', UUID(as_uuid=True), sa.ForeignKey('tbl_users.user_id', ondelete='CASCADE'), nullable=False),
+        sa.Column('job_type', sa.String(64), nullable=False),
+        sa.Column('status', sa.String(20), nullable=False, server_default='queued'),
+        sa.Column('payload', JSONB, nullable=False),
+        sa.Column('progress', JSONB, nullable=True),
+        sa.Column('result', JSONB, nullable=True),
+        sa.Column('error', sa.Text, nullable=True),
+        sa.Column('created_at', sa.DateTime, server_default=sa.func.now()),
+        sa.Column('started_at', sa.DateTime, nullable=True),
+        sa.Column('finished_at', sa.DateTime, nullable=True),
+        sa.Column('updated_at', sa.DateTime, server_default=sa.func.now())
+    )
+    op.create_index('ix_tbl_jobs_user_id', 'tbl_jobs', ['user_id'])
+    op.create_index('ix_tbl_jobs_status', 'tbl_jobs', ['status'])
+
+def downgrade():
+    op.drop_index('ix_tbl_jobs_status', table_name='tbl_jobs')
+    op.drop_index('ix_tbl_jobs_user_id', table_name='tbl_jobs')
+    op.drop_table('tbl_jobs')
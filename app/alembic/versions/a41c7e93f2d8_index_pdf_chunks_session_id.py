@@ -0,0 +1,24 @@
+"""Index pdf_chunks.session_id for session-scoped vector search
+
+Revision ID: a41c7e93f2d8
+Revises: 5d3a9f7e21b4
+Create Date: 2026-10-17 20:10:00.000000
+"""
+
+from alembic import op
+
+revision = 'a41c7e93f2d8'
+down_revision = '5d3a9f7e21b4'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_index('ix_pdf_chunks_session_id', 'pdf_chunks', ['session_id'])
+    # Created by the first revision; repeated so databases built without it get one.
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS pdf_chunks_embedding_idx ON pdf_chunks "
+        "USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+    )
+
+def downgrade():
+    op.drop_index('ix_pdf_chunks_session_id', table_name='pdf_chunks')
@@ -0,0 +1,31 @@
+"""Track windowed chat ingestion progress on pdf_documents
+
+Revision ID: c72e4b18d9f5
+Revises: a41c7e93f2d8
+Create Date: 2026-10-17 21:30:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'c72e4b18d9f5'
+down_revision = 'a41c7e93f2d8'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('pdf_documents', sa.Column('source_path', sa.String(512), nullable=True))
+    # Documents indexed before this revision were always complete.
+    op.add_column('pdf_documents', sa.Column('status', sa.String(20), nullable=False, server_default='ready'))
+    op.add_column('pdf_documents', sa.Column('pages_total', sa.Integer, nullable=False, server_default='0'))
+    op.add_column('pdf_documents', sa.Column('pages_indexed', sa.Integer, nullable=False, server_default='0'))
+    op.add_column('pdf_documents', sa.Column('updated_at', sa.DateTime, server_default=sa.func.now()))
+    op.create_index('ix_pdf_documents_status', 'pdf_documents', ['status'])
+
+def downgrade():
+    op.drop_index('ix_pdf_documents_status', table_name='pdf_documents')
+    op.drop_column('pdf_documents', 'updated_at')
+    op.drop_column('pdf_documents', 'pages_indexed')
+    op.drop_column('pdf_documents', 'pages_total')
+    op.drop_column('pdf_documents', 'status')
+    op.drop_column('pdf_documents', 'source_path')
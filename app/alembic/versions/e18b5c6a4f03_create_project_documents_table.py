@@ -0,0 +1,34 @@
+"""Project-scoped chat: documents per project folder and project sessions
+
+Revision ID: e18b5c6a4f03
+Revises: c72e4b18d9f5
+Create Date: 2026-10-17 23:15:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'e18b5c6a4f03'
+down_revision = 'c72e4b18d9f5'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'project_documents',
+        sa.Column('project_path', sa.String(512), primary_key=True),
+        sa.Column('pdf_path', sa.String(512), primary_key=True),
+        sa.Column('content_hash', sa.String(64), sa.ForeignKey('pdf_documents.content_hash', ondelete='CASCADE'), nullable=False),
+        sa.Column('source_md5', sa.String(64), nullable=True),
+        sa.Column('added_at', sa.DateTime, server_default=sa.func.now())
+    )
+    op.create_index('ix_project_documents_content_hash', 'project_documents', ['content_hash'])
+
+    op.add_column('sessions', sa.Column('project_path', sa.String(512), nullable=True))
+    op.create_index('ix_sessions_project_path', 'sessions', ['project_path'])
+
+def downgrade():
+    op.drop_index('ix_sessions_project_path', table_name='sessions')
+    op.drop_column('sessions', 'project_path')
+    op.drop_index('ix_project_documents_content_hash', table_name='project_documents')
+    op.drop_table('project_documents')
@@ -0,0 +1,161 @@
+import os, json, time, sqlite3, hashlib, logging, tempfile, threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+
+load_dotenv(override=True)
+
+
+logger = logging.getLogger("chat_cache")
+
+
+# Two levels: "embedding" maps a normalized question to its query embedding,
+# "answer" maps (document, question, retrieved chunks, model) to the answer.
+# Each level is LRU-bounded by its own entry count. CHAT_CACHE_BACKEND is
+# "sqlite" (shared by the workers on a host) or "memory" (per process).
+CHAT_CACHE_BACKEND = os.getenv("CHAT_CACHE_BACKEND", "sqlite")
+CHAT_CACHE_DB = os.getenv("CHAT_CACHE_DB", os.path.join(tempfile.gettempdir(), "mra_chat_cache.sqlite3"))
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", 10000))
+# A cached query embedding is 1536 floats, about 50KB as a Python list and 30KB
+# as JSON, against well under 1KB for an answer, so that level is kept far
+# smaller: 500 entries come to about 25MB per worker in the memory backend.
+CHAT_CACHE_EMBEDDING_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_EMBEDDING_MAX_ENTRIES", 500))
+LEVEL_MAX_ENTRIES = {"embedding": CHAT_CACHE_EMBEDDING_MAX_ENTRIES, "answer": CHAT_CACHE_MAX_ENTRIES}
+
+
+
+
+class MemoryBackend:
+    def __init__(self, max_entries: dict):
+        self.max_entries = max_entries
+        self._levels = {}
+        self._lock = threading.Lock()
+
+    def get(self, level: str, key: str):
+        with self._lock:
+            entries = self._levels.get(level)
+            if entries is None or key not in entries:
+                return None
+            entries.move_to_end(key)
+            return entries[key]
+
+    def put(self, level: str, key: str, value):
+        with self._lock:
+            entries = self._levels.setdefault(level, OrderedDict())
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries[level]:
+                entries.popitem(last=False)
+
+
+
+
+class SqliteBackend:
+    def __init__(self, path: str, max_entries: dict):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_cache ("
+                "level TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "accessed_at REAL NOT NULL, PRIMARY KEY (level, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_chat_cache_accessed ON chat_cache (level, accessed_at)")
+            self._local.conn = conn
+        return conn
+
+    def get(self, level: str, key: str):
+        conn = self._connection()
+        row = conn.execute("SELECT value FROM chat_cache WHERE level = ? AND key = ?", (level, key)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE chat_cache SET accessed_at = ? WHERE level = ? AND key = ?", (time.time(), level, key))
+        return json.loads(row[0])
+
+    def put(self, level: str, key: str, value):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO chat_cache (level, key, value, accessed_at) VALUES (?, ?, ?, ?)",
+            (level, key, json.dumps(value), time.time())
+        )
+        conn.execute(
+            "DELETE FROM chat_cache WHERE level = ? AND key IN ("
+            "SELECT key FROM chat_cache WHERE level = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (level, level, self.max_entries[level])
+        )
+
+
+BACKENDS = {
+    "memory": lambda: MemoryBackend(LEVEL_MAX_ENTRIES),
+    "sqlite": lambda: SqliteBackend(CHAT_CACHE_DB, LEVEL_MAX_ENTRIES),
+}
+
+_backend = BACKENDS[CHAT_CACHE_BACKEND]()
+
+
+
+
+def normalize_question(query: str) -> str:
+    return " ".join(query.lower().split()).rstrip(" ?!.")
+
+
+
+
+def _digest(*parts) -> str:
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+
+
+def _get(level: str, key: str):
+    try:
+        return _backend.get(level, key)
+    except Exception as e:
+        logger.warning(f"{level} cache lookup failed: {e}")
+        return None
+
+
+
+
+def _put(level: str, key: str, value):
+    try:
+        _backend.put(level, key, value)
+    except Exception as e:
+        logger.warning(f"{level} cache store failed: {e}")
+
+
+
+
+def get_query_embedding(query: str, model: str):
+    return _get("embedding", _digest(model, normalize_question(query)))
+
+
+
+
+def put_query_embedding(query: str, model: str, embedding):
+    _put("embedding", _digest(model, normalize_question(query)), embedding)
+
+
+
+
+def answer_key(document: str, query: str, chunk_ids, model: str) -> str:
+    """Key for an answer: the same question on the same retrieved chunks of the same document."""
+    return _digest(document, normalize_question(query), ",".join(sorted(str(chunk_id) for chunk_id in chunk_ids)), model)
+
+
+
+
+def get_answer(key: str):
+    return _get("answer", key)
+
+
+
+
+def put_answer(key: str, answer: str):
+    _put("answer", key, answer)
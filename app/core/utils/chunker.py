@@ -0,0 +1,314 @@
+import os, re, hashlib, logging, threading
+from collections import Counter, OrderedDict
+import fitz
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")   # tokenizer of text-embedding-3-*
+except Exception:
+    _encoding = None
+
+
+logger = logging.getLogger("chunker")
+
+
+# "structured" follows the PDF's blocks and sections, "fixed" is the old
+# 1000-character slicing. Sizes are in embedding-model tokens.
+CHAT_CHUNKER = os.getenv("CHAT_CHUNKER", "structured")
+CHAT_CHUNK_TOKENS = int(os.getenv("CHAT_CHUNK_TOKENS", "300"))
+CHAT_CHUNK_OVERLAP = int(os.getenv("CHAT_CHUNK_OVERLAP", "50"))
+FIXED_CHUNK_CHARS = 1000
+
+# Blocks inside the top/bottom MARGIN_BAND of a page that repeat (digits
+# ignored) on at least REPEAT_SHARE of the document's pages are running
+# headers or footers.
+MARGIN_BAND = 0.08
+REPEAT_SHARE = 0.3
+
+# A heading is a short line set HEADING_SIZE_RATIO above the body font size,
+# or in bold, or a numbered ("2.", "2.1") or well-known section title. Blocks
+# that are more than NUMERIC_SHARE numbers (table rows) never are.
+HEADING_SIZE_RATIO = 1.15
+NUMERIC_SHARE = 0.5
+# Documents whose header/footer and font profile is kept between windows.
+PROFILE_CACHE_SIZE = 16
+# Text and fonts only; embedded images are not decoded.
+_TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+REFERENCES_HEADING = r"(?m)^\s*(?:\d+\.?\s*)?(?:References|Bibliography|Literature Cited)\s*$"
+# Only a References heading in the back part of a document ends its content;
+# one in a table of contents or an early cross-reference does not.
+REFERENCES_BACK_SHARE = 0.5
+_references = re.compile(REFERENCES_HEADING, re.IGNORECASE)
+_page_number = re.compile(r"^\s*(?:page\s*)?\d+(?:\s*(?:of|/)\s*\d+)?\s*$", re.IGNORECASE)
+_heading = re.compile(r"^(?:\d+(?:\.\d+)*\.?\s+)?[A-Z][^.!?]{0,80}$")
+_numbered_heading = re.compile(r"^(?:\d+\.|\d+(?:\.\d+)+\.?)\s+[A-Z]")
+_section_name = re.compile(
+    r"^(?:\d+(?:\.\d+)*\.?\s+)?(?:abstract|introduction|background|(?:materials|patients|subjects) and methods|"
+    r"methods?|methodology|results|discussion|conclusions?|limitations|acknowledge?ments|funding|"
+    r"references|bibliography)\s*:?$", re.IGNORECASE
+)
+_number = re.compile(r"^[-+±<>=≤≥~]?[\d.,:/%()–-]*\d[\d.,:/%()–-]*$")
+_sentence_end = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\[])")
+
+
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+
+
+def _signature(text: str) -> str:
+    return re.sub(r"\d+", "#", " ".join(text.lower().split()))
+
+
+
+
+def _page_blocks(doc, pages):
+    """
+    Text blocks in reading order as (text, is_margin, page_index, size, bold):
+    whitespace collapsed, size the largest font size in the block, bold
+    whether every span is set in bold.
+    """
+    blocks = []
+    for page in (doc[i] for i in pages):
+        height = page.rect.height or 1
+        for block in page.get_text("dict", sort=True, flags=_TEXT_FLAGS)["blocks"]:
+            if block["type"] != 0:
+                continue
+            spans = [span for line in block["lines"] for span in line["spans"] if span["text"].strip()]
+            text = " ".join(" ".join("".join(span["text"] for span in line["spans"]) for line in block["lines"]).split())
+            if not spans or not text:
+                continue
+            x0, y0, x1, y1 = block["bbox"]
+            is_margin = y1 <= height * MARGIN_BAND or y0 >= height * (1 - MARGIN_BAND)
+            size = max(span["size"] for span in spans)
+            bold = all(span["flags"] & fitz.TEXT_FONT_BOLD or "bold" in span["font"].lower() for span in spans)
+            blocks.append((text, is_margin, page.number, size, bold))
+    return blocks
+
+
+
+
+def document_profile(doc):
+    """
+    (signatures of running headers/footers, body font size) of the whole
+    document, so a window of a few pages is cleaned as the full text would be.
+    The body size is the size most characters are set in.
+    """
+    pages_with, sizes = Counter(), Counter()
+    blocks = _page_blocks(doc, range(doc.page_count))
+    for signature, page_index in {(_signature(text), page_index) for text, is_margin, page_index, _, _ in blocks if is_margin}:
+        pages_with[signature] += 1
+    for text, is_margin, _, size, _ in blocks:
+        if not is_margin:
+            sizes[round(size, 1)] += len(text)
+    repeat_min = max(2, REPEAT_SHARE * doc.page_count)
+    repeated = {signature for signature, count in pages_with.items() if count >= repeat_min}
+    body_size = max(sizes, key=sizes.get) if sizes else 0
+    return repeated, body_size
+
+
+
+
+_profiles = OrderedDict()
+_profiles_lock = threading.Lock()
+
+
+def _cached_profile(pdf_bytes: bytes, doc):
+    """document_profile, computed once per document content for its windows."""
+    key = hashlib.sha256(pdf_bytes).digest()
+    with _profiles_lock:
+        if key in _profiles:
+            _profiles.move_to_end(key)
+            return _profiles[key]
+    profile = document_profile(doc)
+    with _profiles_lock:
+        _profiles[key] = profile
+        while len(_profiles) > PROFILE_CACHE_SIZE:
+            _profiles.popitem(last=False)
+    return profile
+
+
+
+
+def _in_back_part(doc, page_index: int) -> bool:
+    return page_index >= int(doc.page_count * REFERENCES_BACK_SHARE)
+
+
+
+
+def _body_blocks(doc, pages, repeated):
+    """
+    Blocks as (text, size, bold), minus running headers/footers (margin blocks
+    whose signature is in `repeated`) and page numbers. When the last of
+    `pages` is in the back part of the document and holds a References
+    heading, it is cut at its last such heading (see content_pages).
+    """
+    body = [
+        (text, page_index, size, bold) for text, is_margin, page_index, size, bold in _page_blocks(doc, pages)
+        if not (is_margin and (_page_number.match(text) or _signature(text) in repeated))
+    ]
+    last_page = max(pages, default=None)
+    if last_page is not None and _in_back_part(doc, last_page):
+        headings = [i for i, (text, page_index, _, _) in enumerate(body) if page_index == last_page and _references.search(text)]
+        if headings:
+            body = body[:headings[-1]]
+    return [(text, size, bold) for text, _, size, bold in body]
+
+
+
+
+def _mostly_numbers(text: str) -> bool:
+    """True for table rows like "Treatment 45 55 100"; a leading section number does not count."""
+    words = re.sub(r"^\d+(?:\.\d+)*\.?\s+", "", text).split()
+    return sum(1 for word in words if _number.match(word)) > NUMERIC_SHARE * len(words)
+
+
+
+
+def _is_heading(text: str, size: float, bold: bool, body_size: float) -> bool:
+    if len(text.split()) > 12 or _mostly_numbers(text):
+        return False
+    if _section_name.match(text):
+        return True
+    if not _heading.match(text):
+        return False
+    return bool(_numbered_heading.match(text)) or bold or (body_size > 0 and size >= body_size * HEADING_SIZE_RATIO)
+
+
+
+
+def _split_long(block: str, max_tokens: int):
+    """Split a block bigger than max_tokens at sentence ends, then hard by size."""
+    pieces = []
+    for sentence in _sentence_end.split(block):
+        if count_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        words, current = sentence.split(), []
+        for word in words:
+            if current and count_tokens(" ".join(current + [word])) > max_tokens:
+                pieces.append(" ".join(current))
+                current = []
+            current.append(word)
+        if current:
+            pieces.append(" ".join(current))
+    return pieces
+
+
+
+
+def _overlap_tail(text: str, overlap_tokens: int) -> str:
+    """Trailing whole sentences of text that fit in overlap_tokens."""
+    tail = []
+    for sentence in reversed(_sentence_end.split(text)):
+        if count_tokens(" ".join([sentence] + tail)) > overlap_tokens:
+            break
+        tail.insert(0, sentence)
+    return " ".join(tail)
+
+
+
+
+def chunk_structured(doc, pages, max_tokens=CHAT_CHUNK_TOKENS, overlap_tokens=CHAT_CHUNK_OVERLAP, profile=None):
+    """
+    Pack whole blocks (paragraphs, table rows, captions) into chunks of up to
+    max_tokens. A section heading always starts a new chunk, and within a
+    section each chunk repeats the last overlap_tokens worth of sentences of
+    the previous one. `profile` is the document_profile of doc, computed here
+    when not given.
+    """
+    repeated, body_size = profile or document_profile(doc)
+    chunks, current, current_tokens = [], [], 0
+
+    def flush(keep_overlap):
+        nonlocal current, current_tokens
+        if not current:
+            return
+        chunk = "\n".join(current)
+        chunks.append(chunk)
+        tail = _overlap_tail(chunk, overlap_tokens) if keep_overlap and overlap_tokens else ""
+        current = [tail] if tail else []
+        current_tokens = count_tokens(tail) if tail else 0
+
+    for block, size, bold in _body_blocks(doc, pages, repeated):
+        if _is_heading(block, size, bold, body_size):
+            flush(keep_overlap=False)
+        for piece in ([block] if count_tokens(block) <= max_tokens else _split_long(block, max_tokens)):
+            piece_tokens = count_tokens(piece)
+            if current and current_tokens + piece_tokens > max_tokens:
+                flush(keep_overlap=True)
+                if current_tokens + piece_tokens > max_tokens:
+                    current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    # A trailing overlap-only chunk adds nothing new.
+    if current and (not chunks or "\n".join(current) not in chunks[-1]):
+        flush(keep_overlap=False)
+    return chunks
+
+
+
+
+def chunk_fixed(doc, pages, chunk_size=FIXED_CHUNK_CHARS):
+    text = "".join(doc[i].get_text() + "\n" for i in pages)
+    chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+CHUNKERS = {
+    "structured": chunk_structured,
+    "fixed": chunk_fixed,
+}
+
+
+
+
+def _content_page_count(doc, strategy: str) -> int:
+    if strategy == "structured":
+        for page_index in range(doc.page_count - 1, -1, -1):
+            if not _in_back_part(doc, page_index):
+                break
+            if _references.search(doc[page_index].get_text()):
+                return page_index + 1
+    return doc.page_count
+
+
+
+
+def chunk_pdf(pdf_bytes: bytes, strategy: str = None, pages=None):
+    """
+    Split a PDF, or only the 0-based page indices in `pages`, into chat chunks
+    with the named strategy (default CHAT_CHUNKER).
+    """
+    strategy = strategy or CHAT_CHUNKER
+    if strategy not in CHUNKERS:
+        raise ValueError(f"Unknown chunker '{strategy}', expected one of: {', '.join(CHUNKERS)}")
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        pages = list(range(_content_page_count(doc, strategy))) if pages is None else list(pages)
+        if strategy == "structured":
+            return chunk_structured(doc, pages, profile=_cached_profile(pdf_bytes, doc))
+        return CHUNKERS[strategy](doc, pages)
+    finally:
+        doc.close()
+
+
+
+
+def content_pages(pdf_bytes: bytes, strategy: str = None) -> int:
+    """
+    Number of leading pages worth chunking: for the structured strategy, pages
+    after the last one in the back part of the document holding a References
+    heading are left out.
+    """
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return _content_page_count(doc, strategy or CHAT_CHUNKER)
+    finally:
+        doc.close()
@@ -6,7 +6,7 @@ from io import BytesIO
 from fastapi.responses import StreamingResponse
 from datetime import timedelta
 from core.settings import BASE_DIR
-import os, re
+import os, re, hashlib
 from google.api_core.exceptions import NotFound, GoogleAPIError
 from google.api_core.exceptions import NotFound as GCPNotFound
 from typing import Dict
@@ -27,6 +27,12 @@ BUCKET_NAME = GCP_BUCKET_NAME
 bucket = client.bucket(BUCKET_NAME)
 
 
+# Content-addressed store shared by every user/project (see shared_pdf_key).
+SHARED_PDF_PREFIX = "shared/pdfs/"
+# A PDF's header must start within its first KiB.
+PDF_HEADER_WINDOW = 1024
+
+
 
 
 def create_folder(folder_name: str, description: str):
@@ -105,9 +111,7 @@ def upload_text_file(path:str, file:str):
 
 
 
-def upload_image_file(file: UploadFile, extention:str):
-    path = f"{file}"
-    blob = bucket.blob(path)
+def _image_content_type(extention: str) -> str:
     content_type = ""
     if extention == "png":
         content_type = "image/png"
@@ -115,6 +119,15 @@ def upload_image_file(file: UploadFile, extention:str):
         content_type = "image/jpeg"
     elif extention == "jpg":
         content_type = "image/jpg"
+    return content_type
+
+
+
+
+def upload_image_file(file: UploadFile, extention:str):
+    path = f"{file}"
+    blob = bucket.blob(path)
+    content_type = _image_content_type(extention)
 
     with open(path, 'rb') as file_data:
         blob.upload_from_file(file_data, content_type=content_type)
@@ -123,6 +136,21 @@ def upload_image_file(file: UploadFile, extention:str):
 
 
 
+def upload_image_bytes(path: str, img_bytes: bytes, extention: str):
+    """Upload image bytes held in memory, without a local copy on this host."""
+    blob = bucket.blob(path)
+    blob.upload_from_string(img_bytes, content_type=_image_content_type(extention))
+    return {"message": f"File '{path}' uploaded."}
+
+
+
+
+def blob_exists(path: str) -> bool:
+    return bucket.blob(path.replace("\\", "/")).exists()
+
+
+
+
 def download_pdf_file(path: str):
     blob = bucket.blob(path)
 
@@ -140,6 +168,16 @@ def download_pdf_file(path: str):
 
 
 
+def download_file_bytes(path: str) -> bytes:
+    blob = bucket.blob(path.replace("\\", "/"))
+
+    if not blob.exists():
+        raise HTTPException(status_code=404, detail="File not found.")
+    return blob.download_as_bytes()
+
+
+
+
 def generate_presigned_url(blob_name: str, expiration: timedelta = timedelta(minutes=15)):
     bucket = client.get_bucket(BUCKET_NAME) 
     blob = bucket.blob(blob_name)
@@ -493,6 +531,19 @@ async def list_files_in_folder(prefix: str) -> List[str]:
 
 
 
+def list_pdf_blobs(prefix: str) -> Dict[str, str]:
+    """PDF blob names under prefix mapped to their MD5 (None for composite objects), without downloading them."""
+    if not prefix.endswith("/"):
+        prefix += "/"
+    return {
+        blob.name: blob.md5_hash
+        for blob in bucket.list_blobs(prefix=prefix)
+        if blob.name.lower().endswith(".pdf")
+    }
+
+
+
+
 async def download_text_file(blob_name: str) -> str:
     """
     Download a .txt metadata file as string.
@@ -531,4 +582,75 @@ def upload_pdf_from_bytes(gcp_path: str, pdf_bytes: bytes):
     blob = bucket.blob(gcp_path)
     blob.upload_from_string(pdf_bytes, content_type='application/pdf')
     print(f"[GCP] PDF uploaded (bytes): {gcp_path}")
-    return {"message": f"File '{gcp_path}' uploaded successfully."}
\ No newline at end of file
+    return {"message": f"File '{gcp_path}' uploaded successfully."}
+
+
+
+def open_pdf_writer(gcp_path: str, chunk_size: int = 4 * 256 * 1024):
+    """
+    Open a writable stream onto a GCP blob so a PDF can be uploaded
+    chunk by chunk without ever touching local disk.
+    Call .close() to finalize the upload.
+    """
+    gcp_path = gcp_path.replace("\\", "/")
+    blob = bucket.blob(gcp_path)
+    return blob.open("wb", content_type='application/pdf', chunk_size=chunk_size)
+
+
+
+
+
+# ---------------------------------------------------------------------------
+# Shared PDF store
+#
+# A PDF fetched once is kept under shared/pdfs/<sha256 of its article id>.pdf.
+# Project folders get a server-side copy of that blob, so a repeat fetch skips
+# both the publisher download and the upload from this host. Only bodies that
+# carry a PDF header are stored, so a login or paywall page is never shared.
+# ---------------------------------------------------------------------------
+
+def looks_like_pdf(head: bytes) -> bool:
+    """True when the first bytes of a body carry a PDF header."""
+    return b"%PDF-" in head[:PDF_HEADER_WINDOW]
+
+
+
+
+def shared_pdf_key(kind: str, value: str) -> str:
+    """
+    Blob path for an article in the shared store.
+    kind is the id namespace ("pmcid", "doi", "url"), value the id itself.
+    """
+    canonical = f"{kind}:{value.strip().lower()}"
+    return f"{SHARED_PDF_PREFIX}{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}.pdf"
+
+
+
+
+def link_shared_pdf(shared_key: str, gcp_path: str) -> bool:
+    """
+    Copy a stored PDF into a project folder. Returns False when the article is
+    not in the shared store yet, in which case the caller should download it.
+    """
+    gcp_path = gcp_path.replace("\\", "/")
+    # The copy itself tells whether the blob exists, so a miss costs one request.
+    try:
+        bucket.copy_blob(bucket.blob(shared_key), bucket, gcp_path)
+    except NotFound:
+        return False
+    print(f"[GCP] PDF linked from shared store: {gcp_path}")
+    return True
+
+
+
+
+def store_shared_pdf(shared_key: str, pdf_bytes: bytes, gcp_path: str):
+    """Upload PDF bytes once into the shared store, then link them into gcp_path."""
+    if not looks_like_pdf(pdf_bytes):
+        raise ValueError("response is not a PDF")
+    upload_pdf_from_bytes(shared_key, pdf_bytes)
+    if not link_shared_pdf(shared_key, gcp_path):
+        # The shared copy vanished between upload and copy; write the project copy directly.
+        logging.warning(f"[GCP] Linking {shared_key} failed, uploading {gcp_path} directly")
+        upload_pdf_from_bytes(gcp_path, pdf_bytes)
+    return {"message": f"File '{gcp_path}' uploaded successfully."}
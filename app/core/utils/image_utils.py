@@ -0,0 +1,151 @@
+import os, sqlite3, hashlib, logging, tempfile, threading
+import fitz
+
+
+logger = logging.getLogger("image_utils")
+
+
+# Embedded images smaller than IMAGE_MIN_SIDE px on either side, or more
+# elongated than IMAGE_MAX_ASPECT, are treated as decoration (rules, bullets,
+# banners) and not extracted.
+IMAGE_MIN_SIDE = int(os.getenv("IMAGE_MIN_SIDE", "64"))
+IMAGE_MAX_ASPECT = float(os.getenv("IMAGE_MAX_ASPECT", "8"))
+
+# An image is stored once per project: a later image with the exact same bytes
+# reuses the stored copy. Perceptual matching (hashes within IMAGE_HASH_DISTANCE
+# of 64 bits, same size in pixels) only applies within one document, where a
+# figure re-embedded at another quality is the same figure; across papers
+# sparse plots and near-blank figures collide too easily.
+IMAGE_HASH_DISTANCE = int(os.getenv("IMAGE_HASH_DISTANCE", "4"))
+IMAGE_HASH_INDEX = os.getenv("IMAGE_HASH_INDEX", os.path.join(tempfile.gettempdir(), "mra_image_hashes.sqlite3"))
+
+
+_local = threading.local()
+_claim_lock = threading.Lock()
+
+
+
+
+def _connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(IMAGE_HASH_INDEX, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS image_claims ("
+            "scope TEXT NOT NULL, path TEXT NOT NULL, digest TEXT NOT NULL, phash TEXT, "
+            "width INTEGER NOT NULL, height INTEGER NOT NULL, PRIMARY KEY (scope, path))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_image_claims_digest ON image_claims (scope, digest)")
+        _local.conn = conn
+    return conn
+
+
+
+
+def is_decorative(width: int, height: int) -> bool:
+    if min(width, height) < IMAGE_MIN_SIDE:
+        return True
+    return max(width, height) / max(min(width, height), 1) > IMAGE_MAX_ASPECT
+
+
+
+
+def perceptual_hash(img_bytes: bytes):
+    """
+    64-bit difference hash (dHash) of an image as 16 hex chars: the image is
+    reduced to 9x8 grayscale and each bit says whether a pixel is brighter than
+    its right neighbour. Returns None for formats PyMuPDF cannot decode.
+    """
+    try:
+        pix = fitz.Pixmap(img_bytes)
+        if pix.alpha:
+            pix = fitz.Pixmap(pix, 0)
+        if pix.colorspace is None or pix.colorspace.n != 1:
+            pix = fitz.Pixmap(fitz.csGRAY, pix)
+        samples = fitz.Pixmap(pix, 9, 8, None).samples
+    except Exception as e:
+        logger.debug(f"perceptual hash failed: {e}")
+        return None
+
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (samples[row * 9 + col] > samples[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+
+
+def content_digest(img_bytes: bytes) -> str:
+    return hashlib.sha256(img_bytes).hexdigest()
+
+
+
+
+def _find_copy(conn, scope, digest, phash, width, height, path):
+    row = conn.execute(
+        "SELECT path FROM image_claims WHERE scope = ? AND digest = ? LIMIT 1", (scope, digest)
+    ).fetchone()
+    if row is not None:
+        return row[0]
+    if phash is None:
+        return None
+    document = os.path.dirname(path)
+    value = int(phash, 16)
+    for known, known_path in conn.execute(
+        "SELECT phash, path FROM image_claims WHERE scope = ? AND width = ? AND height = ? AND phash IS NOT NULL",
+        (scope, width, height)
+    ):
+        if os.path.dirname(known_path) == document and bin(value ^ int(known, 16)).count("1") <= IMAGE_HASH_DISTANCE:
+            return known_path
+    return None
+
+
+
+
+def claim_image(scope: str, path: str, digest: str, phash, width: int, height: int) -> str:
+    """
+    Register `path` as the stored copy of an image in `scope` (a project folder)
+    unless a copy is already registered there: the same bytes anywhere in the
+    project, or a near-identical image of the same size in the same document.
+    Returns the path to use: the existing copy, otherwise `path` itself. The
+    caller should check that an existing copy is still in the bucket, and
+    release_image it if not.
+    """
+    with _claim_lock:
+        conn = _connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            known_path = _find_copy(conn, scope, digest, phash, width, height, path)
+            if known_path is not None and known_path != path:
+                conn.execute("COMMIT")
+                return known_path
+            # Re-extracting a document overwrites its blobs, so an old claim on this path is void.
+            conn.execute(
+                "INSERT OR REPLACE INTO image_claims (scope, path, digest, phash, width, height) VALUES (?, ?, ?, ?, ?, ?)",
+                (scope, path, digest, phash, width, height)
+            )
+            conn.execute("COMMIT")
+            return path
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+
+
+def release_image(scope: str, path: str):
+    """Forget a claim whose upload failed or whose blob is gone, so the next occurrence uploads again."""
+    _connection().execute("DELETE FROM image_claims WHERE scope = ? AND path = ?", (scope, path))
+
+
+
+
+def release_images(prefix: str):
+    """Forget every claim on blobs under prefix, e.g. a deleted project folder."""
+    prefix = prefix.rstrip("/") + "/"
+    _connection().execute(
+        "DELETE FROM image_claims WHERE substr(path, 1, ?) = ? OR substr(scope || '/', 1, ?) = ?",
+        (len(prefix), prefix, len(prefix), prefix)
+    )
@@ -0,0 +1,97 @@
+import os, math, logging
+from core.utils.progress import report_progress
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+logger = logging.getLogger("paginator")
+
+
+PAGINATOR_MAX_IN_FLIGHT = int(os.getenv("PAGINATOR_MAX_IN_FLIGHT", "4"))
+PAGINATOR_MAX_PAGES = int(os.getenv("PAGINATOR_MAX_PAGES", "20"))
+
+
+
+
+def collect_pages(fetch_page, max_results, max_in_flight=PAGINATOR_MAX_IN_FLIGHT, max_pages=PAGINATOR_MAX_PAGES, source=None):
+    """
+    Fetch result pages concurrently until `max_results` PDF links are collected.
+
+    `fetch_page(page)` takes a 0-based page number and returns
+    (links, metadatas, has_more). The first page is fetched alone; after that
+    the number of pages in flight is sized from the PDF hits seen per page so
+    far, capped at `max_in_flight`. Rate limiting is left to `fetch_page`.
+    Pages are stitched back together in page order. Once the quota is filled,
+    pages not yet started are cancelled; fetches already running in a worker
+    thread cannot be interrupted and finish in the background, their results
+    discarded.
+
+    At most `max_pages` pages are read. When that cap ends the search before
+    the quota is filled and the source still had more results, a warning is
+    logged and reported through report_progress(truncated=True).
+    """
+    pages = {}
+    has_more_after = {}
+    last_page = max_pages - 1
+    next_page = 0
+    in_flight = {}
+
+    def assemble():
+        links, metadatas = [], []
+        page = 0
+        while page in pages and page <= last_page:
+            links.extend(pages[page][0])
+            metadatas.extend(pages[page][1])
+            page += 1
+        complete = page > last_page
+        return links, metadatas, complete
+
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    try:
+        while True:
+            links, metadatas, complete = assemble()
+            if len(links) >= max_results or complete:
+                break
+
+            if pages:
+                hits = sum(len(p[0]) for p in pages.values())
+                per_page = max(hits / len(pages), 0.5)
+                remaining = max_results - hits - len(in_flight) * per_page
+                wanted = math.ceil(remaining / per_page) if remaining > 0 else 0
+            else:
+                wanted = 1 - len(in_flight)
+
+            wanted = min(wanted, max_in_flight - len(in_flight), last_page + 1 - next_page)
+            if not in_flight and wanted <= 0:
+                # Nothing pending and the estimate asks for nothing: fetch one
+                # more page so the loop keeps making progress.
+                wanted = 1 if next_page <= last_page else 0
+                if not wanted:
+                    break
+
+            for _ in range(max(wanted, 0)):
+                in_flight[executor.submit(fetch_page, next_page)] = next_page
+                next_page += 1
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                page = in_flight.pop(future)
+                try:
+                    page_links, page_metadatas, has_more = future.result()
+                except Exception as e:
+                    logger.error(f"page {page} failed: {e}")
+                    page_links, page_metadatas, has_more = [], [], False
+                pages[page] = (page_links, page_metadatas)
+                has_more_after[page] = has_more
+                if not has_more:
+                    last_page = min(last_page, page)
+
+        logger.debug(f"collected {len(links)} links from {len(pages)} pages, cancelling {len(in_flight)}")
+        if len(links) < max_results and last_page == max_pages - 1 and has_more_after.get(last_page):
+            logger.warning(f"{source}: stopped at the {max_pages}-page cap with {len(links)} of {max_results} links")
+            report_progress(stage="searching", source=source, truncated=True, max_pages=max_pages,
+                            collected=len(links), requested=max_results)
+        return links[:max_results], metadatas[:max_results]
+    finally:
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -89,3 +89,112 @@ def process_pdfs(s3_pdf_path):
     results.append((result_section))
     return results
 
+
+
+
+
+
+TABLE_CANDIDATE_THRESHOLD = float(os.getenv("TABLE_CANDIDATE_THRESHOLD", "0.3"))
+_TABLE_CAPTION = re.compile(r'^\s*table\s+([0-9]+|[IVX]+)\b', re.IGNORECASE | re.MULTILINE)
+
+
+
+
+def _count_ruling_lines(page):
+    """Count horizontal and vertical rules drawn on the page (lines and hairline rects)."""
+    horizontal = vertical = 0
+    for drawing in page.get_drawings():
+        for item in drawing["items"]:
+            if item[0] == "l":
+                p1, p2 = item[1], item[2]
+                width, height = abs(p1.x - p2.x), abs(p1.y - p2.y)
+            elif item[0] == "re":
+                width, height = item[1].width, item[1].height
+            else:
+                continue
+            if height < 2 and width > 20:
+                horizontal += 1
+            elif width < 2 and height > 10:
+                vertical += 1
+    return horizontal, vertical
+
+
+
+
+def _count_columnar_lines(page, gap=15):
+    """Count text lines split into 3+ runs by wide horizontal gaps, as table rows are."""
+    lines = {}
+    for x0, y0, x1, y1, word, block_no, line_no, word_no in page.get_text("words"):
+        lines.setdefault((round(y0), round(y1)), []).append((x0, x1))
+
+    columnar = 0
+    for words in lines.values():
+        words.sort()
+        runs = 1 + sum(1 for (_, prev_x1), (x0, _) in zip(words, words[1:]) if x0 - prev_x1 > gap)
+        if runs >= 3:
+            columnar += 1
+    return columnar
+
+
+
+
+def table_scan(page):
+    """
+    Cheap 0..1 score of how likely a page holds a table, from PyMuPDF's table
+    finder, ruling-line density, "Table N" captions and column-aligned text.
+    Pages without a text layer (scans) score 1.0: only the vision model can tell.
+    Returns (score, TableFinder or None) so the native engine can reuse the
+    finder instead of running it a second time.
+    """
+    text = page.get_text("text")
+    if len(text.strip()) < 20:
+        return 1.0, None
+
+    score = 0.0
+    if _TABLE_CAPTION.search(text):
+        score += 0.3
+
+    try:
+        found = page.find_tables()
+    except Exception:
+        found = None
+    if found is not None and found.tables:
+        score += 0.6
+
+    horizontal, vertical = _count_ruling_lines(page)
+    if horizontal >= 3:
+        score += 0.3
+    if vertical >= 2:
+        score += 0.1
+
+    if _count_columnar_lines(page) >= 5:
+        score += 0.3
+
+    return min(score, 1.0), found
+
+
+
+
+def table_likelihood(page) -> float:
+    return table_scan(page)[0]
+
+
+
+
+def find_table_candidate_pages(pdf_bytes, threshold=TABLE_CANDIDATE_THRESHOLD, on_candidate=None):
+    """
+    Return the 1-based numbers of pages worth sending to table extraction, and the page count.
+    on_candidate(page, finder), if given, is called for each candidate while its page is open.
+    """
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        candidates = []
+        for page in doc:
+            score, found = table_scan(page)
+            if score >= threshold:
+                candidates.append(page.number + 1)
+                if on_candidate is not None:
+                    on_candidate(page, found)
+        return candidates, doc.page_count
+    finally:
+        doc.close()
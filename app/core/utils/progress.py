@@ -0,0 +1,83 @@
+import logging, threading, contextvars
+from contextlib import contextmanager
+
+
+logger = logging.getLogger("progress")
+
+
+# Whoever runs a long task (the job worker, a streaming endpoint) installs a
+# sink; services just call report_progress() / report_article() and never need
+# to know who listens. The sink is callback(kind, fields) with kind "progress"
+# for aggregate counters and "article" for per-article events.
+_sink = contextvars.ContextVar("progress_sink", default=None)
+# Cancel events of this context and the ones enclosing it; any of them stops the work.
+_cancel = contextvars.ContextVar("progress_cancel", default=())
+
+
+
+
+@contextmanager
+def progress_sink(callback, cancel_event: threading.Event = None):
+    """
+    Send every report made in this context to callback(kind, fields).
+    Setting cancel_event asks services that check is_cancelled() to stop early.
+    """
+    sink_token = _sink.set(callback)
+    cancel_token = _cancel.set(_cancel.get() + ((cancel_event,) if cancel_event is not None else ()))
+    try:
+        yield
+    finally:
+        _cancel.reset(cancel_token)
+        _sink.reset(sink_token)
+
+
+
+
+def _emit(kind: str, fields: dict):
+    sink = _sink.get()
+    if sink is None:
+        return
+    try:
+        sink(kind, fields)
+    except Exception as e:
+        logger.warning(f"progress sink failed: {e}")
+
+
+
+
+def report_progress(**fields):
+    """Report progress of the current task; a no-op when nobody is listening."""
+    _emit("progress", fields)
+
+
+
+
+def report_article(event: str, **fields):
+    """
+    Report one article's state: found, downloaded, uploaded, skipped_403 or failed.
+    A no-op when nobody is listening.
+    """
+    _emit("article", {"event": event, **fields})
+
+
+
+
+@contextmanager
+def cancel_scope():
+    """
+    Yield a cancel event for the work started in this context, keeping the
+    current sink. Setting it stops only this work; an enclosing cancel still
+    reaches it.
+    """
+    cancel_event = threading.Event()
+    token = _cancel.set(_cancel.get() + (cancel_event,))
+    try:
+        yield cancel_event
+    finally:
+        _cancel.reset(token)
+
+
+
+
+def is_cancelled() -> bool:
+    return any(cancel_event.is_set() for cancel_event in _cancel.get())
@@ -0,0 +1,128 @@
+import os, time, sqlite3, asyncio, logging, tempfile, threading
+from dotenv import load_dotenv
+
+
+load_dotenv(override=True)
+
+
+logger = logging.getLogger("rate_limiter")
+
+
+# Token buckets live in one SQLite file so every gunicorn/uvicorn worker on the
+# host draws from the same quota. Point RATE_LIMIT_DB at a shared path to change it.
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "mra_rate_limits.sqlite3"))
+
+
+def _bucket(name: str, rate: float, burst: int) -> dict:
+    """Bucket settings, overridable with RATE_LIMIT_<NAME>_RATE / RATE_LIMIT_<NAME>_BURST."""
+    prefix = f"RATE_LIMIT_{name.upper()}"
+    return {
+        "rate": float(os.getenv(f"{prefix}_RATE", rate)),
+        "burst": int(os.getenv(f"{prefix}_BURST", burst)),
+    }
+
+
+_NCBI_HAS_KEY = os.getenv("PUBMED_NCBI_API_KEY") not in (None, "", "YOUR_NCBI_API_KEY_HERE")
+
+# rate = requests per second, burst = requests allowed back-to-back after idling
+BUCKETS = {
+    "semantic_scholar_key": _bucket("semantic_scholar_key", 1.0, 1),
+    "semantic_scholar_public": _bucket("semantic_scholar_public", 1.0, 1),
+    "ncbi_eutils": _bucket("ncbi_eutils", 10.0 if _NCBI_HAS_KEY else 3.0, 10 if _NCBI_HAS_KEY else 3),
+    "serpapi": _bucket("serpapi", 5.0, 5),
+    # Costs are embedding tokens, not requests: a tokens-per-minute budget.
+    "openai_embeddings": _bucket("openai_embeddings", 1_000_000 / 60, 1_000_000),
+}
+
+
+_local = threading.local()
+
+
+
+
+def _connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(RATE_LIMIT_DB, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        _local.conn = conn
+    return conn
+
+
+
+
+def _update(name: str, change) -> float:
+    """
+    Refill bucket `name` up to now, apply `change(tokens, rate)` and store the result.
+    Runs under an IMMEDIATE transaction, so workers update the bucket one at a time.
+    Returns the new token count.
+    """
+    config = BUCKETS[name]
+    conn = _connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        now = time.time()
+        row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            tokens = float(config["burst"])
+        else:
+            tokens = min(float(config["burst"]), row[0] + (now - row[1]) * config["rate"])
+
+        tokens = change(tokens, config["rate"])
+        conn.execute(
+            "INSERT INTO buckets (name, tokens, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+            (name, tokens, now)
+        )
+        conn.execute("COMMIT")
+        return tokens
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+
+
+def reserve(name: str, cost: float = 1.0) -> float:
+    """
+    Take `cost` tokens from bucket `name` and return how many seconds the caller must
+    wait before sending its request. The token count may go negative, which queues
+    later callers behind this one instead of letting them race for the next token.
+    """
+    tokens = _update(name, lambda tokens, rate: tokens - cost)
+    return max(0.0, -tokens / BUCKETS[name]["rate"])
+
+
+
+
+def acquire(name: str, cost: float = 1.0):
+    """Blocking acquire, for code that already runs in a worker thread."""
+    wait = reserve(name, cost)
+    if wait > 0:
+        logger.debug(f"[{name}] rate-limit wait {wait:.2f}s")
+        time.sleep(wait)
+
+
+
+
+async def acquire_async(name: str, cost: float = 1.0):
+    """Non-blocking acquire for coroutines running on the event loop."""
+    wait = await asyncio.to_thread(reserve, name, cost)
+    if wait > 0:
+        logger.debug(f"[{name}] rate-limit wait {wait:.2f}s")
+        await asyncio.sleep(wait)
+
+
+
+
+def penalize(name: str, seconds: float):
+    """
+    Drain bucket `name` so nobody, in any worker, sends for `seconds`.
+    Call this when the upstream answers 429.
+    """
+    logger.warning(f"[{name}] upstream throttled us – pausing bucket for {seconds:.1f}s")
+    _update(name, lambda tokens, rate: min(tokens, 0.0) - seconds * rate)
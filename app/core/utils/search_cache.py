@@ -0,0 +1,134 @@
+import os, json, time, sqlite3, logging, tempfile, threading
+from dotenv import load_dotenv
+
+
+load_dotenv(override=True)
+
+
+logger = logging.getLogger("search_cache")
+
+
+# Search results keyed by (source, normalized query, offset, page size).
+# Fresh for SEARCH_CACHE_TTL seconds; for SEARCH_CACHE_STALE seconds after that
+# the old result is still served while a background thread refreshes it.
+SEARCH_CACHE_DB = os.getenv("SEARCH_CACHE_DB", os.path.join(tempfile.gettempdir(), "mra_search_cache.sqlite3"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 6 * 60 * 60))
+SEARCH_CACHE_STALE = float(os.getenv("SEARCH_CACHE_STALE", 24 * 60 * 60))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 5000))
+
+
+_local = threading.local()
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+
+
+def _connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(SEARCH_CACHE_DB, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_search_results_accessed ON search_results (accessed_at)")
+        _local.conn = conn
+    return conn
+
+
+
+
+def normalize_query(query: str) -> str:
+    # Whitespace only: case matters to boolean operators and quoted phrases upstream.
+    return " ".join(query.split())
+
+
+
+
+def cache_key(source: str, query: str, offset: int, limit: int) -> str:
+    return f"{source}|{normalize_query(query)}|{offset}|{limit}"
+
+
+
+
+def _store(key: str, value):
+    now = time.time()
+    conn = _connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO search_results (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+        (key, json.dumps(value), now, now)
+    )
+    conn.execute(
+        "DELETE FROM search_results WHERE stored_at < ?",
+        (now - SEARCH_CACHE_TTL - SEARCH_CACHE_STALE,)
+    )
+    # Size cap: drop the least recently used entries beyond SEARCH_CACHE_MAX_ENTRIES.
+    conn.execute(
+        "DELETE FROM search_results WHERE key IN ("
+        "SELECT key FROM search_results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+        (SEARCH_CACHE_MAX_ENTRIES,)
+    )
+
+
+
+
+def _refresh(key: str, fetch, is_valid):
+    try:
+        value = fetch()
+        if is_valid(value):
+            _store(key, value)
+            logger.debug(f"refreshed stale entry {key}")
+    except Exception as e:
+        logger.warning(f"background refresh failed for {key}: {e}")
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+
+
+
+def cached_search(source: str, query: str, offset: int, limit: int, fetch, is_valid=bool):
+    """
+    Return the cached result for this search, or call `fetch()` and cache it.
+
+    Only results for which `is_valid(result)` is true are stored, so failed or
+    empty upstream responses are retried on the next call. Results must be JSON
+    serialisable. Cache errors never fail the search; `fetch()` is used instead.
+    """
+    key = cache_key(source, query, offset, limit)
+    now = time.time()
+
+    try:
+        conn = _connection()
+        row = conn.execute("SELECT value, stored_at FROM search_results WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            value, stored_at = json.loads(row[0]), row[1]
+            age = now - stored_at
+            if age < SEARCH_CACHE_TTL + SEARCH_CACHE_STALE:
+                conn.execute("UPDATE search_results SET accessed_at = ? WHERE key = ?", (now, key))
+    except (sqlite3.Error, ValueError) as e:
+        logger.warning(f"cache lookup failed for {key}: {e}")
+        row = None
+
+    if row is not None and age < SEARCH_CACHE_TTL + SEARCH_CACHE_STALE:
+        if age >= SEARCH_CACHE_TTL:
+            with _refreshing_lock:
+                start_refresh = key not in _refreshing
+                _refreshing.add(key)
+            if start_refresh:
+                threading.Thread(target=_refresh, args=(key, fetch, is_valid), daemon=True).start()
+            logger.debug(f"stale hit {key} (age {age:.0f}s)")
+        else:
+            logger.debug(f"hit {key}")
+        return value
+
+    value = fetch()
+    if is_valid(value):
+        try:
+            _store(key, value)
+        except sqlite3.Error as e:
+            logger.warning(f"cache store failed for {key}: {e}")
+    return value
@@ -1,6 +1,9 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from pgvector.asyncpg import register_vector
+import os
 from core.settings import config
 from dotenv import load_dotenv
 
@@ -17,9 +20,34 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
+# asyncpg engine for request paths that must not block the event loop (chat).
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or DATABASE_URL.replace(
+    DATABASE_URL.split("://", 1)[0], "postgresql+asyncpg", 1
+)
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=int(os.getenv("ASYNC_DB_POOL_SIZE", "10")),
+    max_overflow=int(os.getenv("ASYNC_DB_MAX_OVERFLOW", "10")),
+    pool_pre_ping=True
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+@event.listens_for(async_engine.sync_engine, "connect")
+def _register_vector(dbapi_connection, connection_record):
+    dbapi_connection.run_async(register_vector)
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()    
\ No newline at end of file
+        db.close()
+
+
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -4,6 +4,8 @@ from routes import routes, auth_routes, user_routes
 from core.middleware import JWTMiddleware
 from starlette.middleware.cors import CORSMiddleware
 from pathlib import Path
+import asyncio
+from services import job_services, chat_pdf
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -32,6 +34,25 @@ app.add_middleware(
 
 
 
+@app.on_event("startup")
+async def start_job_workers():
+    job_services.start_workers()
+
+
+
+@app.on_event("startup")
+async def resume_chat_ingestion():
+    # Runs in the background; downloading the PDFs must not hold up startup.
+    app.state.chat_resume = asyncio.create_task(chat_pdf.resume_stale_ingestions())
+
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_services.stop_workers()
+
+
+
 @app.post("/")
 async def test():
     return BASE_DIR
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, String, DateTime, Text, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from uuid import uuid4
+from database.database import Base
+from datetime import datetime
+
+
+
+
+class Job(Base):
+    __tablename__ = 'tbl_jobs'
+
+    job_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("tbl_users.user_id", ondelete='CASCADE'), nullable=False, index=True)
+    job_type = Column(String(64), nullable=False)
+    status = Column(String(20), nullable=False, default="queued", index=True)
+    payload = Column(JSONB, nullable=False)
+    progress = Column(JSONB, nullable=True)
+    result = Column(JSONB, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
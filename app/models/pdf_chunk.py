@@ -13,11 +13,13 @@ class PdfChunk(Base):
     __tablename__ = 'pdf_chunks'
 
     chunk_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
-    session_id = Column(UUID(as_uuid=True), ForeignKey("sessions.session_id", ondelete='CASCADE'), nullable=False)
+    session_id = Column(UUID(as_uuid=True), ForeignKey("sessions.session_id", ondelete='CASCADE'), nullable=True, index=True)
+    content_hash = Column(String(64), ForeignKey("pdf_documents.content_hash", ondelete='CASCADE'), nullable=True, index=True)
     pdf_path = Column(String(512), nullable=False)
     chunk_text = Column(String, nullable=False)
     embedding = Column(Vector(1536), nullable=False)  
     chunk_index = Column(Integer, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
-    session = relationship("Session", back_populates="chunks")
\ No newline at end of file
+    session = relationship("Session", back_populates="chunks")
+    document = relationship("PdfDocument", back_populates="chunks")
\ No newline at end of file
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, String, Integer, DateTime
+from sqlalchemy.orm import relationship
+from database.database import Base
+from datetime import datetime
+
+
+
+
+class PdfDocument(Base):
+    __tablename__ = 'pdf_documents'
+
+    content_hash = Column(String(64), primary_key=True)
+    source_path = Column(String(512), nullable=True)
+    status = Column(String(20), nullable=False, default="indexing")
+    pages_total = Column(Integer, nullable=False, default=0)
+    pages_indexed = Column(Integer, nullable=False, default=0)
+    chunk_count = Column(Integer, nullable=False, default=0)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
+
+    chunks = relationship("PdfChunk", back_populates="document", cascade='all, delete-orphan', passive_deletes=True)
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, String, DateTime, ForeignKey
+from database.database import Base
+from datetime import datetime
+
+
+
+
+class ProjectDocument(Base):
+    __tablename__ = 'project_documents'
+
+    project_path = Column(String(512), primary_key=True)
+    pdf_path = Column(String(512), primary_key=True)
+    content_hash = Column(String(64), ForeignKey("pdf_documents.content_hash", ondelete='CASCADE'), nullable=False, index=True)
+    source_md5 = Column(String(64), nullable=True)
+    added_at = Column(DateTime, default=datetime.utcnow)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime
+from sqlalchemy import Column, String, DateTime, ForeignKey
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from uuid import uuid4
@@ -13,6 +13,8 @@ class Session(Base):
 
     session_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
     pdf_path = Column(String(512), nullable=False)
+    content_hash = Column(String(64), ForeignKey("pdf_documents.content_hash", ondelete='SET NULL'), nullable=True, index=True)
+    project_path = Column(String(512), nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     chunks = relationship("PdfChunk", back_populates="session", cascade='all, delete-orphan')
\ No newline at end of file
@@ -1,8 +1,9 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Request, Depends, status, Request
-from fastapi.responses import JSONResponse
-from typing import Optional
-from database.database import get_db
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Request, Depends, status, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Optional, List
+from database.database import get_db, get_async_db
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import FastAPI, Request
 from pydantic import BaseModel
 import uuid
@@ -18,6 +19,7 @@ from schemas.project_schemas import CreateNewProjectRequest, DownloadArticles, S
 from schemas.common_words_analysis_schemas import GetAllFoldersRequest, ExtractCommonWordsRequest, DownloadCWAPdfRequest
 from schemas.filter_schemas import ExcludeFileRequest, ExcludeFileResponse, IncludeFileRequest, IncludeFileResponse, DeleteDownloadedFileRequest, UndoFileRequest, ViewContentRequest
 from schemas.search_schemas import DeleteRecentSearchRequest
+from schemas.job_schemas import JobSubmitResponse, JobStatusResponse, JobResultResponse
 #============================== Services ================================================#
 from services.file_listing_service import list_downloaded_articles_with_dates
 from services.pubmed_services import retrive_pubmed
@@ -32,11 +34,14 @@ from services.common_words_analysis import get_all_project_data, common_words_an
 from services.search_services import user_recent_searches, delete_specific_recent_search
 from services.filter_services import exclude_specific_file, include_specific_file, delete_downloaded_file, undo_specific_file, view_file_content
 from services.semantic_scholar_services import retrive_semantic_scholar # Semantic Scholar API
+from services.combined_retrieval_services import retrive_from_sources, stream_from_sources, validate_retrieval_request, SOURCES
+from services.job_services import submit_job, get_job_status, get_job_result, stage_upload
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from services.chat_pdf import chat_with_pdf_timed, start_chat_session_resilient,end_chat_session_timed
+from services.chat_pdf import chat_with_pdf_timed, start_chat_session_resilient,end_chat_session_timed, prepare_chat, stream_chat_answer
+from services.chat_pdf import start_project_chat_session, chat_with_project, prepare_project_chat, project_includes_path, schedule_project_sync, drop_project_index
 from core.jwt import verify_token
 
 
@@ -110,10 +115,10 @@ async def extract_term( article_type: str = Form(...),
 
 
 @router.post("/table_extractor")
-async def extract_table(request:Request, project_name:str = Form(...), file: UploadFile = File(...)):
+async def extract_table(request:Request, project_name:str = Form(...), file: UploadFile = File(...), engine: str = Form("auto")):
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="File type must be PDF.")
-    return await extract_tables(request,project_name, file)
+    return await extract_tables(request,project_name, file, engine=engine)
 
 
 
@@ -136,6 +141,56 @@ async def extract_tables_and_images(request: Request, project_name:str = Form(..
 
 
 
+@router.post("/jobs/retrive_pubmed_article", response_model=JobSubmitResponse)
+async def submit_pubmed_job(request: Request, data: PubmedRetriverRequest):
+    return submit_job(request.state.user.get("user_id"), "retrive_pubmed_article", data)
+
+
+
+
+@router.post("/jobs/retrive_google_scholer_article", response_model=JobSubmitResponse)
+async def submit_google_scholer_job(request: Request, data: GoogleScholerRetriverRequest):
+    return submit_job(request.state.user.get("user_id"), "retrive_google_scholer_article", data)
+
+
+
+
+@router.post("/jobs/table_extractor", response_model=JobSubmitResponse)
+async def submit_table_extractor_job(request: Request, project_name:str = Form(...), file: UploadFile = File(...), engine: str = Form("auto")):
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=400, detail="File type must be PDF.")
+    user_id = request.state.user.get("user_id")
+    staged_path = await stage_upload(user_id, file)
+    return submit_job(user_id, "table_extractor", {"project_name": project_name, "filename": file.filename, "staged_path": staged_path, "engine": engine})
+
+
+
+
+@router.post("/jobs/combined_extractor", response_model=JobSubmitResponse)
+async def submit_combined_extractor_job(request: Request, project_name:str = Form(...), file: UploadFile = File(...)):
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=400, detail="File type must be PDF.")
+    user_id = request.state.user.get("user_id")
+    staged_path = await stage_upload(user_id, file)
+    return submit_job(user_id, "combined_extractor", {"project_name": project_name, "filename": file.filename, "staged_path": staged_path})
+
+
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def job_status(request: Request, job_id: str):
+    return get_job_status(request.state.user.get("user_id"), job_id)
+
+
+
+
+@router.get("/jobs/{job_id}/result", response_model=JobResultResponse)
+async def job_result(request: Request, job_id: str):
+    return get_job_result(request.state.user.get("user_id"), job_id)
+
+
+
+
 @router.post("/get_all_file_and_folders")
 async def cwa_get_all_files_and_folders(request:Request, data:GetAllFoldersRequest):
     return get_all_project_data(request=request, data =data)
@@ -179,47 +234,25 @@ async def delete_recent_search(data:DeleteRecentSearchRequest, db:Session = Depe
 
 @router.post("/exclude_file", response_model = ExcludeFileResponse)
 async def exclude_file(request: Request, data: ExcludeFileRequest):
-    return exclude_specific_file(request=request, data=data)
+    result = exclude_specific_file(request=request, data=data)
+    schedule_project_sync(project_includes_path(request.state.user.get("user_id"), data.project_name))
+    return result
 
 
 
 
 @router.post("/include_file", response_model=IncludeFileResponse)
 async def include_file(request: Request, data: IncludeFileRequest):
-    return include_specific_file(request=request, data=data)
+    result = include_specific_file(request=request, data=data)
+    schedule_project_sync(project_includes_path(request.state.user.get("user_id"), data.project_name))
+    return result
 
 
 
 
 @router.post("/retrive_scholar_and_pubmed_articles")
 async def retrive_scholar_and_pubmed_articles(request: Request, data: GoogleScholerRetriverRequest):
-
-    number = data.max_pdfs
-    if number <= 0:
-        raise HTTPException(status_code=422, detail="Number of downloads must be greater than 0.")
-
-    # Split PDFs download count
-    half = number // 2
-
-    # --- GOOGLE SCHOLAR ---
-    data.max_pdfs = half + (1 if number % 2 != 0 else 0)
-    scholar_result = await retrive_google_scholer(request=request, data=data)
-
-    # --- PUBMED ---
-    data.max_pdfs = half
-    pubmed_result = retrive_pubmed(request=request, data=data)
-
-   
-    final_result = {
-        "success": scholar_result["success"] + pubmed_result["success"],
-        "failed": scholar_result["failed"] + pubmed_result["failed"],
-        "downloaded": scholar_result["downloaded"] + pubmed_result["downloaded"],
-        "skipped_403": scholar_result.get("skipped_403", 0) + pubmed_result.get("skipped_403", 0),
-        "failed_downloads": scholar_result["failed_downloads"] + pubmed_result["failed_downloads"],
-        "source": "google_scholar + pubmed"
-    }
-
-    return final_result
+    return await retrive_from_sources(request=request, data=data, sources=["google_scholar", "pubmed"])
 
 
 
@@ -227,47 +260,37 @@ async def retrive_scholar_and_pubmed_articles(request: Request, data: GoogleScho
 
 @router.post("/retrive_scholar_and_semantic")
 async def retrive_scholar_and_semantic(request: Request, data: GoogleScholerRetriverRequest):
+    return await retrive_from_sources(request=request, data=data, sources=["google_scholar", "semantic_scholar"], remainder_last=True)
 
-    number = data.max_pdfs
-    if number <= 0:
-        raise HTTPException(status_code=422, detail="Number of downloads should be greater than 0.")
-
-    # Split PDFs
-    half = number // 2
-
-    # --- GOOGLE SCHOLAR ---
-    data.max_pdfs = half
-    google_result = await retrive_google_scholer(request=request, data=data)
-
-    # --- SEMANTIC SCHOLAR ---
-    remaining = number - half
-    data.max_pdfs = remaining
-    semantic_result = await retrive_semantic_scholar(request=request, data=data)
 
-    # --- MERGE INTO FINAL FLAT RESULT ---
-    final_result = {
-        "success": google_result["success"] + semantic_result["success"],
-        "failed": google_result["failed"] + semantic_result["failed"],
-        "downloaded": google_result["downloaded"] + semantic_result["downloaded"],
-        "skipped_403": google_result["skipped_403"] + semantic_result["skipped_403"],
-        "failed_downloads": google_result["failed_downloads"] + semantic_result["failed_downloads"],
-        "source": "google_scholar + semantic_scholar"
-    }
 
-    return final_result
+@router.post("/retrive_articles_stream")
+async def retrive_articles_stream(request: Request, data: GoogleScholerRetriverRequest, sources: List[str] = Query(...)):
+    unknown = [name for name in sources if name not in SOURCES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown source(s): {', '.join(unknown)}")
+    validate_retrieval_request(data)
+    return StreamingResponse(
+        stream_from_sources(request=request, data=data, sources=list(dict.fromkeys(sources))),
+        media_type="application/x-ndjson"
+    )
 
 
 
 @router.post("/delete_file")
 async def delete_file_endpoint(request: Request, data: DeleteDownloadedFileRequest):
-    return delete_downloaded_file(request=request, data=data)  
+    result = delete_downloaded_file(request=request, data=data)
+    schedule_project_sync(project_includes_path(request.state.user.get("user_id"), data.project_name))
+    return result
 
 
 
 
 @router.post("/undo_file")
 async def undo_file_endpoint(data: UndoFileRequest, request: Request):
-    return undo_specific_file(data=data, request=request)
+    result = undo_specific_file(data=data, request=request)
+    schedule_project_sync(project_includes_path(request.state.user.get("user_id"), data.project_name))
+    return result
 
 
 
@@ -338,13 +361,61 @@ class ChatRequest(BaseModel):
 
 
 @router.post("/chat_with_pdf")
-async def chat(request: ChatRequest, user_id: str = Depends(get_current_user), db: Session = Depends(get_db)):
+async def chat(request: ChatRequest, user_id: str = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     full_path = f"users/{user_id}/{request.project_name}/{request.relative_path}"
     return await chat_with_pdf_timed(request.session_id, full_path, request.query, db)
+
+
+
+@router.post("/chat_with_pdf_stream")
+async def chat_stream(request: ChatRequest, http_request: Request, user_id: str = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    full_path = f"users/{user_id}/{request.project_name}/{request.relative_path}"
+    # Retrieval errors still come back as normal HTTP errors; only the answer is streamed.
+    prepared = await prepare_chat(request.session_id, full_path, request.query, db)
+    return StreamingResponse(
+        stream_chat_answer(prepared, http_request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
     
 
 
 
+class ProjectSessionRequest(BaseModel):
+    project_name: str
+
+
+@router.post("/start_project_chat_session")
+async def start_project_session(request: ProjectSessionRequest, user_id: str = Depends(get_current_user), db: Session = Depends(get_db)):
+    return await start_project_chat_session(project_includes_path(user_id, request.project_name), db)
+
+
+
+
+class ProjectChatRequest(BaseModel):
+    session_id: str
+    project_name: str
+    query: str
+
+
+@router.post("/chat_with_project")
+async def chat_project(request: ProjectChatRequest, user_id: str = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    return await chat_with_project(request.session_id, project_includes_path(user_id, request.project_name), request.query, db)
+
+
+
+@router.post("/chat_with_project_stream")
+async def chat_project_stream(request: ProjectChatRequest, http_request: Request, user_id: str = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    prepared = await prepare_project_chat(request.session_id, project_includes_path(user_id, request.project_name), request.query, db)
+    return StreamingResponse(
+        stream_chat_answer(prepared, http_request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+
+
 class EndSessionRequest(BaseModel):
     session_id: str
 
@@ -369,7 +440,9 @@ async def get_downloaded_articles(request: Request, project_name: str = Form(...
 
 @router.post("/delete_project")
 async def delete_project_endpoint(request: Request,data: DeleteProjectRequest):
-    return delete_project(request=request, project_name=data.project_name)
+    result = delete_project(request=request, project_name=data.project_name)
+    await drop_project_index(project_includes_path(request.state.user.get("user_id"), data.project_name))
+    return result
    
 
 
@@ -0,0 +1,30 @@
+from typing import Any, Optional
+from datetime import datetime
+from pydantic import BaseModel
+
+
+
+
+class JobSubmitResponse(BaseModel):
+    job_id: str
+    status: str
+
+
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    job_type: str
+    status: str
+    progress: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+
+class JobResultResponse(BaseModel):
+    job_id: str
+    status: str
+    result: Optional[Any] = None
+    error: Optional[str] = None
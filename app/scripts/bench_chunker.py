@@ -0,0 +1,117 @@
+"""
+Chunker benchmark for chat ingestion.
+
+Builds a synthetic paper of --pages pages (running header and footer, numbered
+sections, paragraphs, a table every few pages, References at the end), or
+reads --pdf, and reports for each strategy in core.utils.chunker.CHUNKERS:
+
+- whole:    one chunk_pdf call over every content page, as ingestion did
+  before it was windowed;
+- windowed: one chunk_pdf call per CHAT_INGEST_WINDOW_PAGES pages, as
+  chat_pdf.ingest_windows calls it.
+
+Per mode: wall time, pages/s, chunks, mean tokens per chunk, and the peak
+Python memory allocated while chunking (tracemalloc; PyMuPDF's own buffers
+are not counted). Run from app/:
+
+    python -m scripts.bench_chunker --pages 300
+"""
+
+import os, time, argparse, tracemalloc
+
+import fitz
+from core.utils import chunker
+
+
+WINDOW_PAGES = int(os.getenv("CHAT_INGEST_WINDOW_PAGES", "10"))
+
+
+
+
+def synthetic_paper(pages: int) -> bytes:
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 40), "Journal of Clinical Testing Vol. 12 - Example et al.", fontsize=8)
+        page.insert_text((300, 820), str(number + 1), fontsize=8)
+        y = 90
+        if number % 3 == 0:
+            page.insert_text((72, y), f"{number // 3 + 1}. Methods and Results", fontsize=14)
+            y += 30
+        for paragraph in range(4):
+            text = " ".join(f"Sentence {paragraph}.{s} on page {number + 1} describes a measured effect "
+                            f"with some detail." for s in range(6))
+            page.insert_textbox(fitz.Rect(72, y, 540, y + 130), text, fontsize=10)
+            y += 140
+        if number % 5 == 4:
+            page.insert_text((72, y), f"Table {number // 5 + 1}. Outcomes by arm", fontsize=9)
+            for i, row in enumerate(("Treatment 45 55 100", "Placebo 40 60 100", "Total 85 115 200")):
+                page.insert_text((72, y + 20 + 16 * i), row, fontsize=10)
+    page = doc.new_page()
+    page.insert_text((72, 90), "References", fontsize=14)
+    for i in range(30):
+        page.insert_text((72, 120 + 20 * i), f"{i + 1}. Author A, Author B. A cited study. 2020.", fontsize=9)
+    return doc.tobytes()
+
+
+
+
+def measure(chunk):
+    """
+    Time chunk(), then run it again under tracemalloc, which slows it down, for
+    the peak; (seconds, peak bytes, chunks). Each run scans the document anew.
+    """
+    chunker._profiles.clear()
+    start = time.perf_counter()
+    chunks = chunk()
+    seconds = time.perf_counter() - start
+
+    chunker._profiles.clear()
+    tracemalloc.start()
+    chunk()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, chunks
+
+
+
+
+def windowed(pdf_bytes: bytes, strategy: str, pages_total: int):
+    chunks = []
+    for page in range(0, pages_total, WINDOW_PAGES):
+        chunks.extend(chunker.chunk_pdf(pdf_bytes, strategy, range(page, min(page + WINDOW_PAGES, pages_total))))
+    return chunks
+
+
+
+
+def run(args):
+    if args.pdf:
+        with open(args.pdf, "rb") as f:
+            pdf_bytes = f.read()
+    else:
+        pdf_bytes = synthetic_paper(args.pages)
+    pages_total = chunker.content_pages(pdf_bytes, "structured")
+    tokenizer = "tiktoken" if chunker._encoding is not None else "length estimate"
+    print(f"PDF of {len(pdf_bytes) / 1024:.0f} KiB, {pages_total} content pages, "
+          f"{WINDOW_PAGES}-page windows, token counts from {tokenizer}")
+    print(f"  {'strategy':<11} {'mode':<9} {'seconds':>8} {'pages/s':>8} {'chunks':>7} {'tokens':>7} {'peak MiB':>9}")
+    for strategy in chunker.CHUNKERS:
+        for mode in ("whole", "windowed"):
+            if mode == "whole":
+                chunk = lambda: chunker.chunk_pdf(pdf_bytes, strategy, range(pages_total))
+            else:
+                chunk = lambda: windowed(pdf_bytes, strategy, pages_total)
+            seconds, peak, chunks = measure(chunk)
+            tokens = sum(chunker.count_tokens(c) for c in chunks) / max(len(chunks), 1)
+            print(f"  {strategy:<11} {mode:<9} {seconds:>8.2f} {pages_total / seconds:>8.0f} {len(chunks):>7} "
+                  f"{tokens:>7.0f} {peak / 2**20:>9.1f}")
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pdf", help="chunk this PDF instead of a synthetic one")
+    parser.add_argument("--pages", type=int, default=300, help="pages of the synthetic paper")
+    run(parser.parse_args())
@@ -0,0 +1,101 @@
+"""
+Embedding ingestion benchmark: wall time of chat_pdf.EmbeddingOptimizer
+against the OpenAI stand-in of scripts.load_test_chat, per concurrency level.
+
+Starts `load_test_chat mock` on --port in a child process, with --embedding-ms
+of latency per call, then embeds --chunks synthetic chunks of about
+--chunk-tokens tokens at each --concurrency, the way ingest_windows does for one
+document (one EmbeddingOptimizer, token-packed batches). The embeddings rate
+limit is lifted for the run, so the numbers measure batching and concurrency
+against the mock's latency, not the account's quota. Run from app/:
+
+    python -m scripts.bench_embeddings --chunks 2000 --concurrency 1 2 4 8 16
+
+Lower --batch-tokens to get more, smaller batches and see concurrency pay off.
+The mock builds its vectors in one Python process, so at high concurrency
+wall time levels off at the mock's own throughput.
+"""
+
+import io, os, sys, time, shutil, socket, asyncio, argparse, tempfile, contextlib, subprocess
+
+# The token bucket of the run stays in its own throwaway file, without a quota.
+WORKDIR = tempfile.mkdtemp(prefix="bench_embeddings_")
+os.environ.setdefault("RATE_LIMIT_DB", os.path.join(WORKDIR, "rate_limits.sqlite3"))
+os.environ.setdefault("RATE_LIMIT_OPENAI_EMBEDDINGS_RATE", "1e12")
+os.environ.setdefault("RATE_LIMIT_OPENAI_EMBEDDINGS_BURST", str(10**12))
+
+from openai import AsyncOpenAI
+from services import chat_pdf
+
+
+SENTENCE = "The treatment arm showed a measured reduction in the primary outcome at twelve weeks. "
+
+
+
+
+def wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with contextlib.suppress(OSError), socket.create_connection(("127.0.0.1", port), timeout=1):
+            return
+        time.sleep(0.1)
+    raise RuntimeError(f"mock server did not start on port {port}")
+
+
+
+
+def synthetic_chunks(count: int, tokens: int):
+    words = SENTENCE * max(1, tokens // 16)
+    return [f"Chunk {i}. {words}" for i in range(count)]
+
+
+
+
+async def run_level(client, chunks, concurrency: int, args):
+    optimizer = chat_pdf.EmbeddingOptimizer(client, concurrency=concurrency, batch_tokens=args.batch_tokens)
+    batches = len(optimizer.pack_batches([chat_pdf.count_tokens(chunk) for chunk in chunks]))
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        embeddings = await optimizer.embed(chunks)
+    seconds = time.perf_counter() - start
+    assert len(embeddings) == len(chunks) and all(embeddings)
+    return batches, seconds
+
+
+
+
+async def run(args):
+    client = AsyncOpenAI(base_url=f"http://127.0.0.1:{args.port}/v1", api_key="mock")
+    chunks = synthetic_chunks(args.chunks, args.chunk_tokens)
+    tokens = sum(chat_pdf.count_tokens(chunk) for chunk in chunks)
+    print(f"{len(chunks)} chunks, {tokens} tokens, batches up to {args.batch_tokens} tokens, "
+          f"mock latency {args.embedding_ms:.0f} ms per call")
+    print(f"  {'concurrency':>11}  {'batches':>7}  {'seconds':>8}  {'chunks/s':>9}")
+    for concurrency in args.concurrency:
+        batches, seconds = await run_level(client, chunks, concurrency, args)
+        print(f"  {concurrency:>11}  {batches:>7}  {seconds:>8.2f}  {len(chunks) / seconds:>9.0f}")
+    await client.close()
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--chunks", type=int, default=2000, help="chunks to embed per level")
+    parser.add_argument("--chunk-tokens", type=int, default=400, help="approximate tokens per chunk")
+    parser.add_argument("--batch-tokens", type=int, default=chat_pdf.EMBEDDING_BATCH_TOKENS,
+                        help="token budget of one embeddings call")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--embedding-ms", type=float, default=300, help="mock latency per embeddings call")
+    args = parser.parse_args()
+
+    mock = subprocess.Popen([sys.executable, "-m", "scripts.load_test_chat", "mock",
+                             "--port", str(args.port), "--embedding-ms", str(args.embedding_ms)])
+    try:
+        wait_for_port(args.port)
+        asyncio.run(run(args))
+    finally:
+        mock.terminate()
+        mock.wait()
+        shutil.rmtree(WORKDIR, ignore_errors=True)
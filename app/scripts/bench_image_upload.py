@@ -0,0 +1,167 @@
+"""
+Image extraction benchmark: the old write-to-disk upload path against the
+in-memory one in image_extractor_services.
+
+Builds a PDF with --images distinct embedded images (or reads --pdf) and
+extracts it --repeat times with each path. GCS uploads and URL signing are
+replaced by sleeps of --upload-ms and --sign-ms, so the numbers measure this
+host's disk I/O and the upload concurrency, not the network:
+
+- before: every image is written under pdfImages/, read back for the upload,
+  and signed, one image after another, as extract_images_from_pdf did;
+- after:  extract_images_from_pdf as it is now.
+
+Wall time per extraction (p50/p99), bytes this process wrote (write() calls,
+from /proc/self/io where available) and bytes left on local disk are reported
+per path. Each repetition uses a fresh project, so image dedup does not skip
+uploads. Run from app/:
+
+    python -m scripts.bench_image_upload --images 200 --repeat 5
+"""
+
+import os, io, time, shutil, asyncio, argparse, tempfile, contextlib
+
+# The claims index of the run stays in its own throwaway directory.
+WORKDIR = tempfile.mkdtemp(prefix="bench_images_")
+os.environ.setdefault("IMAGE_HASH_INDEX", os.path.join(WORKDIR, "image_hashes.sqlite3"))
+
+import fitz
+import numpy as np
+from services import image_extractor_services
+
+
+# ---------------------------------------------------------------------------
+# Fixtures
+# ---------------------------------------------------------------------------
+
+def synthetic_pdf(images: int, side: int, per_page: int, seed: int) -> bytes:
+    """A PDF holding `images` distinct noise PNGs of side x side px."""
+    rng = np.random.default_rng(seed)
+    doc = fitz.open()
+    page = None
+    for i in range(images):
+        if i % per_page == 0:
+            page = doc.new_page()
+        samples = rng.integers(0, 256, size=side * side * 3, dtype=np.uint8).tobytes()
+        pixmap = fitz.Pixmap(fitz.csRGB, side, side, samples, False)
+        column, row = divmod(i % per_page, 2)
+        page.insert_image(fitz.Rect(50 + row * 250, 50 + column * 250, 250 + row * 250, 250 + column * 250),
+                          stream=pixmap.tobytes("png"))
+    return doc.tobytes()
+
+
+
+
+def written_bytes() -> int:
+    """Bytes this process has passed to write() so far; 0 where /proc is unavailable."""
+    try:
+        with open("/proc/self/io") as stats:
+            return next(int(line.split()[1]) for line in stats if line.startswith("wchar:"))
+    except (OSError, StopIteration):
+        return 0
+
+
+
+
+def local_bytes(root: str) -> int:
+    return sum(os.path.getsize(os.path.join(folder, name)) for folder, _, names in os.walk(root) for name in names)
+
+
+
+
+# ---------------------------------------------------------------------------
+# Paths under test
+# ---------------------------------------------------------------------------
+
+def legacy_extract(pdf_bytes: bytes, save_dir: str, upload_ms: float, sign_ms: float):
+    """The extraction before the in-memory path: disk write, read back, upload and sign per image."""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    presigned_urls = []
+    os.makedirs(save_dir, exist_ok=True)
+    for page_num in range(doc.page_count):
+        for img_index, img in enumerate(doc[page_num].get_images(full=True), start=1):
+            base_image = doc.extract_image(img[0])
+            img_path = os.path.join(save_dir, f"image_{page_num + 1}_{img_index}.{base_image['ext']}")
+            with open(img_path, "wb") as f:
+                f.write(base_image["image"])
+            with open(img_path, "rb") as f:
+                f.read()
+                time.sleep(upload_ms / 1000)
+            time.sleep(sign_ms / 1000)
+            presigned_urls.append(img_path)
+    doc.close()
+    return presigned_urls
+
+
+
+
+def use_mock_storage(upload_ms: float, sign_ms: float):
+    """Point the current path's GCS upload, existence check and URL signing at sleeps."""
+    uploaded = set()
+
+    def upload_image_bytes(path, img_bytes, extention):
+        time.sleep(upload_ms / 1000)
+        uploaded.add(path)
+
+    def get_presigned_urls(path):
+        time.sleep(sign_ms / 1000)
+        return path
+
+    image_extractor_services.upload_image_bytes = upload_image_bytes
+    image_extractor_services.get_presigned_urls = get_presigned_urls
+    image_extractor_services.blob_exists = lambda path: path in uploaded
+
+
+
+
+async def run_mode(mode: str, pdf_bytes: bytes, args):
+    latencies, urls = [], 0
+    root = os.path.join(WORKDIR, mode)
+    written = written_bytes()
+    for i in range(args.repeat):
+        save_dir = os.path.join(root, f"users/bench/project_{i}/pdfImages/paper")
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            if mode == "before":
+                result = await asyncio.to_thread(legacy_extract, pdf_bytes, save_dir, args.upload_ms, args.sign_ms)
+            else:
+                result = await image_extractor_services.extract_images_from_pdf(pdf_bytes, save_dir)
+        latencies.append((time.perf_counter() - start) * 1000)
+        urls += len(result)
+    return latencies, urls // args.repeat, written_bytes() - written, local_bytes(root)
+
+
+
+
+async def run(args):
+    use_mock_storage(args.upload_ms, args.sign_ms)
+    if args.pdf:
+        with open(args.pdf, "rb") as f:
+            pdf_bytes = f.read()
+    else:
+        pdf_bytes = synthetic_pdf(args.images, args.side, 4, args.random_seed)
+    print(f"PDF of {len(pdf_bytes) / 1024:.0f} KiB, {args.repeat} extraction(s) per path, "
+          f"upload {args.upload_ms:.0f} ms, sign {args.sign_ms:.0f} ms, "
+          f"{image_extractor_services.IMAGE_UPLOAD_CONCURRENCY} upload threads")
+    print(f"  {'path':<7} {'images':>6}  {'p50 ms':>9}  {'p99 ms':>9}  {'written KiB':>11}  {'left on disk KiB':>16}")
+    for mode in ("before", "after"):
+        latencies, images, written, left = await run_mode(mode, pdf_bytes, args)
+        print(f"  {mode:<7} {images:>6}  {np.percentile(latencies, 50):>9.0f}  {np.percentile(latencies, 99):>9.0f}  "
+              f"{written / 1024:>11.0f}  {left / 1024:>16.0f}")
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pdf", help="extract this PDF instead of a synthetic one")
+    parser.add_argument("--images", type=int, default=200, help="images in the synthetic PDF")
+    parser.add_argument("--side", type=int, default=320, help="side in px of each synthetic image")
+    parser.add_argument("--repeat", type=int, default=5, help="extractions per path")
+    parser.add_argument("--upload-ms", type=float, default=40, help="simulated GCS upload latency per image")
+    parser.add_argument("--sign-ms", type=float, default=5, help="simulated URL signing latency per image")
+    parser.add_argument("--random-seed", type=int, default=7)
+    try:
+        asyncio.run(run(parser.parse_args()))
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
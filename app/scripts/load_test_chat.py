@@ -0,0 +1,166 @@
+"""
+Concurrent-chat load test for /chat_with_pdf.
+
+    python -m scripts.load_test_chat mock --port 8090 --embedding-ms 80 --completion-ms 600
+
+serves a stand-in for the OpenAI embeddings and chat completions endpoints with
+fixed latencies. Start the API against it (OPENAI_BASE_URL=http://localhost:8090/v1)
+so the numbers measure this service and its database, not OpenAI.
+
+    python -m scripts.load_test_chat run --base-url http://localhost:8001 --token $JWT \\
+        --project demo --pdf pubmed/topic/paper.pdf --concurrency 1 4 16 64
+
+starts one chat session and sends --requests chats at each concurrency level,
+then reports throughput, p50/p99 latency and errors per level. Every question is
+unique, so the embedding and answer caches do not short-circuit the path under
+test. With a non-blocking chat path, throughput grows with concurrency until the
+CHAT_*_CONCURRENCY limits or the database pool are reached.
+"""
+
+import os, time, random, asyncio, argparse
+import httpx
+import numpy as np
+
+
+SERVICES_PREFIX = "/v1/services"
+QUESTIONS = [
+    "What is the primary outcome of the study",
+    "How many patients were enrolled",
+    "Which adverse events were reported",
+    "What statistical methods were used",
+    "What are the main limitations",
+]
+
+
+
+
+# ---------------------------------------------------------------------------
+# Mock upstream
+# ---------------------------------------------------------------------------
+
+def mock_app(embedding_ms: float, completion_ms: float, dimensions: int = 1536):
+    from fastapi import FastAPI, Request
+
+    app = FastAPI()
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(embedding_ms / 1000)
+        return {
+            "object": "list",
+            "model": body.get("model"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": [random.uniform(-1, 1) for _ in range(dimensions)]}
+                for i in range(len(inputs))
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        await asyncio.sleep(completion_ms / 1000)
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "Mock answer based on the retrieved chunks."},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    return app
+
+
+
+
+# ---------------------------------------------------------------------------
+# Driver
+# ---------------------------------------------------------------------------
+
+async def start_session(client: httpx.AsyncClient, project: str, pdf: str) -> str:
+    response = await client.post(f"{SERVICES_PREFIX}/start_chat_session", json={"project_name": project, "relative_path": pdf})
+    response.raise_for_status()
+    return response.json()["session_id"]
+
+
+
+
+async def run_level(client: httpx.AsyncClient, session_id: str, project: str, pdf: str, concurrency: int, requests: int):
+    """Send `requests` chats with `concurrency` in flight; (wall seconds, latencies in ms, error count)."""
+    latencies, errors = [], 0
+    counter = iter(range(requests))
+
+    async def user():
+        nonlocal errors
+        for i in counter:
+            payload = {
+                "session_id": session_id,
+                "project_name": project,
+                "relative_path": pdf,
+                "query": f"{QUESTIONS[i % len(QUESTIONS)]} (run {concurrency}-{i})?",
+            }
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{SERVICES_PREFIX}/chat_with_pdf", json=payload)
+                response.raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+            except httpx.HTTPError as e:
+                errors += 1
+                print(f"  request {i} failed: {e}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, errors
+
+
+
+
+async def run(args):
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=args.base_url, headers=headers, limits=limits, timeout=args.timeout) as client:
+        session_id = args.session_id or await start_session(client, args.project, args.pdf)
+        print(f"Session {session_id}, {args.requests} chats per level")
+        print(f"  {'concurrency':>11}  {'chats/s':>8}  {'p50 ms':>8}  {'p99 ms':>8}  errors")
+        for concurrency in args.concurrency:
+            wall, latencies, errors = await run_level(client, session_id, args.project, args.pdf, concurrency, args.requests)
+            p50, p99 = (np.percentile(latencies, 50), np.percentile(latencies, 99)) if latencies else (float("nan"),) * 2
+            print(f"  {concurrency:>11}  {len(latencies) / wall:>8.1f}  {p50:>8.0f}  {p99:>8.0f}  {errors}")
+        if not args.session_id:
+            await client.post(f"{SERVICES_PREFIX}/end_chat_session", json={"session_id": session_id})
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    mock = commands.add_parser("mock", help="serve a fixed-latency OpenAI stand-in")
+    mock.add_argument("--port", type=int, default=8090)
+    mock.add_argument("--embedding-ms", type=float, default=80)
+    mock.add_argument("--completion-ms", type=float, default=600)
+
+    driver = commands.add_parser("run", help="drive /chat_with_pdf at increasing concurrency")
+    driver.add_argument("--base-url", default="http://localhost:8001")
+    driver.add_argument("--token", default=os.getenv("LOAD_TEST_TOKEN"), help="JWT of a user owning the PDF")
+    driver.add_argument("--project", required=True)
+    driver.add_argument("--pdf", required=True, help="path of the PDF inside the project")
+    driver.add_argument("--session-id", help="reuse an existing chat session instead of starting one")
+    driver.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    driver.add_argument("--requests", type=int, default=200, help="chats per concurrency level")
+    driver.add_argument("--timeout", type=float, default=120)
+
+    args = parser.parse_args()
+    if args.command == "mock":
+        import uvicorn
+        uvicorn.run(mock_app(args.embedding_ms, args.completion_ms), port=args.port, log_level="warning")
+    else:
+        asyncio.run(run(args))
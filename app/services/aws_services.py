@@ -2,6 +2,7 @@ from core.utils.aws_utils import s3_get_objects, s3_create_project_folder, s3_ge
 from fastapi import Request, HTTPException
 from schemas.project_schemas import CreateNewProjectRequest, DownloadArticles
 from core.utils.gcp_utils import create_folder, get_project_names_only, generate_presigned_url, delete_folder
+from core.utils.image_utils import release_images
  
 
 
@@ -53,6 +54,8 @@ def delete_project(request: Request, project_name: str):
         raise HTTPException(status_code=401, detail="Authentication required")
     folder_path = f"users/{user_id}/{project_name}/"
     success = delete_folder(folder_path)
+    # Extracted images of the project are gone; stop pointing other extractions at them.
+    release_images(folder_path)
     if not success:
         raise HTTPException(
             status_code=404,
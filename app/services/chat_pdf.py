@@ -1,15 +1,22 @@
 import os
 from pathlib import Path
-from fastapi import HTTPException
+from fastapi import HTTPException, Request
 from sqlalchemy.orm import Session
 from models.session import Session
 from models.pdf_chunk import PdfChunk
-from core.utils.gcp_utils import  generate_presigned_url
+from models.pdf_document import PdfDocument
+from models.project_document import ProjectDocument
+from core.utils.gcp_utils import  generate_presigned_url, download_file_bytes, list_pdf_blobs
+from database.database import SessionLocal
 from core.settings import config
-from openai import OpenAI
+from core.utils.chunker import chunk_pdf, content_pages, count_tokens
+from core.utils.rate_limiter import acquire_async, penalize
+from core.utils import chat_cache
+from openai import OpenAI, AsyncOpenAI
+from sqlalchemy.ext.asyncio import AsyncSession
 import PyPDF2
 import requests
-from uuid import uuid4
+from uuid import uuid4, UUID
 from datetime import datetime
 import time
 import random
@@ -22,13 +29,62 @@ import asyncio
 import fitz  
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from sqlalchemy import text
+from sqlalchemy import text, select, func
+from sqlalchemy.dialects.postgresql import insert
 from typing import List
+import hashlib
+import json
+from datetime import timedelta
 
 
 
 client = OpenAI()
-PDF_DOWNLOAD_DIR = "pdf_download"
+# The chat path awaits its upstreams; each has its own concurrency bound per worker.
+async_client = AsyncOpenAI()
+CHAT_EMBEDDING_CONCURRENCY = int(os.getenv("CHAT_EMBEDDING_CONCURRENCY", "16"))
+CHAT_COMPLETION_CONCURRENCY = int(os.getenv("CHAT_COMPLETION_CONCURRENCY", "8"))
+CHAT_DB_CONCURRENCY = int(os.getenv("CHAT_DB_CONCURRENCY", "10"))
+_embedding_slots = asyncio.Semaphore(CHAT_EMBEDDING_CONCURRENCY)
+_completion_slots = asyncio.Semaphore(CHAT_COMPLETION_CONCURRENCY)
+_db_slots = asyncio.Semaphore(CHAT_DB_CONCURRENCY)
+# Ingestion embeddings: batches are packed by tokens (the endpoint takes up to
+# 2048 inputs per call) and several are sent at once.
+EMBEDDING_MODEL = "text-embedding-3-small"
+CHAT_MODEL = "gpt-4o-mini"
+CHAT_MAX_TOKENS = 200
+EMBEDDING_MAX_INPUTS = int(os.getenv("EMBEDDING_MAX_INPUTS", "2048"))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "60000"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+# A batch that still times out after its retries, or is too long for the model,
+# is split in half, at most EMBEDDING_MAX_SPLIT_DEPTH times. Any other error
+# (bad key, bad request) fails the document at once.
+EMBEDDING_MAX_SPLIT_DEPTH = int(os.getenv("EMBEDDING_MAX_SPLIT_DEPTH", "3"))
+# Errors worth sending the same batch again for.
+EMBEDDING_TRANSIENT_ERRORS = (asyncio.TimeoutError, openai.RateLimitError, openai.APIConnectionError,
+                              openai.InternalServerError)
+# Indexed documents no session refers to are kept this long, so reopening a
+# paper soon after still skips embedding; after that they are garbage collected.
+CHAT_INDEX_TTL_HOURS = float(os.getenv("CHAT_INDEX_TTL_HOURS", 7 * 24))
+# HNSW search breadth for multi-document queries; higher means better recall, slower.
+CHAT_HNSW_EF_SEARCH = int(os.getenv("CHAT_HNSW_EF_SEARCH", "100"))
+# pgvector >= 0.8 keeps scanning the graph until enough rows pass the filter.
+# Set to "off" on older servers, which do not know the setting.
+CHAT_HNSW_ITERATIVE_SCAN = os.getenv("CHAT_HNSW_ITERATIVE_SCAN", "relaxed_order")
+# Chat ingestion embeds and commits this many pages at a time. A document whose
+# indexer has not committed a window for CHAT_INGEST_STALE_SECONDS is resumed
+# by the next worker that needs it.
+CHAT_INGEST_WINDOW_PAGES = int(os.getenv("CHAT_INGEST_WINDOW_PAGES", "10"))
+CHAT_INGEST_STALE_SECONDS = float(os.getenv("CHAT_INGEST_STALE_SECONDS", "300"))
+_ingestion_tasks = set()
+# Project chat searches every PDF under a project's includes/ folder. One ANN
+# query fetches PROJECT_CHAT_CANDIDATES times top_k chunks, of which at most
+# PROJECT_CHAT_MAX_PER_DOCUMENT per paper are kept while other papers have
+# matches. New project files are indexed PROJECT_INGEST_CONCURRENCY at a time.
+PROJECT_CHAT_CANDIDATES = int(os.getenv("PROJECT_CHAT_CANDIDATES", "4"))
+PROJECT_CHAT_MAX_PER_DOCUMENT = int(os.getenv("PROJECT_CHAT_MAX_PER_DOCUMENT", "2"))
+PROJECT_INGEST_CONCURRENCY = int(os.getenv("PROJECT_INGEST_CONCURRENCY", "2"))
+_project_ingest_slots = asyncio.Semaphore(PROJECT_INGEST_CONCURRENCY)
+_pending_project_files = set()
 
 
 
@@ -50,201 +106,417 @@ def timer(description: str):
 
 
 
-def extract_text_fast(pdf_path: str) -> str:
-    """Ultra-fast PDF text extraction using PyMuPDF"""
-    doc = fitz.open(pdf_path)
-    text = ""
-    for page_num in range(doc.page_count):
-        page = doc[page_num]
-        page_text = page.get_text()
-        text += page_text + "\n"
-    doc.close()
-    return text
+def claim_document(content_hash: str, pages_total: int, pdf_path: str, db: Session):
+    """
+    Make this worker the indexer of a document: register it if it is new, or
+    take it over if its indexer failed or stopped heart-beating for
+    CHAT_INGEST_STALE_SECONDS. Returns (pages_indexed, chunk_count) to resume
+    from, or None when the document is ready or another worker is indexing it.
+    """
+    now = datetime.utcnow()
+    row = db.execute(
+        insert(PdfDocument.__table__)
+        .values(content_hash=content_hash, source_path=pdf_path,
+                status="indexing" if pages_total else "ready", pages_total=pages_total,
+                pages_indexed=0, chunk_count=0, ref_count=0,
+                created_at=now, updated_at=now, last_used_at=now)
+        .on_conflict_do_nothing(index_elements=["content_hash"])
+        .returning(PdfDocument.pages_indexed, PdfDocument.chunk_count)
+    ).first()
+    if row is None:
+        row = db.execute(
+            text("UPDATE pdf_documents SET status = 'indexing', updated_at = :now "
+                 "WHERE content_hash = :content_hash AND (status = 'failed' "
+                 "OR (status = 'indexing' AND updated_at < :stale)) "
+                 "RETURNING pages_indexed, chunk_count"),
+            {"content_hash": content_hash, "now": now,
+             "stale": now - timedelta(seconds=CHAT_INGEST_STALE_SECONDS)}
+        ).first()
+        if row is not None:
+            print(f"Resuming ingestion of {content_hash[:12]} from page {row[0]}")
+    db.commit()
+    return None if row is None else (row[0], row[1])
 
 
 
 
-def bulk_insert_chunks_fast(chunks: List[str], embeddings: List[List[float]], 
-                           session_id: str, pdf_path: str, db: Session):
-    """Ultra-fast bulk insert using SQLAlchemy Core"""
-    insert_data = []
-    for i, (chunk_text, embedding) in enumerate(zip(chunks, embeddings)):
-        insert_data.append({
-            'chunk_id': str(uuid4()),
-            'session_id': session_id,
-            'pdf_path': pdf_path,
-            'chunk_text': chunk_text,
-            'embedding': embedding,
-            'chunk_index': i,
-            'created_at': datetime.utcnow()
-        })
-    
-    db.bulk_insert_mappings(PdfChunk, insert_data)
+def commit_window(content_hash: str, start_page: int, end_page: int, chunk_offset: int,
+                  chunks: List[str], embeddings: List[List[float]], pdf_path: str) -> bool:
+    """
+    Store one window's chunks and advance pages_indexed (the heartbeat) in a
+    single transaction. False if another worker has taken the document over.
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        advanced = db.execute(
+            text("UPDATE pdf_documents SET pages_indexed = :end_page, chunk_count = chunk_count + :added, "
+                 "updated_at = :now, status = CASE WHEN :end_page >= pages_total THEN 'ready' ELSE status END "
+                 "WHERE content_hash = :content_hash AND status = 'indexing' AND pages_indexed = :start_page "
+                 "RETURNING content_hash"),
+            {"content_hash": content_hash, "start_page": start_page, "end_page": end_page,
+             "added": len(chunks), "now": now}
+        ).first()
+        if advanced is None:
+            db.rollback()
+            return False
+
+        db.bulk_insert_mappings(PdfChunk, [
+            {
+                'chunk_id': str(uuid4()),
+                'content_hash': content_hash,
+                'pdf_path': pdf_path,
+                'chunk_text': chunk_text,
+                'embedding': embedding,
+                'chunk_index': chunk_offset + i,
+                'created_at': now
+            }
+            for i, (chunk_text, embedding) in enumerate(zip(chunks, embeddings))
+        ])
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+
+
+def mark_document_failed(content_hash: str):
+    db = SessionLocal()
+    try:
+        db.execute(
+            text("UPDATE pdf_documents SET status = 'failed', updated_at = :now "
+                 "WHERE content_hash = :content_hash AND status = 'indexing'"),
+            {"content_hash": content_hash, "now": datetime.utcnow()}
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+
+
+def document_coverage(content_hash: str, db: Session) -> Dict[str, Any]:
+    row = db.execute(
+        text("SELECT status, pages_indexed, pages_total FROM pdf_documents WHERE content_hash = :content_hash"),
+        {"content_hash": content_hash}
+    ).first()
+    if row is None:
+        return {"status": "missing", "pages_indexed": 0, "pages_total": 0}
+    return {"status": row[0], "pages_indexed": row[1], "pages_total": row[2]}
+
+
+
+
+async def ingest_windows(pdf_bytes: bytes, content_hash: str, pdf_path: str, pages_total: int,
+                         page: int, chunk_offset: int, max_windows: int = None):
+    """
+    Chunk, embed and commit the document CHAT_INGEST_WINDOW_PAGES pages at a
+    time from `page` on. Returns (next page, next chunk index, still owner).
+    """
+    windows = 0
+    while page < pages_total and (max_windows is None or windows < max_windows):
+        end_page = min(page + CHAT_INGEST_WINDOW_PAGES, pages_total)
+        with timer(f"Ingest pages {page + 1}-{end_page} of {pages_total}"):
+            chunks = await asyncio.to_thread(chunk_pdf, pdf_bytes, None, range(page, end_page))
+            embeddings = await generate_embeddings_resilient(chunks, async_client) if chunks else []
+            if not await asyncio.to_thread(commit_window, content_hash, page, end_page, chunk_offset, chunks, embeddings, pdf_path):
+                print(f"Ingestion of {content_hash[:12]} was taken over by another worker")
+                return page, chunk_offset, False
+        page, chunk_offset, windows = end_page, chunk_offset + len(chunks), windows + 1
+    return page, chunk_offset, True
+
+
+
+
+async def _continue_ingestion(pdf_bytes: bytes, content_hash: str, pdf_path: str, pages_total: int,
+                              page: int, chunk_offset: int):
+    try:
+        await ingest_windows(pdf_bytes, content_hash, pdf_path, pages_total, page, chunk_offset)
+        print(f"Ingestion of {content_hash[:12]} finished")
+    except Exception as e:
+        print(f"Background ingestion of {content_hash[:12]} failed at page {page}: {str(e)}")
+        await asyncio.to_thread(mark_document_failed, content_hash)
+
+
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _ingestion_tasks.add(task)
+    task.add_done_callback(_ingestion_tasks.discard)
+
+
+
+
+def _spawn_ingestion(*args):
+    _spawn(_continue_ingestion(*args))
+
+
+
+
+async def resume_stale_ingestions():
+    """
+    On startup, pick up documents that sessions still use but whose indexer
+    died, and continue them from their last committed window.
+    """
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            text("SELECT content_hash, source_path FROM pdf_documents WHERE ref_count > 0 "
+                 "AND source_path IS NOT NULL AND (status = 'failed' OR (status = 'indexing' AND updated_at < :stale))"),
+            {"stale": datetime.utcnow() - timedelta(seconds=CHAT_INGEST_STALE_SECONDS)}
+        ).all()
+        for content_hash, source_path in rows:
+            try:
+                pdf_bytes = await asyncio.to_thread(download_file_bytes, source_path)
+            except Exception as e:
+                print(f"Cannot resume {content_hash[:12]}, source {source_path} unavailable: {str(e)}")
+                continue
+            if hashlib.sha256(pdf_bytes).hexdigest() != content_hash:
+                print(f"Cannot resume {content_hash[:12]}, {source_path} has changed")
+                continue
+            pages_total = await asyncio.to_thread(content_pages, pdf_bytes)
+            resume = claim_document(content_hash, pages_total, source_path, db)
+            if resume is not None:
+                _spawn_ingestion(pdf_bytes, content_hash, source_path, pages_total, *resume)
+    except Exception as e:
+        print(f"Resuming stale ingestions failed: {str(e)}")
+    finally:
+        db.close()
+
+
+
+
+def acquire_document(content_hash: str, db: Session) -> bool:
+    """Take a reference on an indexed document. False if it is not indexed (or was just collected)."""
+    row = db.execute(
+        text("UPDATE pdf_documents SET ref_count = ref_count + 1, last_used_at = :now "
+             "WHERE content_hash = :content_hash RETURNING content_hash"),
+        {"content_hash": content_hash, "now": datetime.utcnow()}
+    ).first()
     db.commit()
+    return row is not None
+
+
+
+
+def release_document(content_hash: str, db: Session):
+    db.execute(
+        text("UPDATE pdf_documents SET ref_count = GREATEST(ref_count - 1, 0), last_used_at = :now "
+             "WHERE content_hash = :content_hash"),
+        {"content_hash": content_hash, "now": datetime.utcnow()}
+    )
+
+
+
+
+def collect_unused_documents(db: Session) -> int:
+    """Delete documents no session has used for CHAT_INDEX_TTL_HOURS; their chunks cascade."""
+    result = db.execute(
+        text("DELETE FROM pdf_documents WHERE ref_count = 0 AND last_used_at < :cutoff"),
+        {"cutoff": datetime.utcnow() - timedelta(hours=CHAT_INDEX_TTL_HOURS)}
+    )
+    return result.rowcount
+
+
+
+
+async def search_chunks(db: AsyncSession, query_embedding: List[float], chunk_filter, top_k: int = 5, approximate: bool = False):
+    """
+    Nearest chunks to query_embedding among those matching chunk_filter, as rows
+    with chunk_id, chunk_index, chunk_text, pdf_path, content_hash and distance
+    (cosine).
+
+    A single document has at most a few hundred chunks, so it is searched
+    exactly: the filter runs on its btree index inside a materialized CTE,
+    which keeps the planner from walking the HNSW graph and dropping matches
+    that fall outside the ef_search candidates. approximate=True is for wide,
+    multi-document scopes; it uses the HNSW index with CHAT_HNSW_EF_SEARCH.
+    """
+    distance = PdfChunk.embedding.cosine_distance(query_embedding)
+    if approximate:
+        await db.execute(text(f"SET LOCAL hnsw.ef_search = {max(CHAT_HNSW_EF_SEARCH, top_k)}"))
+        if CHAT_HNSW_ITERATIVE_SCAN != "off":
+            await db.execute(text(f"SET LOCAL hnsw.iterative_scan = {CHAT_HNSW_ITERATIVE_SCAN}"))
+        result = await db.execute(
+            select(PdfChunk.chunk_id, PdfChunk.chunk_index, PdfChunk.chunk_text, PdfChunk.pdf_path,
+                   PdfChunk.content_hash, distance.label("distance"))
+            .where(chunk_filter)
+            .order_by(distance)
+            .limit(top_k)
+        )
+        return result.all()
+
+    scope = select(
+        PdfChunk.chunk_id, PdfChunk.chunk_index, PdfChunk.chunk_text, PdfChunk.pdf_path, PdfChunk.content_hash,
+        PdfChunk.embedding
+    ).where(chunk_filter).cte("scope").prefix_with("MATERIALIZED")
+    scope_distance = scope.c.embedding.cosine_distance(query_embedding)
+    result = await db.execute(
+        select(scope.c.chunk_id, scope.c.chunk_index, scope.c.chunk_text, scope.c.pdf_path,
+               scope.c.content_hash, scope_distance.label("distance"))
+        .order_by(scope_distance)
+        .limit(top_k)
+    )
+    return result.all()
 
 
 
 
 class EmbeddingOptimizer:
-    def __init__(self, client, max_retries=3, base_delay=1.0):
+    """
+    Embeds a list of chunks as token-packed batches, EMBEDDING_CONCURRENCY of
+    them in flight, drawing every batch's tokens from the shared
+    "openai_embeddings" tokens-per-minute bucket first.
+    """
+
+    def __init__(self, client, max_retries=3, base_delay=1.0, concurrency=EMBEDDING_CONCURRENCY,
+                 batch_tokens=EMBEDDING_BATCH_TOKENS, max_inputs=EMBEDDING_MAX_INPUTS,
+                 max_split_depth=EMBEDDING_MAX_SPLIT_DEPTH):
         self.client = client
         self.max_retries = max_retries
         self.base_delay = base_delay
+        self.concurrency = concurrency
+        self.batch_tokens = batch_tokens
+        self.max_inputs = max_inputs
+        self.max_split_depth = max_split_depth
         self.performance_stats = []
     
 
-    def get_adaptive_batch_size(self, total_chunks: int, recent_performance: List[float]) -> int:
-        """Dynamically adjust batch size based on recent API performance"""
-        if not recent_performance:
-            # Initial batch size based on document size
-            if total_chunks <= 50:
-                return 15
-            elif total_chunks <= 200:
-                return 20
-            elif total_chunks <= 500:
-                return 25
-            else:
-                return 30
-        
-        # If recent batches are slow, reduce batch size
-        avg_time_per_chunk = sum(recent_performance) / len(recent_performance)
-        
-        if avg_time_per_chunk > 0.5:  # If taking more than 0.5s per chunk
-            return max(10, total_chunks // 50)  # Smaller batches
-        elif avg_time_per_chunk < 0.1:  # If very fast
-            return min(40, total_chunks // 10)  # Larger batches
-        else:
-            return 20  # Default
+    @staticmethod
+    def splittable(error: Exception) -> bool:
+        """True for errors a smaller batch can get past: timeouts and inputs over the model's limits."""
+        if isinstance(error, (asyncio.TimeoutError, openai.APITimeoutError)):
+            return True
+        if isinstance(error, openai.BadRequestError):
+            message = str(error).lower()
+            return (error.code in ("context_length_exceeded", "max_tokens_per_request")
+                    or "maximum context length" in message or "tokens per request" in message)
+        return False
+    
+
+    def pack_batches(self, token_counts: List[int]) -> List[tuple]:
+        """Split chunk indices into (start, end, tokens) batches under batch_tokens and max_inputs."""
+        batches, start, tokens = [], 0, 0
+        for i, count in enumerate(token_counts):
+            if i > start and (tokens + count > self.batch_tokens or i - start >= self.max_inputs):
+                batches.append((start, i, tokens))
+                start, tokens = i, 0
+            tokens += count
+        if start < len(token_counts):
+            batches.append((start, len(token_counts), tokens))
+        return batches
     
 
-    async def generate_batch_with_retry(self, batch_chunks: List[str], 
-                                      batch_num: int, max_time_per_chunk: float = 0.3) -> List[List[float]]:
+    async def generate_batch_with_retry(self, batch_chunks: List[str], batch_num: int, tokens: int,
+                                      max_time_per_chunk: float = 0.3) -> List[List[float]]:
         """Generate embeddings for a batch with retry logic and timeout detection"""
         
         for attempt in range(self.max_retries + 1):
-            batch_start = time.time()
-            
             try:
-                print(f"Batch {batch_num}: Attempt {attempt + 1}, {len(batch_chunks)} chunks")
+                await acquire_async("openai_embeddings", tokens)
+                batch_start = time.time()
+                print(f"Batch {batch_num}: Attempt {attempt + 1}, {len(batch_chunks)} chunks, {tokens} tokens")
                 
                 # Set timeout based on batch size (max 0.3s per chunk + 5s buffer)
                 timeout = len(batch_chunks) * max_time_per_chunk + 5
+                try:
+                    response = await asyncio.wait_for(
+                        self.client.embeddings.create(
+                            input=batch_chunks,
+                            model=EMBEDDING_MODEL
+                        ),
+                        timeout=timeout
+                    )
+                except asyncio.TimeoutError:
+                    print(f" Batch {batch_num} timed out after {time.time() - batch_start:.2f}s "
+                          f"(expected max {timeout:.1f}s)")
+                    raise
                 
-                # Use asyncio for non-blocking call with timeout
-                loop = asyncio.get_event_loop()
-                with ThreadPoolExecutor() as executor:
-                    try:
-                        response = await asyncio.wait_for(
-                            loop.run_in_executor(
-                                executor,
-                                lambda: self.client.embeddings.create(
-                                    input=batch_chunks,
-                                    model="text-embedding-3-small"  #  Fastest OpenAI model
-                                )
-                            ),
-                            timeout=timeout
-                        )
-                        
-                        batch_time = time.time() - batch_start
-                        time_per_chunk = batch_time / len(batch_chunks)
-                        
-                        # Track performance
-                        self.performance_stats.append(time_per_chunk)
-                        if len(self.performance_stats) > 10:  # Keep only recent 10 batches
-                            self.performance_stats.pop(0)
-                        
-                        print(f" Batch {batch_num} completed in {batch_time:.2f}s "
-                              f"({time_per_chunk:.3f}s per chunk)")
-                        
-                        return [item.embedding for item in response.data]
-                        
-                    except asyncio.TimeoutError:
-                        batch_time = time.time() - batch_start
-                        print(f" Batch {batch_num} timed out after {batch_time:.2f}s "
-                              f"(expected max {timeout:.1f}s)")
-                        raise
+                batch_time = time.time() - batch_start
+                time_per_chunk = batch_time / len(batch_chunks)
                 
-            except (asyncio.TimeoutError, openai.RateLimitError, openai.APITimeoutError) as e:
+                # Track performance
+                self.performance_stats.append(time_per_chunk)
+                if len(self.performance_stats) > 10:  # Keep only recent 10 batches
+                    self.performance_stats.pop(0)
+                
+                print(f" Batch {batch_num} completed in {batch_time:.2f}s "
+                      f"({time_per_chunk:.3f}s per chunk, {tokens / batch_time:.0f} tokens/s)")
+                
+                return [item.embedding for item in response.data]
+                
+            except EMBEDDING_TRANSIENT_ERRORS as e:
                 if attempt < self.max_retries:
                     # Exponential backoff with jitter
                     delay = self.base_delay * (2 ** attempt) + random.uniform(0, 1)
                     print(f" Batch {batch_num} failed ({type(e).__name__}), retrying in {delay:.1f}s...")
+                    if isinstance(e, openai.RateLimitError):
+                        # Hold back every worker's batches, not just this one.
+                        penalize("openai_embeddings", delay)
                     await asyncio.sleep(delay)
                 else:
                     print(f" Batch {batch_num} failed after {self.max_retries + 1} attempts")
                     raise
-            
+    
+
+    async def embed(self, chunks: List[str]) -> List[List[float]]:
+        """
+        Embed all chunks, keeping their order. A batch that times out or is too
+        long is retried as two halves; any other failure cancels every batch.
+        """
+        token_counts = [count_tokens(chunk) for chunk in chunks]
+        batches = self.pack_batches(token_counts)
+        print(f" Packed {len(chunks)} chunks into {len(batches)} batches, {self.concurrency} in flight")
+        embeddings = [None] * len(chunks)
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def run(start, end, tokens, batch_num, max_time_per_chunk=0.3, depth=0):
+            try:
+                async with slots:
+                    result = await self.generate_batch_with_retry(
+                        chunks[start:end], batch_num, tokens, max_time_per_chunk
+                    )
+                embeddings[start:end] = result
+                return
             except Exception as e:
-                print(f" Batch {batch_num} unexpected error: {str(e)}")
-                if attempt < self.max_retries:
-                    delay = self.base_delay * (2 ** attempt)
-                    await asyncio.sleep(delay)
-                else:
+                if not self.splittable(e):
+                    print(f"Batch {batch_num} failed with {type(e).__name__}, not retrying: {e}")
                     raise
+                if end - start == 1 or depth >= self.max_split_depth:
+                    print(f"Complete failure on chunks {start}-{end - 1}: {e}")
+                    raise HTTPException(status_code=500,
+                                        detail=f"Failed to generate embeddings for chunks {start}-{end - 1}")
+            # Retry the batch as two halves with a more lenient timeout
+            print(f"Batch {batch_num} failed, trying with smaller batches...")
+            mid = (start + end) // 2
+            await asyncio.gather(
+                run(start, mid, sum(token_counts[start:mid]), f"{batch_num}a", 1.0, depth + 1),
+                run(mid, end, sum(token_counts[mid:end]), f"{batch_num}b", 1.0, depth + 1),
+            )
+
+        tasks = [
+            asyncio.create_task(run(start, end, tokens, batch_num))
+            for batch_num, (start, end, tokens) in enumerate(batches, start=1)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # Batches still queued for a slot would only fail the same way.
+            for task in tasks:
+                task.cancel()
+        return embeddings
 
 
 
 
 
 async def generate_embeddings_resilient(chunks: List[str], client) -> List[List[float]]:
-    """Resilient embedding generation with adaptive batching and retry logic"""
+    """Resilient embedding generation with token-packed concurrent batches and retry logic"""
     
     optimizer = EmbeddingOptimizer(client)
-    all_embeddings = []
-    
-    i = 0
-    batch_num = 1
-    
-    while i < len(chunks):
-        # Get adaptive batch size based on recent performance
-        batch_size = optimizer.get_adaptive_batch_size(len(chunks), optimizer.performance_stats)
-        
-        # Don't exceed remaining chunks
-        batch_size = min(batch_size, len(chunks) - i)
-        
-        batch_chunks = chunks[i:i + batch_size]
-        
-        print(f" Using batch size {batch_size} for batch {batch_num}/{(len(chunks) + batch_size - 1)//batch_size}")
-        
-        try:
-            batch_embeddings = await optimizer.generate_batch_with_retry(
-                batch_chunks, batch_num
-            )
-            all_embeddings.extend(batch_embeddings)
-            i += batch_size
-            batch_num += 1
-            
-        except Exception as e:
-            # If batch completely fails, try with smaller batch size
-            print(f"Batch failed, trying with smaller chunks...")
-            if batch_size > 5:
-                # Try with half the batch size
-                smaller_batch_size = max(5, batch_size // 2)
-                batch_chunks = chunks[i:i + smaller_batch_size]
-                
-                try:
-                    batch_embeddings = await optimizer.generate_batch_with_retry(
-                        batch_chunks, batch_num, max_time_per_chunk=0.5  # More lenient timeout
-                    )
-                    all_embeddings.extend(batch_embeddings)
-                    i += smaller_batch_size
-                    batch_num += 1
-                    continue
-                except Exception:
-                    pass
-            
-            # If all else fails, process one by one
-            print(f"Falling back to individual processing for chunk {i}")
-            try:
-                single_embedding = await optimizer.generate_batch_with_retry(
-                    [chunks[i]], batch_num, max_time_per_chunk=1.0
-                )
-                all_embeddings.extend(single_embedding)
-                i += 1
-                batch_num += 1
-            except Exception as final_e:
-                print(f"Complete failure on chunk {i}: {final_e}")
-                raise HTTPException(status_code=500, detail=f"Failed to generate embedding for chunk {i}")
+    all_embeddings = await optimizer.embed(chunks)
     
     # Print performance summary
     if optimizer.performance_stats:
@@ -258,7 +530,11 @@ async def generate_embeddings_resilient(chunks: List[str], client) -> List[List[
 
 
 async def start_chat_session_resilient(pdf_path: str, db: Session):
-    """Resilient version with adaptive batching and retry logic"""
+    """
+    Resilient version with adaptive batching and retry logic. Returns once the
+    first page window is indexed; "coverage" reports how much of the document
+    the session can search so far.
+    """
     total_start = time.time()
     print(f"Starting RESILIENT chat session for PDF: {pdf_path}")
 
@@ -275,16 +551,10 @@ async def start_chat_session_resilient(pdf_path: str, db: Session):
             detail="Invalid path – user segment missing"
         )
     
-    if not os.path.exists(PDF_DOWNLOAD_DIR):
-        os.makedirs(PDF_DOWNLOAD_DIR)
-    
     pdf_path = normalize_path(pdf_path)
     if not pdf_path.endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Invalid file path: must be a PDF")
     
-    pdf_filename = f"{uuid4()}.pdf"
-    local_path = os.path.join(PDF_DOWNLOAD_DIR, pdf_filename)
-    
     # PDF Download
     with timer("PDF Download from GCS"):
         try:
@@ -292,68 +562,93 @@ async def start_chat_session_resilient(pdf_path: str, db: Session):
             response = requests.get(presigned_url)
             response.raise_for_status()
             print(f"Downloaded PDF size: {len(response.content)} bytes")
-            with open(local_path, "wb") as f:
-                f.write(response.content)
         except Exception as e:
             raise HTTPException(status_code=404, detail=f"Failed to download PDF: {str(e)}")
     
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    pages_total = await asyncio.to_thread(content_pages, response.content)
+    resume = claim_document(content_hash, pages_total, pdf_path, db)
+    reused_index = resume is None
+    if reused_index:
+        print(f"Document {content_hash[:12]} already indexed or being indexed, skipping extraction and embedding")
+    else:
+        # Index the first window before answering so the session is queryable
+        # straight away; the rest is indexed in the background.
+        page, chunk_offset = resume
+        try:
+            page, chunk_offset, owner = await ingest_windows(
+                response.content, content_hash, pdf_path, pages_total, page, chunk_offset, max_windows=1
+            )
+        except Exception as e:
+            print(f"PDF processing error: {str(e)}")
+            await asyncio.to_thread(mark_document_failed, content_hash)
+            raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+        if owner and page < pages_total:
+            _spawn_ingestion(response.content, content_hash, pdf_path, pages_total, page, chunk_offset)
+    
+    if not acquire_document(content_hash, db):
+        raise HTTPException(status_code=409, detail="Document index was just garbage collected, please retry")
+    
     # Database Session Creation
     with timer("Database Session Creation"):
-        session = Session(session_id=uuid4(), pdf_path=pdf_path, created_at=datetime.utcnow())
+        session = Session(session_id=uuid4(), pdf_path=pdf_path, content_hash=content_hash, created_at=datetime.utcnow())
         db.add(session)
-        db.commit()
+        try:
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            release_document(content_hash, db)
+            db.commit()
+            raise HTTPException(status_code=500, detail=f"Error creating session: {str(e)}")
         db.refresh(session)
         print(f"Created session: {session.session_id}")
     
-    try:
-        # Ultra-Fast PDF Text Extraction
-        with timer("Ultra-Fast PDF Text Extraction (PyMuPDF)"):
-            text = extract_text_fast(local_path)
-            print(f"Total extracted text length: {len(text)} characters")
-        
-        # Text Chunking
-        with timer("Text Chunking"):
-            chunk_size = 1000
-            chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
-            chunks = [chunk for chunk in chunks if chunk.strip()]
-            print(f"Created {len(chunks)} chunks")
-        
-        # Resilient Batch Embedding Generation
-        with timer("Resilient Batch Embedding Generation"):
-            all_embeddings = await generate_embeddings_resilient(chunks, client)
-        
-        # Ultra-Fast Bulk Database Insert
-        with timer("Ultra-Fast Bulk Database Insert"):
-            bulk_insert_chunks_fast(chunks, all_embeddings, session.session_id, pdf_path, db)
-            print(f"Inserted {len(chunks)} chunks to database")
-        
-    except Exception as e:
-        print(f"PDF processing error: {str(e)}")
-        db.delete(session)
-        db.commit()
-        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
-    finally:
-        with timer("File Cleanup"):
-            try:
-                if os.path.exists(local_path):
-                    os.remove(local_path)
-                    print(f" Deleted local file: {local_path}")
-            except Exception as e:
-                print(f" Warning: Failed to delete PDF file {local_path}: {str(e)}")
-    
     total_time = time.time() - total_start
     print(f"RESILIENT TOTAL TIME: {total_time:.2f} seconds")
     
-    return {"session_id": str(session.session_id), "message": "Chat session started"}
+    return {
+        "session_id": str(session.session_id),
+        "message": "Chat session started",
+        "reused_index": reused_index,
+        "coverage": document_coverage(content_hash, db)
+    }
 
 
 
 
 
 
-async def chat_with_pdf_timed(session_id: str, pdf_path: str, query: str, db: Session, top_k: int = 5):
-    """Query PDF chunks with detailed timing analysis."""
-    total_start = time.time()
+async def embed_query(query: str) -> List[float]:
+    # TIMING: Query Embedding Generation
+    with timer("Query Embedding Generation"):
+        try:
+            query_embedding = await asyncio.to_thread(chat_cache.get_query_embedding, query, EMBEDDING_MODEL)
+            if query_embedding is not None:
+                print("Query embedding served from cache")
+            else:
+                async with _embedding_slots:
+                    response = await async_client.embeddings.create(
+                        input=query, 
+                        model=EMBEDDING_MODEL
+                    )
+                query_embedding = response.data[0].embedding
+                await asyncio.to_thread(chat_cache.put_query_embedding, query, EMBEDDING_MODEL, query_embedding)
+            print(f"Generated query embedding, length: {len(query_embedding)}")
+        except Exception as e:
+            print(f"Query embedding error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error generating query embedding: {str(e)}")
+    return query_embedding
+
+
+
+
+async def prepare_chat(session_id: str, pdf_path: str, query: str, db: AsyncSession, top_k: int = 5) -> Dict[str, Any]:
+    """
+    Everything before the completion: validate the session, embed the query,
+    retrieve chunks and build the context. Every upstream call is awaited
+    (AsyncOpenAI, asyncpg), so one worker serves many chats at once. "answer"
+    is already set when the answer cache has it.
+    """
     print(f" Starting chat with PDF: {pdf_path}, Session: {session_id}")
     print(f"Query: {query}")
     
@@ -361,36 +656,40 @@ async def chat_with_pdf_timed(session_id: str, pdf_path: str, query: str, db: Se
     
     # TIMING: Session Validation
     with timer("Session Validation"):
-        session = db.query(Session).filter(
-            Session.session_id == session_id, 
-            Session.pdf_path == pdf_path
-        ).first()
+        try:
+            session_id = UUID(str(session_id))
+        except ValueError:
+            raise HTTPException(status_code=404, detail="Session or PDF not found")
+        async with _db_slots:
+            row = (await db.execute(
+                select(Session, PdfDocument.status, PdfDocument.pages_indexed, PdfDocument.pages_total)
+                .outerjoin(PdfDocument, PdfDocument.content_hash == Session.content_hash)
+                .where(
+                    Session.session_id == session_id, 
+                    Session.pdf_path == pdf_path
+                )
+            )).first()
+            session = row[0] if row else None
+            # End the read so the connection goes back to the pool during upstream calls.
+            await db.commit()
         if not session:
             print(f" Session not found: {session_id}")
             raise HTTPException(status_code=404, detail="Session or PDF not found")
         print(f" Session validated: {session_id}")
     
-    # TIMING: Query Embedding Generation
-    with timer("Query Embedding Generation"):
-        try:
-            response = client.embeddings.create(
-                input=query, 
-                model="text-embedding-3-small"  # Still using old model here
-            )
-            query_embedding = response.data[0].embedding
-            print(f"Generated query embedding, length: {len(query_embedding)}")
-        except Exception as e:
-            print(f"Query embedding error: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Error generating query embedding: {str(e)}")
+    query_embedding = await embed_query(query)
     
     # TIMING: Vector Similarity Search
     with timer("Vector Similarity Search"):
         try:
-            chunks = db.query(PdfChunk).filter(
-                PdfChunk.session_id == session_id
-            ).order_by(
-                PdfChunk.embedding.cosine_distance(query_embedding)
-            ).limit(top_k).all()
+            # Sessions from before the shared document index own their chunks directly.
+            if session.content_hash:
+                chunk_filter = PdfChunk.content_hash == session.content_hash
+            else:
+                chunk_filter = PdfChunk.session_id == session_id
+            async with _db_slots:
+                chunks = await search_chunks(db, query_embedding, chunk_filter, top_k)
+                await db.commit()
             
             if not chunks:
                 print(" No chunks found for session")
@@ -399,8 +698,7 @@ async def chat_with_pdf_timed(session_id: str, pdf_path: str, query: str, db: Se
             
             # Print similarity scores for debugging
             for i, chunk in enumerate(chunks):
-                # Note: This is approximate since we can't easily get the actual distance
-                print(f"  Chunk {i+1}: Index {chunk.chunk_index}, Length: {len(chunk.chunk_text)} chars")
+                print(f"  Chunk {i+1}: Index {chunk.chunk_index}, Distance: {chunk.distance:.4f}, Length: {len(chunk.chunk_text)} chars")
                 
         except Exception as e:
             print(f" Vector search error: {str(e)}")
@@ -411,33 +709,92 @@ async def chat_with_pdf_timed(session_id: str, pdf_path: str, query: str, db: Se
         context = "\n".join(f"Chunk {chunk.chunk_index}: {chunk.chunk_text}" for chunk in chunks)
         print(f"Context length: {len(context)} characters")
     
+    # Same question on the same retrieved chunks of the same document: reuse the answer.
+    answer_key = chat_cache.answer_key(
+        session.content_hash or session_id, query, [chunk.chunk_id for chunk in chunks], CHAT_MODEL
+    )
+    answer = await asyncio.to_thread(chat_cache.get_answer, answer_key)
+    if answer is not None:
+        print("Answer served from cache")
+    
+    return {
+        "query": query,
+        "context": context,
+        "chunks": chunks,
+        # Legacy per-session chunks are always complete.
+        "coverage": {"status": row.status, "pages_indexed": row.pages_indexed, "pages_total": row.pages_total}
+        if session.content_hash else {"status": "ready"},
+        "answer_key": answer_key,
+        "answer": answer,
+    }
+
+
+
+
+def _chat_prompt(prepared: Dict[str, Any]) -> str:
+    return f"Based on the following PDF content, answer the query: {prepared['query']}\n\nContent:\n{prepared['context']}"
+
+
+
+
+def _relevant_chunks(prepared: Dict[str, Any]) -> List[Dict[str, Any]]:
+    sources = prepared.get("sources")
+    if sources is None:
+        return [
+            {"chunk_index": chunk.chunk_index, "chunk_text": chunk.chunk_text}
+            for chunk in prepared["chunks"]
+        ]
+    return [
+        {"pdf_path": sources[chunk.content_hash], "chunk_index": chunk.chunk_index, "chunk_text": chunk.chunk_text}
+        for chunk in prepared["chunks"]
+    ]
+
+
+
+
+async def complete_chat(prepared: Dict[str, Any]) -> Dict[str, Any]:
+    """Answer a prepared chat (or take its cached answer) and build the response."""
+    answer = prepared["answer"]
+    
     # TIMING: LLM Response Generation
-    with timer("LLM Response Generation"):
-        try:
-            prompt = f"Based on the following PDF content, answer the query: {query}\n\nContent:\n{context}"
-            print(f"Prompt length: {len(prompt)} characters")
-            
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=200
-            )
-            answer = response.choices[0].message.content.strip()
-            print(f"Generated LLM response: {answer[:100]}...")
-            
-        except Exception as e:
-            print(f" LLM error: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
+    if answer is None:
+        with timer("LLM Response Generation"):
+            try:
+                prompt = _chat_prompt(prepared)
+                print(f"Prompt length: {len(prompt)} characters")
+                
+                async with _completion_slots:
+                    response = await async_client.chat.completions.create(
+                        model=CHAT_MODEL,
+                        messages=[{"role": "user", "content": prompt}],
+                        max_tokens=CHAT_MAX_TOKENS
+                    )
+                answer = response.choices[0].message.content.strip()
+                print(f"Generated LLM response: {answer[:100]}...")
+                
+            except Exception as e:
+                print(f" LLM error: {str(e)}")
+                raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
+        await asyncio.to_thread(chat_cache.put_answer, prepared["answer_key"], answer)
     
     # TIMING: Response Preparation
     with timer("Response Preparation"):
         result = {
             "answer": answer,
-            "relevant_chunks": [
-                {"chunk_index": chunk.chunk_index, "chunk_text": chunk.chunk_text}
-                for chunk in chunks
-            ]
+            "cached": prepared["answer"] is not None,
+            "coverage": prepared["coverage"],
+            "relevant_chunks": _relevant_chunks(prepared)
         }
+    return result
+
+
+
+
+async def chat_with_pdf_timed(session_id: str, pdf_path: str, query: str, db: AsyncSession, top_k: int = 5):
+    """Query PDF chunks with detailed timing analysis."""
+    total_start = time.time()
+    prepared = await prepare_chat(session_id, pdf_path, query, db, top_k)
+    result = await complete_chat(prepared)
     
     total_time = time.time() - total_start
     print(f"TOTAL CHAT TIME: {total_time:.3f} seconds")
@@ -447,10 +804,450 @@ async def chat_with_pdf_timed(session_id: str, pdf_path: str, query: str, db: Se
 
 
 
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+
+
+async def stream_chat_answer(prepared: Dict[str, Any], request: Request):
+    """
+    Server-sent events for a prepared chat: "chunks" (references and coverage)
+    first, then one "token" event per completion delta, then "done" with the
+    full answer, or "error". When the client disconnects the completion stream
+    is closed, which stops generation upstream; partial answers are not cached.
+    """
+    total_start = time.time()
+    yield _sse("chunks", {
+        "relevant_chunks": _relevant_chunks(prepared),
+        "coverage": prepared["coverage"],
+        "cached": prepared["answer"] is not None,
+    })
+    
+    if prepared["answer"] is not None:
+        yield _sse("token", {"delta": prepared["answer"]})
+        yield _sse("done", {"answer": prepared["answer"]})
+        return
+    
+    parts, stream, completed = [], None, False
+    try:
+        async with _completion_slots:
+            stream = await async_client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=[{"role": "user", "content": _chat_prompt(prepared)}],
+                max_tokens=CHAT_MAX_TOKENS,
+                stream=True
+            )
+            async for event in stream:
+                delta = event.choices[0].delta.content if event.choices else None
+                if not delta:
+                    continue
+                if not parts:
+                    print(f"Time to first token: {time.time() - total_start:.2f} seconds")
+                parts.append(delta)
+                yield _sse("token", {"delta": delta})
+                if await request.is_disconnected():
+                    print("Client disconnected – stopping completion")
+                    return
+        completed = True
+    except Exception as e:
+        print(f" LLM streaming error: {str(e)}")
+        yield _sse("error", {"status_code": 500, "detail": f"Error generating response: {str(e)}"})
+        return
+    finally:
+        if stream is not None and not completed:
+            await stream.close()
+    
+    answer = "".join(parts).strip()
+    await asyncio.to_thread(chat_cache.put_answer, prepared["answer_key"], answer)
+    print(f"STREAMED CHAT TIME: {time.time() - total_start:.3f} seconds")
+    yield _sse("done", {"answer": answer})
+
+
+
+
+
+
+def project_includes_path(user_id: str, project_name: str) -> str:
+    return normalize_path(f"users/{user_id}/{project_name}/includes")
+
+
+
+
+def _add_project_file(project_path: str, pdf_path: str, source_md5: str, content_hash: str, pages_total: int):
+    """Claim the document and record the membership; the ingestion resume point, if any."""
+    db = SessionLocal()
+    try:
+        resume = claim_document(content_hash, pages_total, pdf_path, db)
+        # The project was deleted while this file was downloading.
+        if (project_path, pdf_path) not in _pending_project_files:
+            return resume
+        added = db.execute(
+            insert(ProjectDocument.__table__)
+            .values(project_path=project_path, pdf_path=pdf_path, content_hash=content_hash,
+                    source_md5=source_md5, added_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=["project_path", "pdf_path"])
+            .returning(ProjectDocument.content_hash)
+        ).first()
+        db.commit()
+        if added is not None:
+            acquire_document(content_hash, db)
+        return resume
+    finally:
+        db.close()
+
+
+
+
+async def _index_project_file(project_path: str, pdf_path: str, source_md5: str):
+    """
+    Add one PDF to a project: hash it, index it unless its content already is,
+    and record the membership, which holds a reference on the document.
+    """
+    try:
+        async with _project_ingest_slots:
+            pdf_bytes = await asyncio.to_thread(download_file_bytes, pdf_path)
+            content_hash = hashlib.sha256(pdf_bytes).hexdigest()
+            pages_total = await asyncio.to_thread(content_pages, pdf_bytes)
+            resume = await asyncio.to_thread(_add_project_file, project_path, pdf_path, source_md5,
+                                             content_hash, pages_total)
+            if resume is not None:
+                await _continue_ingestion(pdf_bytes, content_hash, pdf_path, pages_total, *resume)
+    except Exception as e:
+        print(f"Indexing {pdf_path} for project {project_path} failed: {str(e)}")
+    finally:
+        _pending_project_files.discard((project_path, pdf_path))
+
+
+
+
+def _drop_project_files(project_path: str, listed: Dict[str, str]):
+    """
+    Remove the memberships whose file disappeared from the listing (excluded,
+    deleted, or replaced) and release their document references; returns the
+    paths the index knew and the ones removed.
+    """
+    db = SessionLocal()
+    try:
+        known = dict(db.execute(
+            select(ProjectDocument.pdf_path, ProjectDocument.source_md5)
+            .where(ProjectDocument.project_path == project_path)
+        ).all())
+        # A missing MD5 (composite upload) gives no signal of change, so the file is kept.
+        removed = [path for path, md5 in known.items()
+                   if path not in listed or (listed[path] and md5 and listed[path] != md5)]
+        for pdf_path in removed:
+            row = db.execute(
+                text("DELETE FROM project_documents WHERE project_path = :project_path AND pdf_path = :pdf_path "
+                     "RETURNING content_hash"),
+                {"project_path": project_path, "pdf_path": pdf_path}
+            ).first()
+            if row is not None:
+                release_document(row[0], db)
+        db.commit()
+        return known, removed
+    finally:
+        db.close()
+
+
+
+
+async def sync_project_index(project_path: str) -> Dict[str, int]:
+    """
+    Bring a project's index in line with the PDFs under its includes/ folder.
+    Only the difference is touched: files that disappeared (excluded, deleted,
+    or replaced) drop their membership and document reference, and new or
+    replaced files are indexed in the background. Content already indexed for
+    any session or project is reused.
+    """
+    with timer("Project listing"):
+        listed = await asyncio.to_thread(list_pdf_blobs, project_path)
+    known, removed = await asyncio.to_thread(_drop_project_files, project_path, listed)
+
+    added = [path for path in listed if (path not in known or path in removed)
+             and (project_path, path) not in _pending_project_files]
+    for pdf_path in added:
+        _pending_project_files.add((project_path, pdf_path))
+        _spawn(_index_project_file(project_path, pdf_path, listed[pdf_path]))
+
+    print(f"Project {project_path}: {len(listed)} PDFs, {len(added)} added, {len(removed)} removed")
+    return {"documents": len(listed), "added": len(added), "removed": len(removed)}
+
+
+
+
+def _has_project_index(project_path: str) -> bool:
+    db = SessionLocal()
+    try:
+        return db.execute(
+            select(ProjectDocument.pdf_path).where(ProjectDocument.project_path == project_path).limit(1)
+        ).first() is not None
+    finally:
+        db.close()
+
+
+
+
+async def _sync_project_in_background(project_path: str):
+    try:
+        if await asyncio.to_thread(_has_project_index, project_path):
+            await sync_project_index(project_path)
+    except Exception as e:
+        print(f"Project sync of {project_path} failed: {str(e)}")
+
+
+
+
+def schedule_project_sync(project_path: str):
+    """Re-sync a project's index after its includes/ folder changed, if it has one."""
+    _spawn(_sync_project_in_background(project_path))
+
+
+
+
+def _drop_project_rows(project_path: str, session_prefix: str) -> int:
+    db = SessionLocal()
+    try:
+        released = db.execute(
+            text("DELETE FROM project_documents WHERE project_path = :project_path RETURNING content_hash"),
+            {"project_path": project_path}
+        ).all()
+        # Legacy per-session chunks go first, as end_chat_session_timed does.
+        db.execute(
+            text("DELETE FROM pdf_chunks WHERE session_id IN "
+                 "(SELECT session_id FROM sessions WHERE left(pdf_path, length(:prefix)) = :prefix)"),
+            {"prefix": session_prefix}
+        )
+        sessions = db.execute(
+            text("DELETE FROM sessions WHERE left(pdf_path, length(:prefix)) = :prefix RETURNING content_hash"),
+            {"prefix": session_prefix}
+        ).all()
+        for content_hash in [row[0] for row in released + sessions if row[0]]:
+            release_document(content_hash, db)
+        collected = collect_unused_documents(db)
+        db.commit()
+        return collected
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+
+
+async def drop_project_index(project_path: str):
+    """
+    Forget a deleted project: its memberships and chat sessions go, with the
+    document references they held, so the indexes can be collected. Files
+    still being indexed are not recorded.
+    """
+    project_path = normalize_path(project_path)
+    for key in [key for key in _pending_project_files if key[0] == project_path]:
+        _pending_project_files.discard(key)
+    collected = await asyncio.to_thread(_drop_project_rows, project_path, project_path.rsplit("/", 1)[0] + "/")
+    if collected:
+        print(f"Garbage collected {collected} unused document index(es)")
+
+
+
+
+def _project_coverage(row, project_path: str) -> Dict[str, Any]:
+    documents, documents_ready, pages_indexed, pages_total = row
+    pending = sum(1 for project, _ in _pending_project_files if project == project_path)
+    return {
+        "status": "ready" if documents == documents_ready and not pending else "indexing",
+        "documents": documents,
+        "documents_ready": documents_ready,
+        "documents_pending": pending,
+        "pages_indexed": pages_indexed or 0,
+        "pages_total": pages_total or 0,
+    }
+
+
+
+
+def _project_coverage_query(project_path: str):
+    return (
+        select(
+            func.count(PdfDocument.content_hash),
+            func.count(PdfDocument.content_hash).filter(PdfDocument.status == "ready"),
+            func.sum(PdfDocument.pages_indexed),
+            func.sum(PdfDocument.pages_total),
+        )
+        .select_from(ProjectDocument)
+        .join(PdfDocument, PdfDocument.content_hash == ProjectDocument.content_hash)
+        .where(ProjectDocument.project_path == project_path)
+    )
+
+
+
+
+def _create_project_session(project_path: str, db: Session):
+    session_id = uuid4()
+    db.add(Session(session_id=session_id, pdf_path=project_path, project_path=project_path, created_at=datetime.utcnow()))
+    try:
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return session_id, db.execute(_project_coverage_query(project_path)).one()
+
+
+
+
+async def start_project_chat_session(project_path: str, db: Session):
+    """
+    Start a chat over every PDF included in a project. The index is synced
+    first; files still being indexed become searchable window by window, and
+    "coverage" reports how far along the project is.
+    """
+    total_start = time.time()
+    project_path = normalize_path(project_path)
+    parts = project_path.split("/")
+    if len(parts) != 4 or parts[0] != "users" or parts[3] != "includes":
+        raise HTTPException(status_code=400, detail="Invalid project path – expected users/{id}/{project}/includes")
+
+    try:
+        index = await sync_project_index(project_path)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error indexing project: {str(e)}")
+    if not index["documents"]:
+        raise HTTPException(status_code=404, detail="No included PDFs in this project")
+
+    with timer("Database Session Creation"):
+        try:
+            session_id, coverage_row = await asyncio.to_thread(_create_project_session, project_path, db)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error creating session: {str(e)}")
+        print(f"Created project session: {session_id}")
+
+    print(f"PROJECT SESSION TOTAL TIME: {time.time() - total_start:.2f} seconds")
+    return {
+        "session_id": str(session_id),
+        "message": "Project chat session started",
+        "index": index,
+        "coverage": _project_coverage(coverage_row, project_path)
+    }
+
+
+
+
+def diversify_chunks(candidates, top_k: int, max_per_document: int = PROJECT_CHAT_MAX_PER_DOCUMENT):
+    """
+    Best top_k of the distance-ordered candidates, at most max_per_document from
+    any one document; if too few documents match, the best remaining
+    candidates fill the rest.
+    """
+    picked, overflow, per_document = [], [], {}
+    for chunk in candidates:
+        if per_document.get(chunk.content_hash, 0) < max_per_document:
+            per_document[chunk.content_hash] = per_document.get(chunk.content_hash, 0) + 1
+            picked.append(chunk)
+        else:
+            overflow.append(chunk)
+        if len(picked) == top_k:
+            return picked
+    picked.extend(overflow[:top_k - len(picked)])
+    return sorted(picked, key=lambda chunk: chunk.distance)
+
+
+
+
+async def prepare_project_chat(session_id: str, project_path: str, query: str, db: AsyncSession, top_k: int = 5) -> Dict[str, Any]:
+    """
+    prepare_chat for a project session: one approximate (HNSW) search over the
+    chunks of every document in the project, diversified per document.
+    """
+    print(f" Starting project chat: {project_path}, Session: {session_id}")
+    print(f"Query: {query}")
+    project_path = normalize_path(project_path)
+
+    with timer("Session Validation"):
+        try:
+            session_id = UUID(str(session_id))
+        except ValueError:
+            raise HTTPException(status_code=404, detail="Session or project not found")
+        async with _db_slots:
+            session = (await db.execute(
+                select(Session.session_id)
+                .where(Session.session_id == session_id, Session.project_path == project_path)
+            )).first()
+            sources = {}
+            for content_hash, pdf_path in (await db.execute(
+                select(ProjectDocument.content_hash, ProjectDocument.pdf_path)
+                .where(ProjectDocument.project_path == project_path)
+                .order_by(ProjectDocument.pdf_path)
+            )).all():
+                sources.setdefault(content_hash, pdf_path)
+            coverage = _project_coverage((await db.execute(_project_coverage_query(project_path))).one(), project_path)
+            await db.commit()
+        if not session:
+            raise HTTPException(status_code=404, detail="Session or project not found")
+        if not sources:
+            raise HTTPException(status_code=404, detail="No indexed documents in this project yet")
+
+    query_embedding = await embed_query(query)
+
+    with timer("Vector Similarity Search"):
+        try:
+            project_hashes = select(ProjectDocument.content_hash).where(ProjectDocument.project_path == project_path)
+            async with _db_slots:
+                candidates = await search_chunks(
+                    db, query_embedding, PdfChunk.content_hash.in_(project_hashes),
+                    top_k * PROJECT_CHAT_CANDIDATES, approximate=True
+                )
+                await db.commit()
+        except Exception as e:
+            print(f" Vector search error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error retrieving chunks: {str(e)}")
+        # Drop chunks of a document that left the project between the two reads.
+        chunks = diversify_chunks([c for c in candidates if c.content_hash in sources], top_k)
+        if not chunks:
+            raise HTTPException(status_code=404, detail="No relevant chunks found")
+        print(f" Retrieved {len(chunks)} chunks from {len({c.content_hash for c in chunks})} documents "
+              f"out of {len(candidates)} candidates")
+
+    context = "\n".join(
+        f"[{os.path.basename(sources[chunk.content_hash])}] Chunk {chunk.chunk_index}: {chunk.chunk_text}"
+        for chunk in chunks
+    )
+    answer_key = chat_cache.answer_key(project_path, query, [chunk.chunk_id for chunk in chunks], CHAT_MODEL)
+    answer = await asyncio.to_thread(chat_cache.get_answer, answer_key)
+    if answer is not None:
+        print("Answer served from cache")
+
+    return {
+        "query": query,
+        "context": context,
+        "chunks": chunks,
+        "sources": sources,
+        "coverage": coverage,
+        "answer_key": answer_key,
+        "answer": answer,
+    }
+
+
+
+
+async def chat_with_project(session_id: str, project_path: str, query: str, db: AsyncSession, top_k: int = 5):
+    total_start = time.time()
+    prepared = await prepare_project_chat(session_id, project_path, query, db, top_k)
+    result = await complete_chat(prepared)
+    print(f"TOTAL PROJECT CHAT TIME: {time.time() - total_start:.3f} seconds")
+    return result
+
+
+
+
 
 
 async def end_chat_session_timed(session_id: str, user_id: str, db: Session):
-    """End a chat session by deleting it and its associated chunks."""
+    """
+    End a chat session. Its document index stays for other sessions and is
+    collected once unused for CHAT_INDEX_TTL_HOURS; legacy per-session chunks
+    are deleted with the session.
+    """
     print(f"Ending session: {session_id} for user: {user_id}")
     session = db.query(Session).filter(Session.session_id == session_id).first()
     if not session:
@@ -461,12 +1258,18 @@ async def end_chat_session_timed(session_id: str, user_id: str, db: Session):
         print(f"Unauthorized attempt to delete session {session_id} by user {user_id}")
         raise HTTPException(status_code=403, detail="Unauthorized access to session")
     try:
+        content_hash = session.content_hash
         # Delete chunks first using raw SQL (fast)
         db.execute(text("DELETE FROM pdf_chunks WHERE session_id = :session_id"), {"session_id": session_id})
         # Delete session using raw SQL
         db.execute(text("DELETE FROM sessions WHERE session_id = :session_id"), {"session_id": session_id})
+        if content_hash:
+            release_document(content_hash, db)
+        collected = collect_unused_documents(db)
         db.commit()
         print(f"Session {session_id} deleted successfully")
+        if collected:
+            print(f"Garbage collected {collected} unused document index(es)")
     except Exception as e:
         print(f"Error deleting session {session_id}: {str(e)}")
         db.rollback()
@@ -1,13 +1,18 @@
-from io import BytesIO
-import os
-from pdf2image import convert_from_bytes
-from services.image_extractor_services import extract_images_from_pdf, download_image
-from services.table_extractor_services import extract_tables_from_image
-import zipfile, csv
-from io import StringIO
+import os, asyncio, threading
+import fitz
 from fastapi import UploadFile, Request
-from core.utils.aws_utils import bucket_name, s3_client
+from services.image_extractor_services import page_images, upload_images
+from services.table_extractor_services import (
+    extract_tables_from_image, rows_to_csv, _native_page_tables, _page_csvs, page_render_dpi,
+    TABLE_VISION_CONCURRENCY, RASTER_MAX_PAGES_IN_MEMORY, NATIVE_TABLE_MIN_CONFIDENCE, JPEG_QUALITY
+)
 from core.utils.gcp_utils import upload_csv_file
+from core.utils.pdf_utils import table_scan, TABLE_CANDIDATE_THRESHOLD
+from core.utils.progress import report_progress
+
+
+# How often a walker waiting for a page slot checks whether the extraction was abandoned.
+PAGE_SLOT_POLL_SECONDS = 0.5
 
 
 
@@ -22,34 +27,121 @@ async def extract_table_and_image(request:Request, project_name:str, file: Uploa
     img_dir = os.path.join(dir,"pdfImages", file_name)
     csv_dir = f"{dir}/csv"
 
-    images = await extract_images_from_pdf(pdf_bytes, img_dir)
-    if images:
-        print("HIIIIIIIIIII")
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    vision_slots = asyncio.Semaphore(TABLE_VISION_CONCURRENCY)
+    page_slots = threading.Semaphore(RASTER_MAX_PAGES_IN_MEMORY)
+    # Set when this coroutine ends for any reason. A cancelled page task never
+    # releases its slot, so the walker must not wait on page_slots alone.
+    stop = threading.Event()
 
-    images_for_tables = convert_from_bytes(pdf_bytes)
-    csv_buffers = []
+    def emit(item):
+        if not stop.is_set():
+            loop.call_soon_threadsafe(queue.put_nowait, item)
 
-    for i, image in enumerate(images_for_tables):
-        img_bytes = BytesIO()
-        image.save(img_bytes, format="JPEG")
-        img_bytes.seek(0)
+    async def page_tables(item):
+        if item["jpeg"] is None:
+            return item["page_number"], [rows_to_csv(rows) for rows in item["native_tables"]]
+        try:
+            async with vision_slots:
+                extracted_table = await asyncio.to_thread(extract_tables_from_image, item["jpeg"])
+        finally:
+            item["jpeg"] = None
+            page_slots.release()
+        return item["page_number"], _page_csvs(extracted_table, item["native_tables"])
 
-        extracted_table = extract_tables_from_image(img_bytes.read())
+    # The document is opened once and walked once in a worker thread; image
+    # uploads and table calls start as soon as each page has been read.
+    walker = asyncio.create_task(asyncio.to_thread(_walk_pages, pdf_bytes, emit, page_slots, stop))
+    image_tasks, table_tasks = [], []
+    page_count = pages_skipped = 0
 
-        if extracted_table and extracted_table.strip() != "No table found.":
-            print(f"Extracted Table from page {i + 1}:")
-            print(extracted_table)
-            key = f"{csv_dir}/extracted_table_page_{i + 1}.csv" 
-            csv_buffer = StringIO()
-            csv_writer = csv.writer(csv_buffer)
+    try:
+        while (item := await queue.get()) is not None:
+            page_count += 1
+            if item["images"]:
+                image_tasks.append(asyncio.create_task(upload_images(item["images"], img_dir)))
+            if item["candidate"]:
+                table_tasks.append(asyncio.create_task(page_tables(item)))
+            else:
+                pages_skipped += 1
+            report_progress(stage="reading_pages", done=page_count)
 
-            table_lines = extracted_table.split('\n')
-            for line in table_lines:
-                if line.strip():
-                    csv_writer.writerow([cell.strip() for cell in line.split('|')])
+        await walker
+        images = list(dict.fromkeys(url for urls in await asyncio.gather(*image_tasks) for url in urls))
+        tables = sorted(await asyncio.gather(*table_tasks), key=lambda page: page[0])
+    finally:
+        stop.set()
+        for task in image_tasks + table_tasks:
+            task.cancel()
+    print(f"Combined extraction: {len(images)} image(s), {len(table_tasks)} table candidate page(s), {pages_skipped} skipped")
 
-            csv_buffers.append((f"extracted_table_page_{i + 1}.csv", csv_buffer))
-            upload_csv_file(path=key,file=csv_buffer.getvalue())
+    csv_buffers = []
+    for page_number, page_tables in tables:
+        if page_tables:
+            print(f"Extracted {len(page_tables)} table(s) from page {page_number}")
+            for table_index, csv_buffer in enumerate(page_tables, start=1):
+                suffix = f"{page_number}" if len(page_tables) == 1 else f"{page_number}_{table_index}"
+                key = f"{csv_dir}/extracted_table_page_{suffix}.csv" 
+                csv_buffers.append((f"extracted_table_page_{suffix}.csv", csv_buffer))
+                upload_csv_file(path=key,file=csv_buffer.getvalue())
         else:
-            print(f"No table detected on page {i + 1}.")
-    return {"message": "Combined extraction done!"}
+            print(f"No table detected on page {page_number}.")
+    return {"message": "Combined extraction done!", "pages_skipped": pages_skipped}
+
+
+
+
+
+def _take_page_slot(page_slots, stop) -> bool:
+    """Wait for a page slot; False if the extraction is abandoned first."""
+    while not stop.is_set():
+        if page_slots.acquire(timeout=PAGE_SLOT_POLL_SECONDS):
+            return True
+    return False
+
+
+
+
+
+def _walk_pages(pdf_bytes, emit, page_slots, stop):
+    """
+    Worker thread: read every page of the document once and emit a dict with its
+    embedded images, whether it is a table candidate, its native tables, and a
+    JPEG render when the vision model is needed. emit(None) marks the end.
+    page_slots bounds how many rendered pages wait in memory for a vision call;
+    setting stop ends the walk at the next page or while waiting for a slot.
+    """
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    seen_xrefs = set()
+    try:
+        for page in doc:
+            if stop.is_set():
+                break
+            images = page_images(doc, page, seen_xrefs)
+
+            score, found = table_scan(page)
+            candidate = score >= TABLE_CANDIDATE_THRESHOLD
+            native_tables, jpeg = [], None
+            if candidate:
+                native_tables, confidence = _native_page_tables(page, found)
+                if confidence < NATIVE_TABLE_MIN_CONFIDENCE:
+                    if not _take_page_slot(page_slots, stop):
+                        break
+                    try:
+                        pixmap = page.get_pixmap(dpi=page_render_dpi(page.rect), colorspace=fitz.csRGB, alpha=False)
+                        jpeg = pixmap.tobytes("jpeg", jpg_quality=JPEG_QUALITY)
+                    except Exception:
+                        page_slots.release()
+                        raise
+
+            emit({
+                "page_number": page.number + 1,
+                "images": images,
+                "candidate": candidate,
+                "native_tables": native_tables,
+                "jpeg": jpeg,
+            })
+    finally:
+        doc.close()
+        emit(None)
@@ -0,0 +1,277 @@
+import os, json, asyncio, logging, threading
+from fastapi import Request, HTTPException, status
+from fastapi.responses import JSONResponse
+from core.utils.progress import progress_sink, cancel_scope
+from core.utils import utility
+from services.search_services import add_search_term
+from database.database import get_db
+from services import google_scholer_services, pubmed_services, semantic_scholar_services
+
+
+logger = logging.getLogger("combined_retrieval")
+
+
+# One deadline for the whole fan-out; whatever is still running after it is
+# cancelled, and downloads in worker threads stop at their next article.
+RETRIEVAL_DEADLINE = float(os.getenv("RETRIEVAL_DEADLINE", "300"))
+
+
+
+
+# ---------------------------------------------------------------------------
+# Source adapters
+#
+# find(keyword, count)              -> list of hits, in the source's ranking order
+# fetch(hits, output_dir, start)    -> {"downloaded", "skipped_403", "failed"}
+# topic(query)                      -> folder name, same as the single-source endpoints
+# ---------------------------------------------------------------------------
+
+async def _google_find(keyword, count):
+    links, metas = await asyncio.to_thread(google_scholer_services.get_pdf_links, keyword, count)
+    return list(zip(links, metas))
+
+
+async def _google_fetch(hits, output_dir, start):
+    links, metas = [h[0] for h in hits], [h[1] for h in hits]
+    downloaded, failed, skipped_403, _ = await google_scholer_services.download_pdfs(links, metas, output_dir, start=start)
+    return {"downloaded": downloaded, "skipped_403": skipped_403, "failed": failed}
+
+
+async def _semantic_find(keyword, count):
+    links, metas = await asyncio.to_thread(semantic_scholar_services.get_all_pdf_links, keyword, count)
+    return list(zip(links, metas))
+
+
+async def _semantic_fetch(hits, output_dir, start):
+    links, metas = [h[0] for h in hits], [h[1] for h in hits]
+    downloaded, failed = await semantic_scholar_services.download_pdfs(links, metas, output_dir, start=start)
+    return {"downloaded": downloaded, "skipped_403": 0, "failed": failed}
+
+
+async def _pubmed_find(keyword, count):
+    return await asyncio.to_thread(pubmed_services.get_pmcids_via_eutils, keyword, count)
+
+
+async def _pubmed_fetch(hits, output_dir, start):
+    downloaded, failed = await asyncio.to_thread(pubmed_services.download_pdfs_parallel, hits, output_dir, start)
+    return {"downloaded": downloaded, "skipped_403": 0, "failed": failed}
+
+
+SOURCES = {
+    "google_scholar": {
+        "find": _google_find,
+        "fetch": _google_fetch,
+        "topic": lambda query: google_scholer_services.sanitize_filename(query.replace(' ', '_')),
+    },
+    "semantic_scholar": {
+        "find": _semantic_find,
+        "fetch": _semantic_fetch,
+        "topic": lambda query: semantic_scholar_services.sanitize_filename(query.replace(' ', '_')),
+    },
+    "pubmed": {
+        "find": _pubmed_find,
+        "fetch": _pubmed_fetch,
+        "topic": lambda query: query.replace(' ', '_').replace('"', ''),
+    },
+}
+
+
+
+
+def split_quota(number: int, count: int, remainder_last: bool = False) -> list:
+    """Split `number` PDFs over `count` sources; earlier (or, with remainder_last, later) sources take the remainder."""
+    base, extra = divmod(number, count)
+    quota = [base + (1 if i < extra else 0) for i in range(count)]
+    return quota[::-1] if remainder_last else quota
+
+
+
+
+def validate_retrieval_request(data):
+    """Reject a request before any work starts; also called ahead of streaming so errors keep their status code."""
+    if data.max_pdfs <= 0:
+        raise HTTPException(status_code=422, detail="Number of downloads must be greater than 0.")
+
+
+
+
+async def retrive_from_sources(request: Request, data, sources: list, remainder_last: bool = False):
+    """
+    Run every selected source at the same time under one deadline.
+
+    Searches start together with their share of `max_pdfs`; each source's
+    downloads start as soon as its search returns. When a source finds fewer
+    hits than its share, the shortfall is handed to a source that filled its
+    share, which searches again and downloads only the hits beyond the ones it
+    already has. Counts are merged as each download batch finishes.
+
+    An odd PDF goes to the first source, or to the last with remainder_last,
+    as the single-source endpoints split it before.
+    """
+    validate_retrieval_request(data)
+    number = data.max_pdfs
+
+    user_id = request.state.user.get("user_id")
+    query = utility.construct_query(data.search_terms, data.operators, data.country, data.patient_cohort)
+
+    if not add_search_term(user_id=user_id, term=query, db=next(get_db())):
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content={"detail": "Something is not working. Please try again!"}
+        )
+
+    state = {}
+    for name, share in zip(sources, split_quota(number, len(sources), remainder_last)):
+        output_dir = f"users/{user_id}/{data.project_name}/{name}/{SOURCES[name]['topic'](query)}"
+        os.makedirs(output_dir, exist_ok=True)
+        state[name] = {"quota": share, "found": 0, "exhausted": False, "output_dir": output_dir}
+
+    result = {"success": 0, "failed": 0, "downloaded": 0, "skipped_403": 0, "failed_downloads": 0}
+    tasks = {}
+
+    # Tasks and their worker threads inherit this scope, so setting the event
+    # stops downloads that cancelling the tasks cannot reach.
+    with cancel_scope() as cancel_event:
+        def start_find(name):
+            task = asyncio.create_task(SOURCES[name]["find"](query, state[name]["quota"]))
+            tasks[task] = ("find", name)
+
+        for name in sources:
+            start_find(name)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + RETRIEVAL_DEADLINE
+        shortfall = 0
+
+        try:
+            while tasks:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                done, _ = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+
+                for task in done:
+                    kind, name = tasks.pop(task)
+                    source = state[name]
+
+                    if kind == "find":
+                        try:
+                            hits = task.result() or []
+                        except Exception as e:
+                            logger.error(f"{name} search failed: {e}")
+                            hits = []
+
+                        if len(hits) < source["quota"]:
+                            source["exhausted"] = True
+                            shortfall += source["quota"] - max(len(hits), source["found"])
+                            source["quota"] = max(len(hits), source["found"])
+
+                        new_hits = hits[source["found"]:]
+                        if new_hits:
+                            fetch = SOURCES[name]["fetch"](new_hits, source["output_dir"], source["found"])
+                            tasks[asyncio.create_task(fetch)] = ("fetch", name)
+                            source["found"] = len(hits)
+                        logger.info(f"{name}: {len(hits)} hits, {len(new_hits)} new, shortfall now {shortfall}")
+
+                    else:
+                        try:
+                            counts = task.result()
+                        except Exception as e:
+                            logger.error(f"{name} downloads failed: {e}")
+                            continue
+                        result["downloaded"] += counts["downloaded"]
+                        result["skipped_403"] += counts["skipped_403"]
+                        result["failed"] += counts["failed"]
+
+                if shortfall:
+                    searching = {name for kind, name in tasks.values() if kind == "find"}
+                    for name in sources:
+                        if not state[name]["exhausted"] and name not in searching:
+                            logger.info(f"Rebalancing {shortfall} PDFs onto {name}")
+                            state[name]["quota"] += shortfall
+                            shortfall = 0
+                            start_find(name)
+                            break
+
+        except asyncio.CancelledError:
+            # The caller gave up (e.g. a streaming client disconnected): stop every source.
+            cancel_event.set()
+            for task in tasks:
+                task.cancel()
+            raise
+
+        deadline_exceeded = bool(tasks)
+        if deadline_exceeded:
+            cancel_event.set()
+        for task in tasks:
+            task.cancel()
+    if deadline_exceeded:
+        logger.warning(f"Retrieval deadline of {RETRIEVAL_DEADLINE}s exceeded, cancelled {len(tasks)} task(s)")
+
+    result["success"] = result["downloaded"] + result["skipped_403"]
+    result["failed_downloads"] = result["failed"]
+    result["deadline_exceeded"] = deadline_exceeded
+    result["source"] = " + ".join(sources)
+    return result
+
+
+
+
+
+async def stream_from_sources(request: Request, data, sources: list):
+    """
+    Run retrive_from_sources and yield NDJSON lines as it goes: one line per
+    article event (found, downloaded, uploaded, skipped_403, failed), a
+    "search_truncated" line when a source's search hit its page cap, then a
+    final {"event": "done", "result": ...} line with the merged counts.
+
+    If the client disconnects, the generator is closed and the retrieval is
+    cancelled; downloads already running in worker threads stop at the next
+    article.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancel_event = threading.Event()
+
+    def sink(kind, fields):
+        if kind == "article":
+            loop.call_soon_threadsafe(queue.put_nowait, fields)
+        elif fields.get("truncated"):
+            loop.call_soon_threadsafe(queue.put_nowait, {"event": "search_truncated", **fields})
+
+    async def run():
+        with progress_sink(sink, cancel_event):
+            return await retrive_from_sources(request=request, data=data, sources=sources)
+
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield json.dumps(getter.result()) + "\n"
+                continue
+            getter.cancel()
+            break
+
+        while not queue.empty():
+            yield json.dumps(queue.get_nowait()) + "\n"
+
+        try:
+            result = task.result()
+        except HTTPException as e:
+            yield json.dumps({"event": "error", "status_code": e.status_code, "detail": e.detail}) + "\n"
+            return
+
+        if isinstance(result, JSONResponse):
+            yield json.dumps({"event": "error", "status_code": result.status_code, "detail": json.loads(result.body).get("detail")}) + "\n"
+            return
+        yield json.dumps({"event": "done", "result": result}) + "\n"
+
+    finally:
+        if not task.done():
+            logger.info("Stream closed early – cancelling retrieval")
+            cancel_event.set()
+            task.cancel()
@@ -1,12 +1,15 @@
 
-import os, time, requests, re, httpx, logging, traceback
+import os, requests, re, httpx, logging, traceback, asyncio
+from collections import defaultdict
+from urllib.parse import urlparse
 from fastapi import Request, HTTPException, status
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from core import settings
 from schemas.google_scholer_schemas import GoogleScholerRetriverRequest
-from core.utils import utility
-from core.utils.gcp_utils import upload_text_file, upload_pdf_from_path
+from core.utils import utility, rate_limiter, search_cache, paginator
+from core.utils.progress import report_progress, report_article
+from core.utils.gcp_utils import upload_text_file, open_pdf_writer, shared_pdf_key, link_shared_pdf, looks_like_pdf, PDF_HEADER_WINDOW
 from services.search_services import add_search_term
 from database.database import get_db
 from datetime import datetime
@@ -27,6 +30,14 @@ if not logger.handlers:
     logger.addHandler(handler)
 
 
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+DOWNLOAD_CONCURRENCY = int(os.getenv("GS_DOWNLOAD_CONCURRENCY", "10"))
+PER_HOST_CONCURRENCY = int(os.getenv("GS_PER_HOST_CONCURRENCY", "2"))
+DOWNLOAD_TIMEOUT = httpx.Timeout(60.0, connect=15.0)
+STREAM_CHUNK_SIZE = 64 * 1024
+UPLOAD_CHUNK_SIZE = 4 * 256 * 1024   # GCS resumable uploads need multiples of 256 KiB
+
+
 
 
 
@@ -58,10 +69,9 @@ async def retrive_google_scholer(request: Request, data: GoogleScholerRetriverRe
 
 async def main(keyword, max_results, output_dir):
     output_dir = output_dir.replace("\\", "/")
-    os.makedirs(output_dir, exist_ok=True)
     logger.info(f"Searching Google Scholar: {keyword}")
 
-    pdf_links, metadata_list = get_pdf_links(keyword, max_results)
+    pdf_links, metadata_list = await asyncio.to_thread(get_pdf_links, keyword, max_results)
     if not pdf_links:
         raise ValueError("No PDF links found")
 
@@ -88,29 +98,32 @@ def sanitize_filename(filename):
 
 
 def get_pdf_links(keyword, max_results):
-    pdf_links, metadatas = [], []
-    start = 0
-
-    while len(pdf_links) < max_results:
-        data = search_google_scholar(keyword, start)
+    def fetch_page(page):
+        data = search_google_scholar(keyword, page * 10)
         if not data or "organic_results" not in data:
-            break
+            return [], [], False
 
         new_links, new_meta = extract_pdf_links(data)
         logger.debug(f"new_links {new_links}")
-        pdf_links.extend(new_links)
-        metadatas.extend(new_meta)
-
-        pdf_links = pdf_links[:max_results]
-        metadatas = metadatas[:max_results]
-        start += 10
+        return new_links, new_meta, True
 
-    return pdf_links, metadatas
+    return paginator.collect_pages(fetch_page, max_results, source="google_scholar")
 
 
 
 
 def search_google_scholar(keyword, start=0):
+    return search_cache.cached_search(
+        "serpapi", keyword, start, 10,
+        lambda: _fetch_google_scholar_page(keyword, start),
+        # Quota and key errors come back as HTTP 200 with an "error" field.
+        is_valid=lambda data: bool(data) and "error" not in data
+    )
+
+
+
+
+def _fetch_google_scholar_page(keyword, start=0):
     url = "https://serpapi.com/search"
     params = {
         "engine": "google_scholar",
@@ -119,6 +132,7 @@ def search_google_scholar(keyword, start=0):
         "start": start
     }
     try:
+        rate_limiter.acquire("serpapi")
         response = requests.get(url, params=params, timeout=30)
         response.raise_for_status()
         return response.json()
@@ -151,14 +165,44 @@ def extract_pdf_links(data):
 
 
 
-async def download_pdfs(pdf_links, metadatas, output_dir):
+async def download_pdfs(pdf_links, metadatas, output_dir, start=0):
+    """
+    Download every link concurrently over one shared AsyncClient.
+    At most DOWNLOAD_CONCURRENCY downloads run at once, and at most
+    PER_HOST_CONCURRENCY of them against the same publisher host.
+    """
     num_downloaded = 0
     num_skipped_403 = 0
     num_failed = 0
 
-    for ind, link in enumerate(pdf_links, start=1):
-        metadata = metadatas[ind - 1]
-        result = download_pdf_with_status(link, metadata, output_dir, ind)
+    semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+    host_semaphores = defaultdict(lambda: asyncio.Semaphore(PER_HOST_CONCURRENCY))
+    limits = httpx.Limits(max_connections=DOWNLOAD_CONCURRENCY, max_keepalive_connections=DOWNLOAD_CONCURRENCY)
+    headers = {'User-Agent': USER_AGENT, 'Accept': 'application/pdf'}
+
+    async with httpx.AsyncClient(headers=headers, limits=limits, timeout=DOWNLOAD_TIMEOUT, follow_redirects=True) as client:
+
+        finished = 0
+        for ind, (link, metadata) in enumerate(zip(pdf_links, metadatas), start=start + 1):
+            report_article("found", source="google_scholar", index=ind, url=link, title=metadata.get("title"))
+
+        async def bounded(link, metadata, ind):
+            nonlocal finished
+            # Wait for the host first so links queued on a busy publisher do not hold global slots.
+            async with host_semaphores[urlparse(link).netloc], semaphore:
+                result = await download_pdf_with_status(client, link, metadata, output_dir, ind)
+            finished += 1
+            if result != "downloaded":
+                report_article(result, source="google_scholar", index=ind, url=link)
+            report_progress(stage="downloading", source="google_scholar", done=finished, total=len(pdf_links))
+            return result
+
+        results = await asyncio.gather(*(
+            bounded(link, metadata, ind)
+            for ind, (link, metadata) in enumerate(zip(pdf_links, metadatas), start=start + 1)
+        ))
+
+    for result in results:
         if result == "downloaded":
             num_downloaded += 1
         elif result == "skipped_403":
@@ -172,11 +216,11 @@ async def download_pdfs(pdf_links, metadatas, output_dir):
 
 
 
-def download_pdf_with_status(link, metadata, output_dir, ind):
+async def download_pdf_with_status(client, link, metadata, output_dir, ind):
     try:
-        success = download(link, metadata, output_dir, ind)
+        success = await download(client, link, metadata, output_dir, ind)
         return "downloaded" if success else "failed"
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         if e.response.status_code == 403:
             logger.info(f"PDF #{ind} blocked by publisher (403) – skipping: {link}")
             return "skipped_403"
@@ -191,35 +235,47 @@ def download_pdf_with_status(link, metadata, output_dir, ind):
 
 
 
-def download(url, metadata: dict, dir_, ind):
-    USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-    headers = {'User-Agent': USER_AGENT, 'Accept': 'application/pdf'}
-    file_path = None
-    dir_ = dir_.replace("\\", "/").rstrip("/") + "/"
-    base_name = os.path.basename(dir_.rstrip("/"))
+async def stream_to_gcp(response, pdf_key) -> bool:
+    """
+    Pipe a streaming response body straight into a GCP blob.
+    Bytes are gathered into UPLOAD_CHUNK_SIZE pieces and each piece is
+    handed to the (blocking) blob writer in a worker thread. Returns False,
+    without writing anything, when the body does not start like a PDF.
+    """
+    chunks = response.aiter_bytes(STREAM_CHUNK_SIZE)
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer.extend(chunk)
+        if len(buffer) >= PDF_HEADER_WINDOW:
+            break
+    if not looks_like_pdf(bytes(buffer)):
+        return False
+
+    writer = await asyncio.to_thread(open_pdf_writer, pdf_key, UPLOAD_CHUNK_SIZE)
+    async for chunk in chunks:
+        buffer.extend(chunk)
+        if len(buffer) >= UPLOAD_CHUNK_SIZE:
+            await asyncio.to_thread(writer.write, bytes(buffer))
+            buffer.clear()
+    if buffer:
+        await asyncio.to_thread(writer.write, bytes(buffer))
+    # Only a completed body is finalized; an interrupted upload is left unfinished.
+    await asyncio.to_thread(writer.close)
+    return True
+
 
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            response = requests.get(url, headers=headers, timeout=60)
-            
-            
-            if response.status_code == 403:
-                raise requests.exceptions.HTTPError("403 Forbidden", response=response)
 
-            if response.status_code != 200:
-                raise RuntimeError(f"HTTP {response.status_code}")
 
-            filename_base = f"{base_name}_{ind}"
-            txt_filename = f"{filename_base}.txt"
-            pdf_filename = f"{filename_base}.pdf"
 
-            
-            txt_key = f"{dir_}/{txt_filename}".replace("//", "/")
-            pdf_path_local = os.path.join(dir_, pdf_filename)
+async def download(client, url, metadata: dict, dir_, ind):
+    dir_ = dir_.replace("\\", "/").rstrip("/") + "/"
+    base_name = os.path.basename(dir_.rstrip("/"))
 
-           
-            txt_content = f"""Title: {metadata.get('title', 'Unknown')}
+    filename_base = f"{base_name}_{ind}"
+    txt_key = f"{dir_}{filename_base}.txt"
+    pdf_key = f"{dir_}{filename_base}.pdf"
+
+    txt_content = f"""Title: {metadata.get('title', 'Unknown')}
 Authors: {', '.join(metadata.get('authors', ['Unknown']))}
 Year: {metadata.get('year') or 'Unknown'}
 Source: {metadata.get('source', 'Unknown')}
@@ -228,48 +284,53 @@ Fetched Date: {datetime.now().strftime('%b %d, %Y at %H:%M')}
 Fetched From: google_scholar
 """
 
-            upload_text_file(path=txt_key, file=txt_content)
-            logger.debug(f"Metadata uploaded: {txt_key}")
-
-            
-            with open(pdf_path_local, "wb") as f:
-                f.write(response.content)
+    shared_key = shared_pdf_key("url", url)
+    if await asyncio.to_thread(link_shared_pdf, shared_key, pdf_key):
+        logger.debug(f"PDF #{ind} reused from shared store: {pdf_key}")
+        report_article("uploaded", source="google_scholar", index=ind, url=url, path=pdf_key, reused=True)
+        await asyncio.to_thread(upload_text_file, path=txt_key, file=txt_content)
+        return True
 
-            upload_pdf_from_path(pdf_path_local)
-            logger.debug(f"PDF uploaded: {pdf_path_local}")
+    max_retries = 3
+    for attempt in range(max_retries):
+        try:
+            async with client.stream("GET", url) as response:
+                if response.status_code == 403:
+                    raise httpx.HTTPStatusError("403 Forbidden", request=response.request, response=response)
+
+                if response.status_code != 200:
+                    raise RuntimeError(f"HTTP {response.status_code}")
+
+                if not await stream_to_gcp(response, shared_key):
+                    # A login or paywall page; keep it out of the shared store.
+                    logger.warning(f"PDF #{ind} is not a PDF ({response.headers.get('content-type')}): {url}")
+                    return False
+                report_article("downloaded", source="google_scholar", index=ind, url=url)
+                if not await asyncio.to_thread(link_shared_pdf, shared_key, pdf_key):
+                    raise RuntimeError(f"copying {shared_key} to {pdf_key} failed")
+                logger.debug(f"PDF uploaded: {pdf_key}")
+                report_article("uploaded", source="google_scholar", index=ind, url=url, path=pdf_key, reused=False)
+
+            await asyncio.to_thread(upload_text_file, path=txt_key, file=txt_content)
+            logger.debug(f"Metadata uploaded: {txt_key}")
             return True
 
-        except (requests.exceptions.ConnectTimeout,
-                requests.exceptions.ReadTimeout,
-                requests.exceptions.ConnectionError) as e:
+        except httpx.TransportError as e:
             if attempt < max_retries - 1:
                 wait = 2 ** attempt
-                logger.warning(f"Timeout on attempt {attempt+1}, retrying in {wait}s: {url}")
-                time.sleep(wait)
+                logger.warning(f"Network error on attempt {attempt+1} ({type(e).__name__}), retrying in {wait}s: {url}")
+                await asyncio.sleep(wait)
                 continue
-            logger.error(f"PDF #{ind} timed out after {max_retries} attempts")
+            logger.error(f"PDF #{ind} failed after {max_retries} attempts: {e}")
             return False
 
-        except requests.exceptions.HTTPError as e:
-            if e.response and e.response.status_code == 403:
-                raise  
-            logger.error(f"HTTP error {e.response.status_code} on attempt {attempt+1}")
-            if attempt == max_retries - 1:
-                return False
-            time.sleep(2 ** attempt)
+        except httpx.HTTPStatusError:
+            raise
 
         except Exception as e:
             logger.error(f"Unexpected error on attempt {attempt+1}: {e}")
             if attempt == max_retries - 1:
                 return False
-            time.sleep(2 ** attempt)
-
-        finally:
-            if file_path and os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                    logger.debug(f"Local file removed: {file_path}")
-                except:
-                    pass
+            await asyncio.sleep(2 ** attempt)
 
-        return False
\ No newline at end of file
+    return False
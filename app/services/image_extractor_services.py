@@ -1,10 +1,17 @@
 import fitz  
 from io import BytesIO
-import os
+import os, asyncio
+from concurrent.futures import ThreadPoolExecutor
 from core.settings import INPUT_DIR
 from fastapi import UploadFile, Request
 from core.utils.aws_utils import s3_upload_pdf, get_presigned_urls
-from core .utils.gcp_utils import upload_image_file
+from core .utils.gcp_utils import upload_image_bytes, blob_exists
+from core.utils.image_utils import is_decorative, perceptual_hash, content_digest, claim_image, release_image
+
+
+IMAGE_UPLOAD_CONCURRENCY = int(os.getenv("IMAGE_UPLOAD_CONCURRENCY", "8"))
+# Shared by every request and event loop, so the total number of uploads in flight stays bounded.
+_upload_pool = ThreadPoolExecutor(max_workers=IMAGE_UPLOAD_CONCURRENCY)
 
 
 
@@ -26,35 +33,93 @@ async def extract_images(request: Request,project_name:str, file:UploadFile):
 
 
 async def extract_images_from_pdf(pdf_file, save_dir):
+    images = await asyncio.to_thread(_read_images, pdf_file)
+    return await upload_images(images, save_dir)
+
+
+
+
+
+def _read_images(pdf_file):
     doc = fitz.open(stream= pdf_file, filetype="pdf")
+    try:
+        seen_xrefs = set()
+        images = []
+        for page in doc:
+            images.extend(page_images(doc, page, seen_xrefs))
+        return images
+    finally:
+        doc.close()
+
+
+
+
+
+def page_images(doc, page, seen_xrefs):
+    """
+    Embedded images of one page as (page_num, img_index, img_bytes, img_ext, width, height).
+    An xref already in seen_xrefs (a logo repeated on every page) is extracted
+    only once per document, and decorative images are dropped before extraction.
+    """
     images = []
-    presigned_urls = []
-    os.makedirs(save_dir, exist_ok=True)
-
-    for page_num in range(doc.page_count):
-        page = doc[page_num]
-        image_list = page.get_images(full=True)
-        for img_index, img in enumerate(image_list, start=1):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            img_bytes = base_image["image"]
-            img_ext = base_image["ext"]
-            img_name = f"image_{page_num + 1}_{img_index}.{img_ext}"
-            img_path = os.path.join(save_dir, img_name)
-            with open(img_path, "wb") as f:
-                f.write(img_bytes)
-
-            result = upload_image_file(img_path, img_ext)
-            print("Result:", result)  
-            images.append({
-                "page_num": page_num + 1,
-                "img_index": img_index,
-                "img_bytes": img_bytes,
-                "img_ext": img_ext,
-                "img_path": img_path
-            })
-            presigned_urls.append (get_presigned_urls(img_path)) 
-    return presigned_urls
+    for img_index, img in enumerate(page.get_images(full=True), start=1):
+        xref, width, height = img[0], img[2], img[3]
+        if xref in seen_xrefs:
+            continue
+        seen_xrefs.add(xref)
+        if is_decorative(width, height):
+            continue
+        base_image = doc.extract_image(xref)
+        images.append((page.number + 1, img_index, base_image["image"], base_image["ext"], width, height))
+    return images
+
+
+
+
+
+def store_image(img_bytes, img_ext, width, height, save_dir, page_num, img_index):
+    """
+    Upload one image straight from memory unless the same image is already
+    stored in the project (see claim_image), and return the blob path that
+    holds it. A claimed copy whose blob has been deleted is forgotten.
+    """
+    img_name = f"image_{page_num}_{img_index}.{img_ext}"
+    img_path = os.path.join(save_dir, img_name)
+    scope = os.path.dirname(save_dir)
+    digest, phash = content_digest(img_bytes), perceptual_hash(img_bytes)
+    while (stored_path := claim_image(scope, img_path, digest, phash, width, height)) != img_path:
+        if blob_exists(stored_path):
+            print(f"Image {img_path} duplicates {stored_path}, upload skipped")
+            return stored_path
+        release_image(scope, stored_path)
+
+    try:
+        result = upload_image_bytes(img_path, img_bytes, img_ext)
+        print("Result:", result)  
+    except Exception:
+        release_image(scope, img_path)
+        raise
+    return img_path
+
+
+
+
+
+async def upload_images(images, save_dir):
+    """
+    Store (page_num, img_index, img_bytes, img_ext, width, height) images in parallel on the
+    upload pool, then sign their URLs as one parallel batch. Returns presigned
+    URLs in input order with duplicates collapsed.
+    """
+    loop = asyncio.get_running_loop()
+    paths = await asyncio.gather(*(
+        loop.run_in_executor(_upload_pool, store_image, img_bytes, img_ext, width, height, save_dir, page_num, img_index)
+        for page_num, img_index, img_bytes, img_ext, width, height in images
+    ))
+    paths = list(dict.fromkeys(paths))
+    return list(await asyncio.gather(*(
+        loop.run_in_executor(_upload_pool, get_presigned_urls, path) for path in paths
+    )))
 
 
 
@@ -0,0 +1,405 @@
+import os, json, time, asyncio, logging, traceback
+from io import BytesIO
+from uuid import UUID, uuid4
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+from fastapi import HTTPException, UploadFile, Response, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func, text
+from database.database import SessionLocal
+from models.job_model import Job
+from core.utils.progress import progress_sink
+from core.utils.gcp_utils import upload_pdf_from_bytes, download_file_bytes, bucket
+from schemas.pubmed_schemas import PubmedRetriverRequest
+from schemas.google_scholer_schemas import GoogleScholerRetriverRequest
+from services.pubmed_services import retrive_pubmed
+from services.google_scholer_services import retrive_google_scholer
+from services.table_extractor_services import extract_tables
+from services.combined_extractor_services import extract_table_and_image
+
+
+logger = logging.getLogger("jobs")
+
+
+JOB_MAX_WORKERS = int(os.getenv("JOB_MAX_WORKERS", "4"))                  # jobs run at once by this process
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "2"))                # jobs run at once per user, all processes
+JOB_MAX_QUEUED_PER_USER = int(os.getenv("JOB_MAX_QUEUED_PER_USER", "10")) # queued + running before submit answers 429
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "30"))
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "600"))             # running jobs with no heartbeat are requeued
+JOB_PROGRESS_INTERVAL = 1.0
+JOB_CLAIM_CANDIDATES = 10
+
+JOB_STAGING_PREFIX = "jobs/"
+
+
+_wake = None
+_dispatcher = None
+_running = set()
+_last_requeue = 0.0
+
+
+
+
+# ---------------------------------------------------------------------------
+# Handlers
+#
+# Each takes (request, payload) where request only carries state.user, the same
+# way the HTTP routes see it, and returns what the synchronous endpoint returns.
+# Blocking services run in a worker thread so the event loop stays free.
+# ---------------------------------------------------------------------------
+
+async def _retrive_pubmed_article(request, payload):
+    return await asyncio.to_thread(retrive_pubmed, request=request, data=PubmedRetriverRequest(**payload))
+
+
+async def _retrive_google_scholer_article(request, payload):
+    return await retrive_google_scholer(request=request, data=GoogleScholerRetriverRequest(**payload))
+
+
+async def _table_extractor(request, payload):
+    file = await asyncio.to_thread(_load_staged_upload, payload)
+    try:
+        return await extract_tables(request, payload["project_name"], file, payload.get("engine", "auto"))
+    finally:
+        await asyncio.to_thread(_drop_staged_upload, payload["staged_path"])
+
+
+async def _combined_extractor(request, payload):
+    file = await asyncio.to_thread(_load_staged_upload, payload)
+    try:
+        return await extract_table_and_image(request, payload["project_name"], file)
+    finally:
+        await asyncio.to_thread(_drop_staged_upload, payload["staged_path"])
+
+
+JOB_HANDLERS = {
+    "retrive_pubmed_article": _retrive_pubmed_article,
+    "retrive_google_scholer_article": _retrive_google_scholer_article,
+    "table_extractor": _table_extractor,
+    "combined_extractor": _combined_extractor,
+}
+
+
+
+
+# ---------------------------------------------------------------------------
+# Uploaded PDFs are staged in the bucket so the job survives a restart.
+# ---------------------------------------------------------------------------
+
+async def stage_upload(user_id: str, file: UploadFile) -> str:
+    pdf_bytes = await file.read()
+    path = f"{JOB_STAGING_PREFIX}{user_id}/{uuid4().hex}/{file.filename}"
+    await asyncio.to_thread(upload_pdf_from_bytes, path, pdf_bytes)
+    return path
+
+
+def _load_staged_upload(payload) -> UploadFile:
+    pdf_bytes = download_file_bytes(payload["staged_path"])
+    return UploadFile(file=BytesIO(pdf_bytes), filename=payload["filename"])
+
+
+def _drop_staged_upload(path: str):
+    try:
+        bucket.blob(path).delete()
+    except Exception as e:
+        logger.warning(f"could not delete staged upload {path}: {e}")
+
+
+
+
+# ---------------------------------------------------------------------------
+# Submit / query
+# ---------------------------------------------------------------------------
+
+def submit_job(user_id: str, job_type: str, payload: dict) -> dict:
+    if job_type not in JOB_HANDLERS:
+        raise HTTPException(status_code=400, detail=f"Unknown job type: {job_type}")
+
+    with SessionLocal() as db:
+        pending = db.query(func.count(Job.job_id)).filter(
+            Job.user_id == user_id, Job.status.in_(["queued", "running"])
+        ).scalar()
+        if pending >= JOB_MAX_QUEUED_PER_USER:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many jobs in progress. Please wait for some to finish."
+            )
+
+        job = Job(user_id=user_id, job_type=job_type, payload=jsonable_encoder(payload), status="queued")
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        response = {"job_id": str(job.job_id), "status": job.status}
+
+    if _wake is not None:
+        _wake.set()
+    logger.info(f"job {response['job_id']} queued: {job_type} for user {user_id}")
+    return response
+
+
+
+
+def _get_job(db, user_id: str, job_id: str) -> Job:
+    try:
+        job_uuid = UUID(job_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    job = db.query(Job).filter(Job.job_id == job_uuid, Job.user_id == user_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+
+
+
+def get_job_status(user_id: str, job_id: str) -> dict:
+    with SessionLocal() as db:
+        job = _get_job(db, user_id, job_id)
+        return {
+            "job_id": str(job.job_id),
+            "job_type": job.job_type,
+            "status": job.status,
+            "progress": job.progress,
+            "error": job.error,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+        }
+
+
+
+
+def get_job_result(user_id: str, job_id: str) -> dict:
+    with SessionLocal() as db:
+        job = _get_job(db, user_id, job_id)
+        if job.status in ("queued", "running"):
+            raise HTTPException(status_code=409, detail=f"Job is still {job.status}.")
+        return {"job_id": str(job.job_id), "status": job.status, "result": job.result, "error": job.error}
+
+
+
+
+# ---------------------------------------------------------------------------
+# Worker pool
+# ---------------------------------------------------------------------------
+
+def _claim_next_job():
+    """
+    Atomically move the oldest runnable queued job to 'running'. SKIP LOCKED lets
+    several processes claim concurrently; users already at JOB_MAX_PER_USER are skipped.
+    Claims for one user are serialized with a transaction-level advisory lock, and
+    the user's running count is re-read under it, so processes cannot jointly
+    exceed the limit. A user whose lock is held elsewhere is skipped this round.
+    """
+    with SessionLocal() as db:
+        busy_users = (
+            db.query(Job.user_id)
+            .filter(Job.status == "running")
+            .group_by(Job.user_id)
+            .having(func.count(Job.job_id) >= JOB_MAX_PER_USER)
+        )
+        candidates = (
+            db.query(Job)
+            .filter(Job.status == "queued", ~Job.user_id.in_(busy_users))
+            .order_by(Job.created_at)
+            .with_for_update(skip_locked=True)
+            .limit(JOB_CLAIM_CANDIDATES)
+            .all()
+        )
+        job = None
+        for candidate in candidates:
+            locked = db.execute(
+                text("SELECT pg_try_advisory_xact_lock(hashtext(:user_id))"), {"user_id": str(candidate.user_id)}
+            ).scalar()
+            if not locked:
+                continue
+            running = db.query(func.count(Job.job_id)).filter(
+                Job.user_id == candidate.user_id, Job.status == "running"
+            ).scalar()
+            if running < JOB_MAX_PER_USER:
+                job = candidate
+                break
+        if job is None:
+            db.rollback()
+            return None
+
+        claimed = (job.job_id, str(job.user_id), job.job_type, job.payload)
+        now = datetime.utcnow()
+        job.status = "running"
+        job.started_at = now
+        job.updated_at = now
+        db.commit()
+        return claimed
+
+
+
+
+def _requeue_stale_jobs():
+    """Jobs left 'running' by a process that died (no heartbeat) go back in the queue."""
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_AFTER)
+    with SessionLocal() as db:
+        count = (
+            db.query(Job)
+            .filter(Job.status == "running", Job.updated_at < cutoff)
+            .update({"status": "queued", "started_at": None}, synchronize_session=False)
+        )
+        db.commit()
+    if count:
+        logger.warning(f"requeued {count} stale job(s)")
+
+
+
+
+def _update_job(job_id, **fields):
+    fields["updated_at"] = datetime.utcnow()
+    with SessionLocal() as db:
+        db.query(Job).filter(Job.job_id == job_id).update(fields, synchronize_session=False)
+        db.commit()
+
+
+
+
+def _progress_writer(state: dict):
+    """
+    Progress sink for a job. report_progress is called from coroutines as well as
+    threads, so it only records the latest fields; _flush_progress writes them.
+    """
+    def write(kind, fields):
+        if kind == "progress":
+            state["progress"] = jsonable_encoder(fields)
+
+    return write
+
+
+
+
+async def _flush_progress(job_id, state: dict):
+    written = None
+    while True:
+        await asyncio.sleep(JOB_PROGRESS_INTERVAL)
+        progress = state.get("progress")
+        if progress is None or progress is written:
+            continue
+        try:
+            await asyncio.to_thread(_update_job, job_id, progress=progress)
+            written = progress
+        except Exception as e:
+            logger.warning(f"progress update failed for job {job_id}: {e}")
+
+
+
+
+async def _heartbeat(job_id):
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+        try:
+            await asyncio.to_thread(_update_job, job_id)
+        except Exception as e:
+            logger.warning(f"heartbeat failed for job {job_id}: {e}")
+
+
+
+
+def _normalize_result(result):
+    """Map a handler's return value to (status, result, error)."""
+    if isinstance(result, Response):
+        body = json.loads(result.body) if result.body else None
+        if result.status_code >= 400:
+            detail = body.get("detail") if isinstance(body, dict) else None
+            return "failed", body, detail or f"HTTP {result.status_code}"
+        return "succeeded", body, None
+
+    result = jsonable_encoder(result)
+    if isinstance(result, dict) and result.get("error"):
+        return "failed", result, str(result["error"])
+    return "succeeded", result, None
+
+
+
+
+async def _run_job(job_id, user_id, job_type, payload):
+    logger.info(f"job {job_id} started: {job_type}")
+    heartbeat = asyncio.create_task(_heartbeat(job_id))
+    progress = {}
+    flusher = asyncio.create_task(_flush_progress(job_id, progress))
+    request = SimpleNamespace(state=SimpleNamespace(user={"user_id": user_id}))
+
+    try:
+        with progress_sink(_progress_writer(progress)):
+            result = await JOB_HANDLERS[job_type](request, payload)
+        job_status, result, error = _normalize_result(result)
+    except HTTPException as e:
+        job_status, result, error = "failed", None, str(e.detail)
+    except Exception as e:
+        logger.error(f"job {job_id} crashed: {e}")
+        traceback.print_exc()
+        job_status, result, error = "failed", None, str(e)
+    finally:
+        heartbeat.cancel()
+        flusher.cancel()
+
+    # The last progress goes out with the outcome.
+    final = {"progress": progress["progress"]} if "progress" in progress else {}
+    await asyncio.to_thread(
+        _update_job, job_id, status=job_status, result=result, error=error, finished_at=datetime.utcnow(), **final
+    )
+    logger.info(f"job {job_id} {job_status}")
+
+
+
+
+async def _dispatch_loop():
+    global _last_requeue
+
+    while True:
+        try:
+            if time.monotonic() - _last_requeue > JOB_HEARTBEAT_INTERVAL:
+                _last_requeue = time.monotonic()
+                await asyncio.to_thread(_requeue_stale_jobs)
+
+            while len(_running) < JOB_MAX_WORKERS:
+                claimed = await asyncio.to_thread(_claim_next_job)
+                if claimed is None:
+                    break
+                task = asyncio.create_task(_run_job(*claimed))
+                _running.add(task)
+                task.add_done_callback(_on_job_done)
+        except Exception as e:
+            logger.error(f"job dispatcher error: {e}")
+
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+
+
+
+
+def _on_job_done(task):
+    _running.discard(task)
+    _wake.set()
+
+
+
+
+def start_workers():
+    global _wake, _dispatcher
+    if _dispatcher is None:
+        _wake = asyncio.Event()
+        _dispatcher = asyncio.create_task(_dispatch_loop())
+        logger.info(f"job workers started (max {JOB_MAX_WORKERS} per process, {JOB_MAX_PER_USER} per user)")
+
+
+
+
+async def stop_workers():
+    global _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.cancel()
+        _dispatcher = None
+    for task in list(_running):
+        task.cancel()
+    # Cancelled jobs stay 'running' and are requeued by the next process once stale.
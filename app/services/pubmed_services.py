@@ -1,5 +1,6 @@
 import time
 import re
+import contextvars
 import os
 import logging
 import requests
@@ -11,11 +12,12 @@ from typing import List, Tuple
 from fastapi import Request, HTTPException, status
 from fastapi.responses import JSONResponse
 
-from core.utils.gcp_utils import upload_pdf_from_path, upload_text_file,upload_pdf_from_bytes
+from core.utils.gcp_utils import upload_pdf_from_path, upload_text_file, shared_pdf_key, link_shared_pdf, store_shared_pdf
 from services.search_services import add_search_term
 from database.database import get_db
 from schemas.pubmed_schemas import PubmedRetriverRequest
-from core.utils import utility
+from core.utils import utility, rate_limiter, search_cache
+from core.utils.progress import report_progress, report_article, is_cancelled
 from dotenv import load_dotenv
 from datetime import datetime
 
@@ -36,6 +38,11 @@ PDF_BASE_URL = "https://europepmc.org/backend/ptpmcrender.fcgi?accid={pmcid}&blo
 
 REQUEST_DELAY = 0.11  
 
+# ESummary ids per request; NCBI recommends POST beyond ~200 ids
+ESUMMARY_BATCH_SIZE = 200
+# Attempts per batch before its articles fall back to placeholder metadata
+ESUMMARY_RETRIES = 3
+
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
 
 
@@ -121,7 +128,16 @@ def main(keyword: str, max_pdfs: int, output_dir: str) -> Tuple[int, int]:
 
 
 def get_pmcids_via_eutils(keyword: str, max_results: int) -> List[str]:
-    """Use NCBI ESearch to get PMCIDs (open access only)"""
+    """Use NCBI ESearch to get PMCIDs (open access only), cached per query"""
+    return search_cache.cached_search(
+        "ncbi_esearch", keyword, 0, max_results,
+        lambda: _esearch_pmcids(keyword, max_results)
+    )
+
+
+
+
+def _esearch_pmcids(keyword: str, max_results: int) -> List[str]:
     pmcids = []
 
     params = {
@@ -136,6 +152,7 @@ def get_pmcids_via_eutils(keyword: str, max_results: int) -> List[str]:
         params["api_key"] = NCBI_API_KEY
 
     try:
+        rate_limiter.acquire("ncbi_eutils")
         response = requests.get(ESEARCH_URL, params=params, timeout=30)
         response.raise_for_status()
         root = ET.fromstring(response.content)
@@ -143,8 +160,6 @@ def get_pmcids_via_eutils(keyword: str, max_results: int) -> List[str]:
         for id_elem in root.findall(".//Id"):
             pmcid = f"PMC{id_elem.text}"
             pmcids.append(pmcid)
-
-        time.sleep(REQUEST_DELAY)
     except Exception as e:
         logging.error(f"ESearch failed: {e}")
 
@@ -154,18 +169,37 @@ def get_pmcids_via_eutils(keyword: str, max_results: int) -> List[str]:
 
 
 
+def _parse_summary(doc, pmcid: str) -> dict:
+    title = doc.findtext("Title", "Unknown Title")
+    authors = ", ".join([a.findtext("Name", "") for a in doc.findall(".//Author")])
+    journal = doc.findtext("FullJournalName", "Unknown Journal")
+    pubdate = doc.findtext("PubDate", "")[:10]
+
+    return {
+        "Title": title,
+        "Authors": authors or "Unknown Authors",
+        "Journal": journal,
+        "Date": pubdate,
+        "PMCID": pmcid
+    }
+
+
+
+
 def get_article_metadata(pmcid: str) -> dict:
     """Fetch title, authors, journal, etc. using ESummary"""
     pmcid_num = pmcid.replace("PMC", "")
     params = {
         "db": "pmc",
         "id": pmcid_num,
-        "retmode": "xml"
+        "retmode": "xml",
+        "version": "2.0"
     }
     if NCBI_API_KEY and NCBI_API_KEY != "YOUR_NCBI_API_KEY_HERE":
         params["api_key"] = NCBI_API_KEY
 
     try:
+        rate_limiter.acquire("ncbi_eutils")
         response = requests.get(ESUMMARY_URL, params=params, timeout=20)
         response.raise_for_status()
         root = ET.fromstring(response.content)
@@ -174,19 +208,7 @@ def get_article_metadata(pmcid: str) -> dict:
         if not doc:
             return {"Title": "Unknown", "Authors": "", "Journal": "", "Date": ""}
 
-        title = doc.findtext("Title", "Unknown Title")
-        authors = ", ".join([a.findtext("Name", "") for a in doc.findall(".//Author")])
-        journal = doc.findtext("FullJournalName", "Unknown Journal")
-        pubdate = doc.findtext("PubDate", "")[:10]
-
-        time.sleep(REQUEST_DELAY)
-        return {
-            "Title": title,
-            "Authors": authors or "Unknown Authors",
-            "Journal": journal,
-            "Date": pubdate,
-            "PMCID": pmcid
-        }
+        return _parse_summary(doc, pmcid)
     except Exception as e:
         logging.warning(f"Metadata failed for {pmcid}: {e}")
         return {"Title": pmcid, "Authors": "Unknown", "Journal": "Unknown", "Date": ""}
@@ -194,10 +216,53 @@ def get_article_metadata(pmcid: str) -> dict:
 
 
 
+def get_articles_metadata(pmcids: List[str]) -> dict:
+    """
+    Fetch metadata for a whole ESearch result set with batched ESummary calls
+    (ESUMMARY_BATCH_SIZE ids per request, sent as a POST so long id lists fit).
+    A failed batch is retried with backoff; if it keeps failing its articles
+    get placeholder metadata rather than one ESummary call each. Returns
+    {pmcid: metadata}; ids ESummary did not return are left out.
+    """
+    metadata = {}
+    for i in range(0, len(pmcids), ESUMMARY_BATCH_SIZE):
+        batch = pmcids[i:i + ESUMMARY_BATCH_SIZE]
+        data = {
+            "db": "pmc",
+            "id": ",".join(pmcid.replace("PMC", "") for pmcid in batch),
+            "retmode": "xml",
+            # Without it ESummary answers with <DocSum> records, not <DocumentSummary>.
+            "version": "2.0"
+        }
+        if NCBI_API_KEY and NCBI_API_KEY != "YOUR_NCBI_API_KEY_HERE":
+            data["api_key"] = NCBI_API_KEY
+
+        for attempt in range(ESUMMARY_RETRIES):
+            try:
+                rate_limiter.acquire("ncbi_eutils")
+                response = requests.post(ESUMMARY_URL, data=data, timeout=30)
+                response.raise_for_status()
+                root = ET.fromstring(response.content)
+
+                for doc in root.findall(".//DocumentSummary"):
+                    pmcid = f"PMC{doc.get('uid')}"
+                    metadata[pmcid] = _parse_summary(doc, pmcid)
+                break
+            except Exception as e:
+                logging.warning(f"Batched metadata failed for {len(batch)} articles (attempt {attempt + 1}): {e}")
+                if attempt + 1 < ESUMMARY_RETRIES:
+                    time.sleep(2 ** attempt)
+        else:
+            for pmcid in batch:
+                metadata[pmcid] = {"Title": pmcid, "Authors": "Unknown", "Journal": "Unknown", "Date": ""}
+
+    return metadata
 
 
 
-def download_pdf(pmcid: str, output_dir: str, index: int) -> bool:
+
+
+def download_pdf(pmcid: str, output_dir: str, index: int, metadata: dict = None) -> bool:
     folder_name = Path(output_dir).name
     pdf_filename = f"{folder_name}_{index + 1}.pdf"
     txt_filename = f"{folder_name}_{index + 1}.txt"
@@ -211,28 +276,42 @@ def download_pdf(pmcid: str, output_dir: str, index: int) -> bool:
     if local_pdf_path.exists() and local_pdf_path.stat().st_size > 50000:
         return True
 
-    try:
-        response = requests.get(
-            PDF_BASE_URL.format(pmcid=pmcid),
-            headers={"User-Agent": USER_AGENT, "Referer": "https://europepmc.org/"},
-            timeout=60
-        )
-        response.raise_for_status()
-
-        pdf_bytes = response.content
-        if len(pdf_bytes) < 10000:
-            logging.warning(f"{pmcid}: File too small, likely not a PDF")
-            return False
+    if is_cancelled():
+        return False
 
-        
-        local_pdf_path.write_bytes(pdf_bytes)
+    shared_key = shared_pdf_key("pmcid", pmcid)
 
-        
-        upload_pdf_from_bytes(gcp_pdf_path, pdf_bytes)  
-        logging.info(f"[GCP] PDF uploaded: {gcp_pdf_path}")
+    try:
+        if link_shared_pdf(shared_key, gcp_pdf_path):
+            logging.info(f"{pmcid}: reused from shared store")
+            report_article("uploaded", source="pubmed", index=index + 1, pmcid=pmcid, path=gcp_pdf_path, reused=True)
+        else:
+            response = requests.get(
+                PDF_BASE_URL.format(pmcid=pmcid),
+                headers={"User-Agent": USER_AGENT, "Referer": "https://europepmc.org/"},
+                timeout=60
+            )
+            response.raise_for_status()
+
+            pdf_bytes = response.content
+            if len(pdf_bytes) < 10000:
+                logging.warning(f"{pmcid}: File too small, likely not a PDF")
+                return False
+            # The retrieval may have returned while this download ran.
+            if is_cancelled():
+                return False
+
+            report_article("downloaded", source="pubmed", index=index + 1, pmcid=pmcid, size=len(pdf_bytes))
+            local_pdf_path.write_bytes(pdf_bytes)
+
+            
+            store_shared_pdf(shared_key, pdf_bytes, gcp_pdf_path)
+            logging.info(f"[GCP] PDF uploaded: {gcp_pdf_path}")
+            report_article("uploaded", source="pubmed", index=index + 1, pmcid=pmcid, path=gcp_pdf_path, reused=False)
 
         
-        metadata = get_article_metadata(pmcid)
+        if metadata is None:
+            metadata = get_article_metadata(pmcid)
         current_date = datetime.now().strftime("%b %d, %Y at %H:%M")
 
         metadata_text = f"""Title: {metadata.get("Title", "Unknown Title")}
@@ -263,14 +342,23 @@ def download_pdf(pmcid: str, output_dir: str, index: int) -> bool:
 
 
 
-def download_pdfs_parallel(pmcids: List[str], output_dir: str) -> Tuple[int, int]:
+def download_pdfs_parallel(pmcids: List[str], output_dir: str, start: int = 0) -> Tuple[int, int]:
     success = 0
     failed = 0
 
+    metadata = get_articles_metadata(pmcids)
+    logging.info(f"Prefetched metadata for {len(metadata)}/{len(pmcids)} articles")
+
+    for i, pmcid in enumerate(pmcids, start=start):
+        title = metadata.get(pmcid, {}).get("Title")
+        report_article("found", source="pubmed", index=i + 1, pmcid=pmcid, title=title)
+
     with ThreadPoolExecutor(max_workers=8) as executor:
+        # Each worker runs in a copy of this context so progress reports and
+        # cancellation reach it.
         futures = {
-            executor.submit(download_pdf, pmcid, output_dir, i): pmcid
-            for i, pmcid in enumerate(pmcids)
+            executor.submit(contextvars.copy_context().run, download_pdf, pmcid, output_dir, i, metadata.get(pmcid)): (i, pmcid)
+            for i, pmcid in enumerate(pmcids, start=start)
         }
 
         for future in as_completed(futures):
@@ -279,6 +367,9 @@ def download_pdfs_parallel(pmcids: List[str], output_dir: str) -> Tuple[int, int
                 success += 1
             else:
                 failed += 1
+                i, pmcid = futures[future]
+                report_article("failed", source="pubmed", index=i + 1, pmcid=pmcid)
+            report_progress(stage="downloading", source="pubmed", done=success + failed, total=len(pmcids))
 
     return success, failed
 
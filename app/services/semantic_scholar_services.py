@@ -1,15 +1,17 @@
 
 
-import os, time, requests, re, httpx, logging, uuid
+import os, time, requests, re, httpx, logging, uuid, asyncio
 from fastapi import Request, HTTPException
 from schemas.semantic_scholar_schemas import SemanticScholarRetriverRequest
-from core.utils import utility
-from core.utils.gcp_utils import upload_text_file, upload_pdf_from_path
+from core.utils import utility, rate_limiter, search_cache, paginator
+from core.utils.progress import report_progress, report_article, is_cancelled
+from core.utils.gcp_utils import upload_text_file, shared_pdf_key, link_shared_pdf, store_shared_pdf
 from services.search_services import add_search_term
 from database.database import get_db
 import traceback
 from requests.exceptions import ConnectTimeout, ReadTimeout
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 
 logger = logging.getLogger("semantic_scholar")
@@ -26,10 +28,6 @@ if not logger.handlers:
 
 SEMANTIC_SCHOLAR_API_KEY = os.getenv("SEMANTIC_SCHOLAR_API_KEY")
 
-
-_last_request_time = 0.0
-_RATE_LIMIT_DELAY = 1.0  
-
 def _log_context(request_id: str):
     return {"request_id": request_id}
 
@@ -96,14 +94,43 @@ async def main(keyword, max_results, output_dir):
         os.makedirs(output_dir, exist_ok=True)
         logger.debug(f"ensured output_dir: {output_dir}", extra=ctx)
 
-        all_pdf_links = []
-        all_metadata = []
-        seen_urls = set()
+        all_pdf_links, all_metadata = await asyncio.to_thread(get_all_pdf_links, keyword, max_results)
+
+        if not all_pdf_links:
+            logger.warning("No PDF links found from either source", extra=ctx)
+            raise ValueError("No PDF links found in the search results")
+
+        logger.info(f"TOTAL unique PDFs to download: {len(all_pdf_links)}", extra=ctx)
+
+        num_success, num_failed = await download_pdfs(all_pdf_links, all_metadata, output_dir)
+        logger.info(f"main END – success:{num_success} failed:{num_failed}", extra=ctx)
+        return num_success, num_failed
+
+    except Exception as e:
+        logger.exception("unexpected error in main", extra=ctx)
+        return 0, max_results
+
+
+
+
+
+def get_all_pdf_links(keyword, max_results):
+    """Merge the authenticated and public searches, de-duplicated by PDF URL."""
+    ctx = _log_context(getattr(logging.getLogger(), "request_id", "UNKNOWN"))
+    all_pdf_links = []
+    all_metadata = []
+    seen_urls = set()
+
+    # The authenticated and public searches draw from separate rate-limit
+    # buckets, so both run at once; results are still merged key-first.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        public_future = executor.submit(get_pdf_links, keyword, max_results, False)
+        key_future = executor.submit(get_pdf_links, keyword, max_results, True) if SEMANTIC_SCHOLAR_API_KEY else None
 
         # 1. With API key
-        if SEMANTIC_SCHOLAR_API_KEY:
+        if key_future:
             logger.info("Searching with API key (higher limits)", extra=ctx)
-            links1, meta1 = get_pdf_links(keyword, max_results, use_api_key=True)
+            links1, meta1 = key_future.result()
             for link, meta in zip(links1, meta1):
                 if link not in seen_urls:
                     seen_urls.add(link)
@@ -115,33 +142,17 @@ async def main(keyword, max_results, output_dir):
 
         # 2. Without API key (public)
         logger.info("Searching public API (no key)", extra=ctx)
-        links2, meta2 = get_pdf_links(keyword, max_results, use_api_key=False)
-        new_added = 0
-        for link, meta in zip(links2, meta2):
-            if link not in seen_urls:
-                seen_urls.add(link)
-                all_pdf_links.append(link)
-                all_metadata.append({**meta, "source": "public"})
-                new_added += 1
-        logger.info(f"PDFs received from public API (no key): {len(links2)} (added {new_added} new)", extra=ctx)
-
-        
-        all_pdf_links = all_pdf_links[:max_results]
-        all_metadata = all_metadata[:max_results]
-
-        if not all_pdf_links:
-            logger.warning("No PDF links found from either source", extra=ctx)
-            raise ValueError("No PDF links found in the search results")
+        links2, meta2 = public_future.result()
+    new_added = 0
+    for link, meta in zip(links2, meta2):
+        if link not in seen_urls:
+            seen_urls.add(link)
+            all_pdf_links.append(link)
+            all_metadata.append({**meta, "source": "public"})
+            new_added += 1
+    logger.info(f"PDFs received from public API (no key): {len(links2)} (added {new_added} new)", extra=ctx)
 
-        logger.info(f"TOTAL unique PDFs to download: {len(all_pdf_links)}", extra=ctx)
-
-        num_success, num_failed = await download_pdfs(all_pdf_links, all_metadata, output_dir)
-        logger.info(f"main END – success:{num_success} failed:{num_failed}", extra=ctx)
-        return num_success, num_failed
-
-    except Exception as e:
-        logger.exception("unexpected error in main", extra=ctx)
-        return 0, max_results
+    return all_pdf_links[:max_results], all_metadata[:max_results]
 
 
 
@@ -159,23 +170,18 @@ def get_pdf_links(keyword, max_results, use_api_key: bool):
     mode = "with API key" if use_api_key else "public"
     logger.debug(f"get_pdf_links START [{mode}] – keyword={keyword!r} max={max_results}", extra=ctx)
 
-    pdf_links, metadatas = [], []
-    offset = 0
-    while len(pdf_links) < max_results:
+    def fetch_page(page):
+        offset = page * 10
         logger.debug(f"[{mode}] fetching page offset={offset}", extra=ctx)
         data = search_semantic_scholar(keyword, offset, limit=10, use_api_key=use_api_key)
         new_links, new_meta = extract_pdf_links(data)
 
-        pdf_links.extend(new_links)
-        metadatas.extend(new_meta)
-
-        pdf_links = pdf_links[:max_results]
-        metadatas = metadatas[:max_results]
+        has_more = bool(data.get("data")) and "next" in data
+        if not has_more:
+            logger.info(f"[{mode}] no more results at offset={offset}", extra=ctx)
+        return new_links, new_meta, has_more
 
-        if not new_links:
-            logger.info(f"[{mode}] no more results – stopping", extra=ctx)
-            break
-        offset += 10
+    pdf_links, metadatas = paginator.collect_pages(fetch_page, max_results, source="semantic_scholar")
 
     logger.debug(f"get_pdf_links END [{mode}] – found {len(pdf_links)}", extra=ctx)
     return pdf_links, metadatas
@@ -184,35 +190,33 @@ def get_pdf_links(keyword, max_results, use_api_key: bool):
 
 
 
-def _enforce_rate_limit():
-    """Ensure at least 1 second between any two API calls."""
-    global _last_request_time
-    now = time.time()
-    elapsed = now - _last_request_time
-    if elapsed < _RATE_LIMIT_DELAY:
-        sleep_time = _RATE_LIMIT_DELAY - elapsed
-        logger.debug(f"Rate-limit sleep: {sleep_time:.2f}s")
-        time.sleep(sleep_time)
-    _last_request_time = time.time()
+def search_semantic_scholar(keyword, offset=0, limit=10, use_api_key: bool = False):
+    source = "semantic_scholar_key" if use_api_key else "semantic_scholar_public"
+    return search_cache.cached_search(
+        source, keyword, offset, limit,
+        lambda: _fetch_semantic_scholar_page(keyword, offset, limit, use_api_key),
+        is_valid=lambda data: "total" in data
+    )
 
 
 
 
 
-def search_semantic_scholar(keyword, offset=0, limit=10, use_api_key: bool = False):
+def _fetch_semantic_scholar_page(keyword, offset=0, limit=10, use_api_key: bool = False):
     ctx = _log_context(getattr(logging.getLogger(), "request_id", "UNKNOWN"))
     url = "https://api.semanticscholar.org/graph/v1/paper/search"
     params = {
         "query": keyword, "offset": offset, "limit": limit,
-        "fields": "paperId,title,authors,year,abstract,url,openAccessPdf,publicationVenue"
+        "fields": "paperId,title,authors,year,abstract,url,openAccessPdf,publicationVenue,externalIds"
     }
     headers = {}
     if use_api_key:
         headers["x-api-key"] = SEMANTIC_SCHOLAR_API_KEY
+    bucket = "semantic_scholar_key" if use_api_key else "semantic_scholar_public"
 
     max_retries = 3
     for attempt in range(max_retries):
-        _enforce_rate_limit()  # 1 request / second
+        rate_limiter.acquire(bucket)
 
         logger.debug(f"calling SemanticScholar API [{'(auth)' if use_api_key else ''}] – attempt {attempt+1}/{max_retries}", extra=ctx)
         try:
@@ -220,7 +224,7 @@ def search_semantic_scholar(keyword, offset=0, limit=10, use_api_key: bool = Fal
             if response.status_code == 429:
                 wait = 2 ** attempt  # 1, 2, 4 seconds
                 logger.warning(f"Rate limit (429) – retrying in {wait}s (attempt {attempt+1})", extra=ctx)
-                time.sleep(wait)
+                rate_limiter.penalize(bucket, wait)
                 continue
             response.raise_for_status()
             data = response.json()
@@ -263,7 +267,8 @@ def extract_pdf_links(data):
                     'authors': [a.get('name', '') for a in result.get('authors', [])],
                     'year': result.get('year'),
                     'url': pdf_url,
-                    'abstract': result.get('abstract', '')
+                    'abstract': result.get('abstract', ''),
+                    'doi': (result.get('externalIds') or {}).get('DOI')
                 }
                 metadata.append(d)
     logger.debug(f"extracted {len(links)} PDF links from page", extra=ctx)
@@ -274,19 +279,26 @@ def extract_pdf_links(data):
 
 
 
-async def download_pdfs(pdf_links, metadatas: list[dict], output_dir):
+async def download_pdfs(pdf_links, metadatas: list[dict], output_dir, start=0):
     ctx = _log_context(getattr(logging.getLogger(), "request_id", "UNKNOWN"))
     logger.info(f"download_pdfs START – {len(pdf_links)} PDFs", extra=ctx)
 
+    for ind, (link, metadata) in enumerate(zip(pdf_links, metadatas), start=start + 1):
+        report_article("found", source="semantic_scholar", index=ind, url=link, title=metadata.get("title"))
+
     num_success, num_failed = 0, 0
-    for ind, link in enumerate(pdf_links, start=1):
-        metadata = metadatas[ind - 1]
+    for ind, (link, metadata) in enumerate(zip(pdf_links, metadatas), start=start + 1):
+        if is_cancelled():
+            logger.info("download_pdfs cancelled", extra=ctx)
+            break
         source = metadata.get("source", "unknown")
-        ok = download_pdf_with_status(link, metadata, output_dir, ind, source_label=source)
+        ok = await asyncio.to_thread(download_pdf_with_status, link, metadata, output_dir, ind, source)
         if ok:
             num_success += 1
         else:
             num_failed += 1
+            report_article("failed", source="semantic_scholar", index=ind, url=link)
+        report_progress(stage="downloading", source="semantic_scholar", done=num_success + num_failed, total=len(pdf_links))
 
     logger.info(f"download_pdfs END – success:{num_success} failed:{num_failed}", extra=ctx)
     return num_success, num_failed
@@ -320,6 +332,33 @@ def download(url, metadata: dict, dir_, ind):
     dir_ = dir_.replace("\\", "/").rstrip("/") + "/"
     base_name = os.path.basename(dir_.rstrip("/"))
 
+    filename_base = f"{base_name}_{ind}"
+    txt_filename = f"{filename_base}.txt"
+    pdf_filename = f"{filename_base}.pdf"
+
+    txt_key = f"{dir_}/{txt_filename}".replace("//", "/")
+    pdf_key = os.path.join(dir_, pdf_filename)
+
+    txt_content = f"""Title: {metadata.get('title', 'Unknown')}
+Authors: {', '.join(metadata.get('authors', ['Unknown']))}
+Year: {metadata.get('year') or 'Unknown'}
+Source: {metadata.get('source', 'Unknown')}
+URL: {metadata.get('url', 'Unknown')}
+Fetched Date: {datetime.now().strftime('%b %d, %Y at %H:%M')}
+Fetched From: semantic_scholar
+"""
+
+    if metadata.get('doi'):
+        shared_key = shared_pdf_key("doi", metadata['doi'])
+    else:
+        shared_key = shared_pdf_key("url", url)
+
+    if link_shared_pdf(shared_key, pdf_key):
+        logger.debug(f"PDF #{ind} reused from shared store: {pdf_key}", extra=ctx)
+        report_article("uploaded", source="semantic_scholar", index=ind, url=url, path=pdf_key, reused=True)
+        upload_text_file(path=txt_key, file=txt_content)
+        return True
+
     max_retries = 3
     for attempt in range(max_retries):
         try:
@@ -332,33 +371,13 @@ def download(url, metadata: dict, dir_, ind):
             if response.status_code != 200:
                 raise RuntimeError(f"HTTP {response.status_code}")
 
-            filename_base = f"{base_name}_{ind}"
-            txt_filename = f"{filename_base}.txt"
-            pdf_filename = f"{filename_base}.pdf"
-
-
-            txt_key = f"{dir_}/{txt_filename}".replace("//", "/")
-            pdf_path_local = os.path.join(dir_, pdf_filename)
-
-            
-            txt_content = f"""Title: {metadata.get('title', 'Unknown')}
-Authors: {', '.join(metadata.get('authors', ['Unknown']))}
-Year: {metadata.get('year') or 'Unknown'}
-Source: {metadata.get('source', 'Unknown')}
-URL: {metadata.get('url', 'Unknown')}
-Fetched Date: {datetime.now().strftime('%b %d, %Y at %H:%M')}
-Fetched From: semantic_scholar
-"""
-
+            report_article("downloaded", source="semantic_scholar", index=ind, url=url, size=len(response.content))
             upload_text_file(path=txt_key, file=txt_content)
             logger.debug(f"Metadata uploaded: {txt_key}")
 
-            
-            with open(pdf_path_local, "wb") as f:
-                f.write(response.content)
-
-            upload_pdf_from_path(pdf_path_local)
-            logger.debug(f"PDF uploaded: {pdf_path_local}")
+            store_shared_pdf(shared_key, response.content, pdf_key)
+            logger.debug(f"PDF uploaded: {pdf_key}")
+            report_article("uploaded", source="semantic_scholar", index=ind, url=url, path=pdf_key, reused=False)
             return True
 
         except (ConnectTimeout, ReadTimeout) as e:
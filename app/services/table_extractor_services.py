@@ -1,12 +1,15 @@
-import base64, requests, csv, zipfile, os
-from pdf2image import convert_from_bytes
-from io import BytesIO, StringIO
+import base64, requests, csv, zipfile, os, asyncio, tempfile, multiprocessing
+import fitz
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
 from openai import OpenAI
 from dotenv import load_dotenv
-from fastapi import UploadFile, Request
+from fastapi import UploadFile, Request, HTTPException
 from core.utils.aws_utils import bucket_name, s3_client
 from schemas.extractors_schemas import TableExtractorRequest
 from core.utils.gcp_utils import upload_csv_file
+from core.utils.progress import report_progress
+from core.utils.pdf_utils import find_table_candidate_pages
 
 
 
@@ -17,42 +20,280 @@ load_dotenv(override=True)
 api_key=os.getenv('OPENAI_API_KEY')
 
 
+TABLE_VISION_CONCURRENCY = int(os.getenv("TABLE_VISION_CONCURRENCY", "6"))
+RASTER_WORKERS = int(os.getenv("RASTER_WORKERS", str(min(4, os.cpu_count() or 1))))
+RASTER_CHUNK_PAGES = int(os.getenv("RASTER_CHUNK_PAGES", "4"))
+RASTER_MAX_PAGES_IN_MEMORY = int(os.getenv("RASTER_MAX_PAGES_IN_MEMORY", str(2 * TABLE_VISION_CONCURRENCY)))
+VISION_MAX_SHORT_SIDE = 768      # gpt-4o-mini high-detail tiles: short side scaled to 768 px ...
+VISION_MAX_LONG_SIDE = 2048      # ... after fitting into 2048 x 2048
+RENDER_MIN_DPI = 72
+RENDER_MAX_DPI = 200
+JPEG_QUALITY = int(os.getenv("TABLE_JPEG_QUALITY", "80"))
+NATIVE_TABLE_MIN_CONFIDENCE = float(os.getenv("NATIVE_TABLE_MIN_CONFIDENCE", "0.6"))
+TABLE_ENGINES = ("auto", "native", "vision")
+_raster_pool = None
 
 
-async def extract_tables(request:Request,project_name:str,file:UploadFile):
+
+
+async def extract_tables(request:Request,project_name:str,file:UploadFile, engine:str = "auto"):
     user_id = request.state.user.get("user_id")
     project_name = project_name
     dir = f"users/{user_id}/{project_name}/csv"
     name = file.filename
     pdf_bytes = await file.read()
-    images = convert_from_bytes(pdf_bytes)
-    extracted_data = []
     csv_buffers = []
 
-    for i, image in enumerate(images):
-        img_bytes = BytesIO()
-        image.save(img_bytes, format="JPEG")
-        img_bytes.seek(0)
-
-        extracted_table = extract_tables_from_image(img_bytes.read())
-
-        if extracted_table and extracted_table.strip() != "No table found.":
-            print(f"Extracted Table from page {name}{i+1}:")
-            print(extracted_table)
-            key = f"{dir}/{name}_{i+1}.csv"
-            csv_buffer = StringIO()
-            csv_writer = csv.writer(csv_buffer)
-
-            table_lines = extracted_table.split('\n')
-            for line in table_lines:
-                if line.strip(): 
-                    csv_writer.writerow([cell.strip() for cell in line.split('|')])
-            
-            csv_buffers.append((f"{name}_{i+1}.csv", csv_buffer))
-            upload_csv_file(path=key,file=csv_buffer.getvalue() )
+    tables, pages_skipped = await extract_page_tables(pdf_bytes, engine=engine)
+    for page_number, page_tables in tables:
+        if page_tables:
+            print(f"Extracted {len(page_tables)} table(s) from page {name}{page_number}")
+            for table_index, csv_buffer in enumerate(page_tables, start=1):
+                suffix = f"{page_number}" if len(page_tables) == 1 else f"{page_number}_{table_index}"
+                key = f"{dir}/{name}_{suffix}.csv"
+                csv_buffers.append((f"{name}_{suffix}.csv", csv_buffer))
+                upload_csv_file(path=key,file=csv_buffer.getvalue() )
+        else:
+            print(f"No table detected on page {name}{page_number}.")
+    return {"message": "Csv file extracted successfully!", "pages_skipped": pages_skipped}
+
+
+
+
+
+def table_to_csv(extracted_table: str) -> StringIO:
+    csv_buffer = StringIO()
+    csv_writer = csv.writer(csv_buffer)
+
+    table_lines = extracted_table.split('\n')
+    for line in table_lines:
+        if line.strip(): 
+            csv_writer.writerow([cell.strip() for cell in line.split('|')])
+    return csv_buffer
+
+
+
+
+
+def _get_raster_pool():
+    global _raster_pool
+    if _raster_pool is None:
+        # Spawned, not forked: a fork of the threaded server could inherit a
+        # lock held by another thread and hang in the child.
+        _raster_pool = ProcessPoolExecutor(max_workers=RASTER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _raster_pool
+
+
+
+
+
+def page_render_dpi(rect) -> int:
+    """
+    DPI at which a page fills, but does not exceed, what the vision model looks
+    at: VISION_MAX_SHORT_SIDE x VISION_MAX_LONG_SIDE pixels. Anything larger is
+    downscaled by the API anyway and only costs memory and upload time.
+    """
+    short_side, long_side = sorted((rect.width / 72, rect.height / 72))
+    dpi = min(VISION_MAX_SHORT_SIDE / short_side, VISION_MAX_LONG_SIDE / long_side)
+    return int(max(RENDER_MIN_DPI, min(dpi, RENDER_MAX_DPI)))
+
+
+
+
+
+def _rasterize_pages(pdf_path, page_numbers):
+    """
+    Runs in a worker process: render the given 1-based pages straight to JPEG
+    bytes, one at a time. The PDF is read from a local file so each task only
+    pickles a path, not the document.
+    """
+    doc = fitz.open(pdf_path)
+    try:
+        jpegs = []
+        for page_number in page_numbers:
+            page = doc[page_number - 1]
+            pixmap = page.get_pixmap(dpi=page_render_dpi(page.rect), colorspace=fitz.csRGB, alpha=False)
+            jpegs.append(pixmap.tobytes("jpeg", jpg_quality=JPEG_QUALITY))
+            pixmap = None
+        return jpegs
+    finally:
+        doc.close()
+
+
+
+
+
+def rows_to_csv(rows) -> StringIO:
+    csv_buffer = StringIO()
+    csv.writer(csv_buffer).writerows(rows)
+    return csv_buffer
+
+
+
+
+
+def _native_page_tables(page, found=None):
+    """
+    Rebuild cell grids for one page from its text spans and ruling lines with
+    PyMuPDF's table finder. Returns (tables as lists of rows, confidence 0..1);
+    confidence is the share of non-empty cells in the sparsest table found, and
+    0 when the page has no text layer or no usable table. `found` is the page's
+    TableFinder when the pre-filter already ran it.
+    """
+    if len(page.get_text("text").strip()) < 20:
+        return [], 0.0
+
+    if found is None:
+        try:
+            found = page.find_tables()
+        except Exception as e:
+            print(f"Native table finder failed on page {page.number + 1}: {e}")
+            return [], 0.0
+
+    tables, confidences = [], []
+    for table in found.tables:
+        rows = [[(cell or "").strip() for cell in row] for row in table.extract()]
+        rows = [row for row in rows if any(row)]
+        if len(rows) < 2 or table.col_count < 2:
+            continue
+        cells = sum(len(row) for row in rows)
+        filled = sum(1 for row in rows for cell in row if cell)
+        tables.append(rows)
+        confidences.append(filled / cells)
+
+    return tables, (min(confidences) if confidences else 0.0)
+
+
+
+
+
+def _page_csvs(extracted_table, native_tables):
+    """
+    CSVs for a page sent to vision. When the vision call failed (None) or saw no
+    table, the native tables found for the page are used instead of nothing.
+    """
+    if extracted_table and extracted_table.strip().rstrip(".").lower() != "no table found":
+        return [table_to_csv(extracted_table)]
+    return [rows_to_csv(rows) for rows in native_tables]
+
+
+
+
+
+def find_candidates_with_native_tables(pdf_bytes):
+    """
+    Pre-filter pages and run the native engine on each candidate in the same
+    pass, reusing the pre-filter's TableFinder: (candidates, page_count,
+    {page_number: (tables, confidence)}).
+    """
+    native = {}
+
+    def keep(page, found):
+        native[page.number + 1] = _native_page_tables(page, found)
+
+    candidates, page_count = find_table_candidate_pages(pdf_bytes, on_candidate=keep)
+    return candidates, page_count, native
+
+
+
+
+
+def _write_temp_pdf(pdf_bytes) -> str:
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(pdf_bytes)
+        return tmp.name
+
+
+
+
+
+async def extract_page_tables(pdf_bytes, engine="auto"):
+    """
+    Score every page locally and extract tables from the candidates only.
+
+    engine="native" rebuilds tables from the PDF itself, with no LLM.
+    engine="vision" rasterizes pages in the process pool, RASTER_CHUNK_PAGES
+    pages per task, and sends each to the vision model as soon as its chunk is
+    ready, with at most TABLE_VISION_CONCURRENCY calls in flight.
+    engine="auto" tries native first and falls back to vision for scanned pages
+    and pages whose native confidence is below NATIVE_TABLE_MIN_CONFIDENCE.
+
+    Returns ([(page_number, [csv StringIO, ...])] in page order, pages_skipped).
+    """
+    if engine not in TABLE_ENGINES:
+        raise HTTPException(status_code=400, detail=f"engine must be one of: {', '.join(TABLE_ENGINES)}")
+
+    native = {}
+    if engine in ("native", "auto"):
+        candidates, page_count, native = await asyncio.to_thread(find_candidates_with_native_tables, pdf_bytes)
+    else:
+        candidates, page_count = await asyncio.to_thread(find_table_candidate_pages, pdf_bytes)
+    pages_skipped = page_count - len(candidates)
+    print(f"Table pre-filter: {len(candidates)} candidate page(s), {pages_skipped} of {page_count} skipped")
+
+    if engine == "vision":
+        vision_pages = candidates
+    elif engine == "auto":
+        vision_pages = [p for p in candidates if native[p][1] < NATIVE_TABLE_MIN_CONFIDENCE]
+    else:
+        vision_pages = []
+    print(f"Table engine '{engine}': {len(candidates) - len(vision_pages)} page(s) native, {len(vision_pages)} via vision")
+
+    loop = asyncio.get_running_loop()
+    pool = _get_raster_pool()
+    semaphore = asyncio.Semaphore(TABLE_VISION_CONCURRENCY)
+    # One permit per rendered page held in memory; a chunk's pages are released
+    # together once its vision calls are done, or straight away if rendering fails.
+    pages_in_memory = asyncio.Semaphore(max(RASTER_MAX_PAGES_IN_MEMORY, RASTER_CHUNK_PAGES))
+    finished = 0
+
+    async def vision(page_number, jpeg):
+        nonlocal finished
+        async with semaphore:
+            extracted_table = await asyncio.to_thread(extract_tables_from_image, jpeg)
+        finished += 1
+        report_progress(stage="extracting_tables", done=finished, total=len(vision_pages), pages_skipped=pages_skipped)
+        return page_number, extracted_table
+
+    reserve_lock = asyncio.Lock()
+
+    async def chunk(pdf_path, page_numbers):
+        # Reserve a whole chunk at once so partly-reserved chunks cannot starve each other.
+        async with reserve_lock:
+            for _ in page_numbers:
+                await pages_in_memory.acquire()
+        try:
+            try:
+                jpegs = await loop.run_in_executor(pool, _rasterize_pages, pdf_path, page_numbers)
+            except Exception as e:
+                # The pages keep their native tables, if any.
+                print(f"Rendering pages {page_numbers} failed: {e}")
+                return [(page_number, None) for page_number in page_numbers]
+            return await asyncio.gather(*(vision(page_number, jpeg) for page_number, jpeg in zip(page_numbers, jpegs)))
+        finally:
+            for _ in page_numbers:
+                pages_in_memory.release()
+
+    vision_tables = {}
+    if vision_pages:
+        pdf_path = await asyncio.to_thread(_write_temp_pdf, pdf_bytes)
+        try:
+            chunks = await asyncio.gather(*(
+                chunk(pdf_path, vision_pages[i:i + RASTER_CHUNK_PAGES])
+                for i in range(0, len(vision_pages), RASTER_CHUNK_PAGES)
+            ))
+        finally:
+            os.remove(pdf_path)
+        vision_tables = dict(page for pages in chunks for page in pages)
+
+    tables = []
+    for page_number in candidates:
+        if page_number in vision_tables:
+            native_tables = native[page_number][0] if page_number in native else []
+            tables.append((page_number, _page_csvs(vision_tables[page_number], native_tables)))
         else:
-            print(f"No table detected on page {name}{i + 1}.")
-    return {"message": "Csv file extracted successfully!"}
+            tables.append((page_number, [rows_to_csv(rows) for rows in native[page_number][0]]))
+    return tables, pages_skipped
 
 
 
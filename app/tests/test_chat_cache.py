@@ -0,0 +1,24 @@
+import pytest
+
+from core.utils import chat_cache
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    limits = {"embedding": 2, "answer": 4}
+    if request.param == "memory":
+        return chat_cache.MemoryBackend(limits)
+    return chat_cache.SqliteBackend(str(tmp_path / "chat_cache.sqlite3"), limits)
+
+
+def test_levels_are_bounded_separately(backend):
+    for i in range(6):
+        backend.put("embedding", str(i), [0.5] * 8)
+        backend.put("answer", str(i), f"answer {i}")
+
+    assert [i for i in range(6) if backend.get("embedding", str(i)) is not None] == [4, 5]
+    assert [i for i in range(6) if backend.get("answer", str(i)) is not None] == [2, 3, 4, 5]
+
+
+def test_embedding_level_defaults_smaller_than_answers():
+    assert chat_cache.LEVEL_MAX_ENTRIES["embedding"] < chat_cache.LEVEL_MAX_ENTRIES["answer"]
@@ -0,0 +1,66 @@
+import fitz
+
+from core.utils import chunker
+
+
+ROWS = ["Treatment 45 55 100", "Placebo 40 60 100", "Total 85 115 200"]
+
+
+def _paragraph(page, y, topic):
+    text = " ".join(f"Sentence {i} about {topic} reports a measured effect in detail." for i in range(5))
+    page.insert_textbox(fitz.Rect(72, y, 540, y + 90), text, fontsize=10)
+
+
+def _paper() -> bytes:
+    doc = fitz.open()
+    for number in range(3):
+        page = doc.new_page()
+        page.insert_text((72, 40), "Journal of Testing Vol. 12", fontsize=8)
+        page.insert_text((300, 820), str(number + 1), fontsize=8)
+        if number == 0:
+            page.insert_text((72, 100), "1. Introduction", fontsize=14)
+            _paragraph(page, 120, "background")
+            _paragraph(page, 240, "aims")
+        elif number == 1:
+            page.insert_text((72, 100), "2. Results", fontsize=14)
+            _paragraph(page, 120, "enrolment")
+            page.insert_text((72, 240), "Table 1. Outcomes by arm", fontsize=9)
+            for i, row in enumerate(ROWS):
+                page.insert_text((72, 280 + 40 * i), row, fontsize=10)
+        else:
+            page.insert_text((72, 100), "3. Discussion", fontsize=14)
+            _paragraph(page, 120, "interpretation")
+    return doc.tobytes()
+
+
+def test_table_rows_stay_in_their_section_chunk():
+    chunks = chunker.chunk_pdf(_paper(), "structured")
+
+    with_rows = [chunk for chunk in chunks if any(row in chunk for row in ROWS)]
+    assert len(with_rows) == 1
+    assert all(row in with_rows[0] for row in ROWS)
+    assert "2. Results" in with_rows[0]
+    # One chunk per section: each heading starts a chunk, nothing else does.
+    assert len(chunks) == 3
+
+
+def test_headers_are_dropped_from_a_one_page_window():
+    pdf = _paper()
+    chunks = chunker.chunk_pdf(pdf, "structured", pages=[2])
+
+    assert chunks
+    assert not any("Journal of Testing" in chunk for chunk in chunks)
+    assert "3. Discussion" in chunks[0]
+
+
+def test_font_evidence_decides_unnumbered_headings():
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 100), "Patient Characteristics", fontsize=14)
+    _paragraph(page, 120, "age")
+    page.insert_text((72, 240), "Mean Age Was Similar", fontsize=10)
+    _paragraph(page, 260, "sex")
+    chunks = chunker.chunk_pdf(doc.tobytes(), "structured")
+
+    assert len(chunks) == 1
+    assert chunks[0].startswith("Patient Characteristics")
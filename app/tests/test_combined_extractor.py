@@ -0,0 +1,69 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import fitz
+
+from services import combined_extractor_services as combined
+
+
+def _pdf(pages: int) -> bytes:
+    doc = fitz.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f"Table {i + 1}")
+    return doc.tobytes()
+
+
+class _Upload:
+    filename = "paper.pdf"
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def read(self):
+        return self.data
+
+
+def test_cancelled_extraction_stops_the_walker(monkeypatch):
+    vision_started, release_vision = threading.Event(), threading.Event()
+    walker_done = threading.Event()
+    walk_pages = combined._walk_pages
+
+    def vision(jpeg):
+        vision_started.set()
+        release_vision.wait(10)
+        return "No table found"
+
+    def walk(*args):
+        try:
+            walk_pages(*args)
+        finally:
+            walker_done.set()
+
+    # Every page needs a render, and only one rendered page may wait in
+    # memory, so the walker blocks on the second page while vision runs.
+    monkeypatch.setattr(combined, "table_scan", lambda page: (1.0, None))
+    monkeypatch.setattr(combined, "_native_page_tables", lambda page, found: ([], 0.0))
+    monkeypatch.setattr(combined, "page_images", lambda doc, page, seen: [])
+    monkeypatch.setattr(combined, "extract_tables_from_image", vision)
+    monkeypatch.setattr(combined, "RASTER_MAX_PAGES_IN_MEMORY", 1)
+    monkeypatch.setattr(combined, "PAGE_SLOT_POLL_SECONDS", 0.05)
+    monkeypatch.setattr(combined, "_walk_pages", walk)
+
+    request = SimpleNamespace(state=SimpleNamespace(user={"user_id": "u1"}))
+
+    async def main():
+        extraction = asyncio.create_task(combined.extract_table_and_image(request, "demo", _Upload(_pdf(10))))
+        assert await asyncio.to_thread(vision_started.wait, 5)
+        extraction.cancel()
+        try:
+            await extraction
+        except asyncio.CancelledError:
+            pass
+        # The vision call on page 1 is still running in its thread; the walker
+        # must exit anyway instead of waiting for page slots.
+        exited = await asyncio.to_thread(walker_done.wait, 5)
+        release_vision.set()
+        return exited
+
+    assert asyncio.run(main())
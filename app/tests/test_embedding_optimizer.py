@@ -0,0 +1,87 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+from fastapi import HTTPException
+
+from services import chat_pdf
+
+
+def _status_error(cls, status: int, code: str = None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    return cls(f"Error code: {status}", response=httpx.Response(status, request=request),
+               body={"code": code} if code else None)
+
+
+class _Embeddings:
+    def __init__(self, fail):
+        self.fail = fail
+        self.calls = []
+
+    async def create(self, input, model):
+        self.calls.append(len(input))
+        error = self.fail(input)
+        if error:
+            raise error
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(text))]) for text in input])
+
+
+def _optimizer(fail, **kwargs):
+    embeddings = _Embeddings(fail)
+    optimizer = chat_pdf.EmbeddingOptimizer(SimpleNamespace(embeddings=embeddings), base_delay=0,
+                                            batch_tokens=10**6, max_inputs=16, **kwargs)
+    return optimizer, embeddings
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch):
+    async def acquire_async(name, tokens=1):
+        pass
+
+    monkeypatch.setattr(chat_pdf, "acquire_async", acquire_async)
+    monkeypatch.setattr(chat_pdf.random, "uniform", lambda a, b: 0)
+
+
+def test_bad_key_fails_without_splitting():
+    optimizer, embeddings = _optimizer(lambda input: _status_error(openai.AuthenticationError, 401))
+
+    with pytest.raises(openai.AuthenticationError):
+        asyncio.run(optimizer.embed([f"chunk {i}" for i in range(64)]))
+
+    # One call per packed batch at most; no retries, no halves.
+    assert len(embeddings.calls) <= 64 // 16
+    assert all(size == 16 for size in embeddings.calls)
+
+
+def test_context_length_error_splits_the_batch():
+    too_long = lambda input: (_status_error(openai.BadRequestError, 400, "context_length_exceeded")
+                              if len(input) > 4 else None)
+    optimizer, embeddings = _optimizer(too_long)
+
+    chunks = [f"chunk {i}" for i in range(16)]
+    result = asyncio.run(optimizer.embed(chunks))
+
+    assert result == [[float(len(text))] for text in chunks]
+    assert embeddings.calls.count(4) == 4
+
+
+def test_other_bad_request_is_not_split():
+    optimizer, embeddings = _optimizer(lambda input: _status_error(openai.BadRequestError, 400, "invalid_input"))
+
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(optimizer.embed([f"chunk {i}" for i in range(16)]))
+
+    assert embeddings.calls == [16]
+
+
+def test_split_depth_is_capped():
+    optimizer, embeddings = _optimizer(lambda input: asyncio.TimeoutError(), max_retries=0, max_split_depth=2)
+
+    with pytest.raises(HTTPException):
+        asyncio.run(optimizer.embed([f"chunk {i}" for i in range(16)]))
+
+    # 16, then 8 + 8, then four batches of 4 at the cap; never single chunks.
+    assert min(embeddings.calls) == 4
+    assert len(embeddings.calls) <= 7
@@ -0,0 +1,75 @@
+from pathlib import Path
+
+import pytest
+import requests
+
+from services import pubmed_services
+
+
+FIXTURE = Path(__file__).parent / "fixtures" / "esummary_pmc_v2.xml"
+
+
+class _Response:
+    def __init__(self, content: bytes):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch):
+    monkeypatch.setattr(pubmed_services.rate_limiter, "acquire", lambda name: None)
+    monkeypatch.setattr(pubmed_services.time, "sleep", lambda seconds: None)
+
+
+def test_batched_esummary_parses_version_2_records(monkeypatch):
+    calls = []
+
+    def post(url, data, timeout):
+        calls.append(data)
+        return _Response(FIXTURE.read_bytes())
+
+    monkeypatch.setattr(pubmed_services.requests, "post", post)
+    metadata = pubmed_services.get_articles_metadata(["PMC7096066", "PMC6544235"])
+
+    assert len(calls) == 1
+    assert calls[0]["version"] == "2.0"
+    assert calls[0]["id"] == "7096066,6544235"
+    article = metadata["PMC7096066"]
+    assert article["Title"] == "Clinical course and risk factors for mortality of adult inpatients"
+    assert article["Authors"] == "Zhou F, Yu T"
+    assert article["Journal"] == "International Journal of Infectious Diseases"
+    assert article["PMCID"] == "PMC7096066"
+    assert metadata["PMC6544235"]["Authors"] == "Garcia M"
+
+
+def test_failed_batch_is_retried_not_fanned_out(monkeypatch):
+    attempts = []
+
+    def post(url, data, timeout):
+        attempts.append(data["id"])
+        if len(attempts) < pubmed_services.ESUMMARY_RETRIES:
+            raise requests.ConnectionError("reset")
+        return _Response(FIXTURE.read_bytes())
+
+    def single(pmcid):
+        raise AssertionError("per-article ESummary call")
+
+    monkeypatch.setattr(pubmed_services.requests, "post", post)
+    monkeypatch.setattr(pubmed_services, "get_article_metadata", single)
+    metadata = pubmed_services.get_articles_metadata(["PMC7096066", "PMC6544235"])
+
+    assert attempts == ["7096066,6544235"] * pubmed_services.ESUMMARY_RETRIES
+    assert set(metadata) == {"PMC7096066", "PMC6544235"}
+
+
+def test_batch_that_keeps_failing_gets_placeholders(monkeypatch):
+    def post(url, data, timeout):
+        raise requests.ConnectionError("reset")
+
+    monkeypatch.setattr(pubmed_services.requests, "post", post)
+    metadata = pubmed_services.get_articles_metadata(["PMC1", "PMC2"])
+
+    assert metadata["PMC1"]["Title"] == "PMC1"
+    assert set(metadata) == {"PMC1", "PMC2"}